@@ -0,0 +1,129 @@
+# ============================================================================
+# Benchmark: shared-memory latest-state table vs worker process count
+# ============================================================================
+#
+# Starts 1, 2, 4, ... worker processes that all write (and read back) the same
+# SharedDeviceRegistry for a fixed time, then reports total throughput and the
+# speedup over one worker. A final check reads the table from a fresh process
+# and verifies that every update landed (sum of fix_count == updates done).
+#
+#   python bench_shared_state.py                      # registry only
+#   python bench_shared_state.py --target app         # full POST /send-coordinates path
+#   python bench_shared_state.py --workers 1,2,4,8 --duration 3 --devices 64
+#   python bench_shared_state.py --devices -4         # all workers contend on 4 devices
+
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+
+def device_name(worker, i, devices):
+    # A negative device count means every worker writes the same devices (slot contention)
+    return f"d{i % -devices}" if devices < 0 else f"w{worker}-{i % devices}"
+
+
+def registry_worker(worker, path, devices, duration, start, results):
+    from shared_state import SharedDeviceRegistry
+
+    registry = SharedDeviceRegistry(path)
+    start.wait()
+    done = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        device_id = device_name(worker, done, devices)
+        registry.update({'latitude': 23.7 + done * 1e-7, 'longitude': 90.4, 'timestamp': None,
+                         'accuracy': 5.0, 'device_id': device_id})
+        registry.get(device_id)
+        done += 1
+    results.put(done)
+
+
+def app_worker(worker, path, devices, duration, start, results):
+    # Each worker is what one process of a multi-process server would be
+    os.environ['GPS_STATE_BACKEND'] = 'shared'
+    os.environ['GPS_STATE_PATH'] = path
+    os.environ['GPS_STORAGE_MODE'] = 'json'
+    import receiver_server
+    from server_logging import configure_logging
+
+    configure_logging(level=logging.WARNING)  # keep the console out of the measurement
+    receiver_server.start_write_behind()  # as in --production
+    client = receiver_server.app.test_client()
+    start.wait()
+    done = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        response = client.post('/send-coordinates', json={
+            'latitude': 23.7 + done * 1e-7, 'longitude': 90.4, 'accuracy': 5.0,
+            'device_id': device_name(worker, done, devices)})
+        assert response.status_code == 200
+        done += 1
+    receiver_server.shutdown_persistence()
+    results.put(done)
+
+
+def run(target, workers, path, devices, duration):
+    """Total operations completed by `workers` processes in `duration` seconds"""
+    context = multiprocessing.get_context('spawn')
+    start = context.Event()
+    results = context.Queue()
+    worker_fn = app_worker if target == 'app' else registry_worker
+    processes = [context.Process(target=worker_fn, args=(i, path, devices, duration, start, results))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    time.sleep(1.0 if target == 'registry' else 3.0)  # let every process import and map the table
+    start.set()
+    total = sum(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared latest-state throughput vs worker processes")
+    parser.add_argument('--target', choices=['registry', 'app'], default='registry')
+    parser.add_argument('--workers', default=None, help="comma-separated process counts (default 1,2,4,..,cpus)")
+    parser.add_argument('--duration', type=float, default=2.0, help="seconds per run")
+    parser.add_argument('--devices', type=int, default=32, help="devices written by each worker (negative: the same N devices shared by all workers)")
+    args = parser.parse_args()
+
+    cpus = os.cpu_count() or 1
+    if args.workers:
+        counts = [int(n) for n in args.workers.split(',')]
+    else:
+        counts = [1]
+        while counts[-1] * 2 <= cpus:
+            counts.append(counts[-1] * 2)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from shared_state import SharedDeviceRegistry
+
+    workdir = tempfile.mkdtemp(prefix='arc25_bench_')
+    os.chdir(workdir)  # the app target writes live_gps_coordinates.json here
+    print(f"🏁 {args.target}: {args.duration:.0f}s per run, {args.devices} devices per worker, {cpus} CPUs")
+    print(f"{'workers':>8} {'ops/s':>12} {'speedup':>8}  consistent")
+
+    baseline = None
+    for workers in counts:
+        path = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else workdir,
+                            f"arc25_bench_state_{os.getpid()}_{workers}")
+        total = run(args.target, workers, path, args.devices, args.duration)
+
+        registry = SharedDeviceRegistry(path)
+        recorded = sum(snapshot.fix_count for snapshot in registry.all().values())
+        registry.close()
+        os.unlink(path)
+
+        rate = total / args.duration
+        baseline = baseline or rate
+        print(f"{workers:>8} {rate:>12,.0f} {rate / baseline:>7.2f}x  "
+              f"{'yes' if recorded == total else f'NO ({recorded} != {total})'}")
+
+
+if __name__ == '__main__':
+    main()
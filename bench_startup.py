@@ -0,0 +1,144 @@
+# ============================================================================
+# Benchmark: viewer startup time (cold start vs restored snapshot)
+# ============================================================================
+#
+# Starts the viewer in fresh processes (so every import is cold) and times:
+#   - import:  `import mapviewer`
+#   - init:    LiveGPSMapsViewer() (state file, widgets, first snapshot paint)
+#   - window:  the main window is mapped on screen
+#   - map:     the first basemap (or error text) is visible on the canvas
+# plus which heavy modules (requests, Pillow) were loaded by then. All times
+# are from the start of the child process, in milliseconds, median of --runs.
+#   cold:      no state file; the first basemap is composed from the tile
+#              cache (offline, empty cache dir), so nothing touches the network
+#   snapshot:  a saved state with a basemap snapshot, as after a previous run
+# Needs a display (Tk); on a headless box run it under xvfb-run.
+#
+#   python bench_startup.py
+#   python bench_startup.py --runs 10 --json startup.json
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SCENARIOS = ('cold', 'snapshot')
+HEAVY_MODULES = ('requests', 'PIL.Image')
+START = (23.7465, 90.3763)
+ZOOM = 17
+
+
+def child(scenario):
+    """One viewer start; prints its timings as JSON (runs in the benchmark's subprocess)"""
+    started = time.perf_counter()
+
+    def elapsed():
+        return (time.perf_counter() - started) * 1000
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import mapviewer
+    result = {'scenario': scenario, 'import_ms': elapsed()}
+
+    app = mapviewer.LiveGPSMapsViewer()
+    result['init_ms'] = elapsed()
+    result['snapshot_shown'] = app.snapshot_photo is not None
+
+    def poll():
+        # The snapshot start maps the window during init (to size the canvas), so poll for it
+        if 'window_ms' not in result and app.root.winfo_ismapped():
+            result['window_ms'] = elapsed()
+        shown = [app.canvas.itemcget(item, 'state') == 'normal' for item in (app.basemap_item, app.hud_item)]
+        if any(shown) and 'window_ms' in result:
+            result['map_ms'] = elapsed()
+            result['error'] = app.canvas.itemcget(app.hud_item, 'text') if shown[1] else None
+            result['loaded'] = [name for name in HEAVY_MODULES if name in sys.modules]
+            print(json.dumps(result), flush=True)
+            os._exit(0)  # skip on_closing: it would save a state file over the scenario's
+        if elapsed() > 30000:
+            print(json.dumps(result), flush=True)
+            os._exit(1)
+        app.root.after(2, poll)
+
+    app.root.after(0, poll)
+    app.root.mainloop()
+
+
+def prepare(scenario, workdir):
+    """Environment of a viewer start: offline tiles in a temp dir, state file per scenario"""
+    state_file = os.path.join(workdir, 'viewer_state.json')
+    env = dict(os.environ, GPS_MAP_SOURCE='tiles', GPS_MAP_OFFLINE='1', GPS_PREFETCH='0',
+               GPS_TILE_CACHE_DIR=os.path.join(workdir, 'tiles'), GPS_VIEWER_STATE=state_file)
+    if scenario == 'snapshot':
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from PIL import Image
+        from map_overlay import BasemapView
+        from viewer_state import save_state, snapshot_info
+
+        width, height = 800, 600  # the viewer's minimum viewport
+        image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+        view = BasemapView.centered(START[0], START[1], ZOOM, width, height)
+        save_state(state_file, START[0], START[1], ZOOM, 'roadmap', 'tiles',
+                   snapshot_info(view, ('tiles', 'roadmap', ZOOM), (width, height)), image)
+    return env
+
+
+def run(scenario, runs):
+    results = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory(prefix='arc25_startup_') as workdir:
+            env = prepare(scenario, workdir)
+            process = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', scenario],
+                                     cwd=workdir, env=env, capture_output=True, text=True, timeout=60)
+        lines = process.stdout.strip().splitlines()
+        if process.returncode != 0 or not lines:
+            sys.exit(f"❌ Viewer start failed ({scenario}):\n{process.stderr.strip()}")
+        results.append(json.loads(lines[-1]))
+    return results
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the viewer's startup time")
+    parser.add_argument('--runs', type=int, default=5, help="viewer starts per scenario")
+    parser.add_argument('--scenario', choices=SCENARIOS, action='append', help="default: all")
+    parser.add_argument('--json', help="also write the results to this file")
+    parser.add_argument('--child', choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+
+    results_path = os.path.abspath(args.json) if args.json else None
+    summary = {}
+    print(f"🏁 Starting the viewer {args.runs}x per scenario (times from process start, median)")
+    for scenario in args.scenario or SCENARIOS:
+        results = run(scenario, args.runs)
+        stats = {name: median([result[name] for result in results])
+                 for name in ('import_ms', 'init_ms', 'window_ms', 'map_ms')}
+        stats['snapshot_shown'] = results[-1]['snapshot_shown']
+        stats['loaded_at_first_map'] = results[-1]['loaded']
+        stats['error'] = results[-1]['error']
+        summary[scenario] = {'median': stats, 'runs': results}
+        loaded = ", ".join(stats['loaded_at_first_map']) or "none"
+        print(f"  {scenario:<9} import={stats['import_ms']:7.1f}ms  init={stats['init_ms']:7.1f}ms  "
+              f"window={stats['window_ms']:7.1f}ms  first map={stats['map_ms']:7.1f}ms  (loaded: {loaded})")
+        if stats['error']:
+            print(f"  ⚠️ {scenario}: the first frame showed an error: {stats['error']}")
+
+    if results_path:
+        with open(results_path, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"💾 Results written to {results_path}")
+
+
+if __name__ == '__main__':
+    main()
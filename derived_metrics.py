@@ -0,0 +1,241 @@
+# ============================================================================
+# FILE 22: derived_metrics.py (Per-device speed, heading, odometer, stops)
+# ============================================================================
+#
+# Derived values are updated as fixes arrive, in O(1) per fix per device:
+#   - speed (m/s) over the last segment and its exponential moving average
+#     (time constant SPEED_AVERAGE_TAU seconds, so irregular fix rates are
+#     weighted by time, not by fix count)
+#   - heading (degrees from north) of the last segment that moved
+#   - distance (m): haversine odometer over moving segments only, so GPS
+#     jitter while parked doesn't add up
+#   - stationary_seconds: how long the device has been below
+#     STATIONARY_SPEED (0 while moving)
+# Segments use the device timestamps; fixes that are older than the last one
+# used, or have a non-finite position or time, are counted but don't change
+# the values. A fix exactly as old as the last one (a batch without device
+# timestamps shares one receive time) only moves the position.
+# recompute() produces the same values (up to float rounding) for a whole array of fixes
+# with NumPy, for replays and backfilled batches; DerivedMetrics switches
+# to it when one batch carries many fixes of one device.
+
+import math
+import threading
+import zlib
+from dataclasses import dataclass, asdict, replace
+
+import numpy as np
+
+from device_registry import DEFAULT_DEVICE_ID
+from track_log import parse_timestamp
+
+EARTH_RADIUS = 6371008.8  # metres (mean radius)
+STATIONARY_SPEED = 0.5    # m/s; slower segments count as standing still (GPS jitter)
+SPEED_AVERAGE_TAU = 10.0  # seconds
+BATCH_THRESHOLD = 32      # fixes of one device in one batch before the vectorized path pays off
+MIN_DECAY = 1e-30         # older history than this weight is negligible (keeps logs finite)
+
+
+@dataclass(frozen=True)
+class DeviceMetrics:
+    """Derived state of one device after its latest fix; never mutated after creation"""
+    device_id: str
+    latitude: float
+    longitude: float
+    time: float
+    speed: object
+    speed_avg: object
+    heading: object
+    distance: float
+    stationary_seconds: float
+    moving: bool
+    fix_count: int
+
+    def to_dict(self):
+        # NaN/inf are not valid JSON: report them as null
+        return {name: None if isinstance(value, float) and not math.isfinite(value) else value
+                for name, value in asdict(self).items()}
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres (scalars or arrays)"""
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    a = (np.sin((phi2 - phi1) / 2) ** 2
+         + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def bearing(lat1, lon1, lat2, lon2):
+    """Initial bearing in degrees clockwise from north (scalars or arrays)"""
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dlon = np.radians(lon2 - lon1)
+    y = np.sin(dlon) * np.cos(phi2)
+    x = np.cos(phi1) * np.sin(phi2) - np.sin(phi1) * np.cos(phi2) * np.cos(dlon)
+    return np.degrees(np.arctan2(y, x)) % 360
+
+
+def fix_time(fix):
+    """Epoch seconds of a fix: device timestamp, else the server receive time"""
+    t = parse_timestamp(fix.get('timestamp'))
+    if t != t:
+        t = fix.get('server_received_at')
+    return float('nan') if t is None else float(t)
+
+
+def step(state, lat, lon, t):
+    """Advance one device's state (a DeviceMetrics) by one fix; returns the new state"""
+    count = state.fix_count + 1
+    usable = math.isfinite(lat) and math.isfinite(lon) and math.isfinite(t)
+    if not usable or (state.time is not None and t < state.time):
+        return replace(state, fix_count=count)  # no position or time, or out of order
+    if state.time is None:
+        return DeviceMetrics(state.device_id, lat, lon, t, None, None, None, 0.0, 0.0, False, count)
+    if t == state.time:
+        return replace(state, latitude=lat, longitude=lon, fix_count=count)  # no time has passed
+
+    dt = t - state.time
+    d = float(haversine(state.latitude, state.longitude, lat, lon))
+    speed = d / dt
+    moving = speed >= STATIONARY_SPEED
+    decay = max(math.exp(-dt / SPEED_AVERAGE_TAU), MIN_DECAY)
+    speed_avg = speed if state.speed_avg is None else state.speed_avg * decay + speed * (1 - decay)
+    if moving:
+        heading = float(bearing(state.latitude, state.longitude, lat, lon))
+        distance, stationary = state.distance + d, 0.0
+    else:
+        heading = state.heading
+        distance, stationary = state.distance, state.stationary_seconds + dt
+    return DeviceMetrics(state.device_id, lat, lon, t, speed, speed_avg, heading, distance, stationary,
+                         moving, count)
+
+
+def _forward_fill(values, initial):
+    """Replace NaNs with the last non-NaN value before them (initial before the first)"""
+    valid = ~np.isnan(values)
+    index = np.maximum.accumulate(np.where(valid, np.arange(len(values)), -1))
+    return np.where(index >= 0, values[np.maximum(index, 0)], initial)
+
+
+def _ema(values, decays, initial):
+    """y[i] = decays[i] * y[i-1] + (1 - decays[i]) * values[i], y[-1] = initial, vectorized"""
+    out = np.empty(len(values))
+    logs = np.cumsum(np.log(decays))
+    start, y, log_before = 0, initial, 0.0
+    while start < len(values):
+        # Chunks span at most e^600 of decay, so the rescaled sums stay finite
+        end = max(int(np.searchsorted(-logs, -log_before + 600, side='right')), start + 1)
+        rel = logs[start:end] - log_before
+        weighted = (1 - decays[start:end]) * values[start:end] * np.exp(-rel)
+        out[start:end] = np.exp(rel) * (y + np.cumsum(weighted))
+        y, log_before, start = out[end - 1], logs[end - 1], end
+    return out
+
+
+def recompute(lats, lons, times, state):
+    """
+    Vectorized equivalent of calling step() for every fix in order. Returns
+    (series, final_state): series holds one value per input fix for speed,
+    speed_avg, heading, distance, stationary_seconds and moving (NaN/False
+    for fixes that were skipped, only moved the position or started the track).
+    """
+    lats, lons, times = (np.asarray(a, dtype=float) for a in (lats, lons, times))
+    n = len(times)
+    count = state.fix_count + n
+    series = {name: np.full(n, np.nan) for name in ('speed', 'speed_avg', 'heading', 'distance',
+                                                     'stationary_seconds')}
+    series['moving'] = np.zeros(n, dtype=bool)
+
+    # A fix is accepted if it is finite and not older than any fix before it (and the
+    # state's last one); it starts a segment if it is newer, else it only moves the position
+    valid = np.isfinite(lats) & np.isfinite(lons) & np.isfinite(times)
+    finite = np.where(valid, times, -np.inf)
+    previous_max = np.maximum.accumulate(np.concatenate(([-np.inf if state.time is None else state.time],
+                                                         finite[:-1])))
+    accepted = np.flatnonzero(valid & (times >= previous_max))
+    if state.time is None and len(accepted):
+        first = accepted[0]
+        state = DeviceMetrics(state.device_id, float(lats[first]), float(lons[first]), float(times[first]),
+                              None, None, None, 0.0, 0.0, False, state.fix_count)
+        accepted = accepted[1:]
+    if not len(accepted):
+        return series, replace(state, fix_count=count)
+
+    a_lats, a_lons, a_times = lats[accepted], lons[accepted], times[accepted]
+    a_prev_times = np.concatenate(([state.time], a_times[:-1]))
+    segments = np.flatnonzero(a_times > a_prev_times)
+    if not len(segments):
+        return series, replace(state, latitude=float(a_lats[-1]), longitude=float(a_lons[-1]), fix_count=count)
+
+    used = accepted[segments]
+    k_lats, k_lons, k_times = a_lats[segments], a_lons[segments], a_times[segments]
+    prev_lats = np.concatenate(([state.latitude], a_lats[:-1]))[segments]
+    prev_lons = np.concatenate(([state.longitude], a_lons[:-1]))[segments]
+    dt = k_times - a_prev_times[segments]
+    d = haversine(prev_lats, prev_lons, k_lats, k_lons)
+    speed = d / dt
+    moving = speed >= STATIONARY_SPEED
+
+    distance = state.distance + np.cumsum(np.where(moving, d, 0.0))
+    heading = _forward_fill(np.where(moving, bearing(prev_lats, prev_lons, k_lats, k_lons), np.nan),
+                            np.nan if state.heading is None else state.heading)
+    still = np.cumsum(np.where(moving, 0.0, dt))
+    stationary = still - _forward_fill(np.where(moving, still, np.nan), -state.stationary_seconds)
+    decays = np.maximum(np.exp(-dt / SPEED_AVERAGE_TAU), MIN_DECAY)
+    speed_avg = _ema(speed, decays, speed[0] if state.speed_avg is None else state.speed_avg)
+
+    for name, values in (('speed', speed), ('speed_avg', speed_avg), ('heading', heading),
+                         ('distance', distance), ('stationary_seconds', stationary), ('moving', moving)):
+        series[name][used] = values
+    final = DeviceMetrics(state.device_id, float(a_lats[-1]), float(a_lons[-1]), float(k_times[-1]),
+                          float(speed[-1]), float(speed_avg[-1]),
+                          None if np.isnan(heading[-1]) else float(heading[-1]),
+                          float(distance[-1]), float(stationary[-1]), bool(moving[-1]), count)
+    return series, final
+
+
+def initial_metrics(device_id):
+    return DeviceMetrics(device_id, None, None, None, None, None, None, 0.0, 0.0, False, 0)
+
+
+class DerivedMetrics:
+    """device_id -> DeviceMetrics, updated on ingest; reads never lock"""
+
+    def __init__(self, lock_stripes=64):
+        self._metrics = {}
+        self._locks = [threading.Lock() for _ in range(lock_stripes)]
+
+    def _lock_for(self, device_id):
+        return self._locks[zlib.crc32(device_id.encode('utf-8')) % len(self._locks)]
+
+    def update(self, fix):
+        return self.update_many([fix])[0]
+
+    def update_many(self, fixes):
+        """Apply fixes in order; returns the new DeviceMetrics of every device in the batch"""
+        per_device = {}
+        for fix in fixes:
+            per_device.setdefault(fix.get('device_id') or DEFAULT_DEVICE_ID, []).append(fix)
+
+        updated = []
+        for device_id, device_fixes in per_device.items():
+            with self._lock_for(device_id):
+                state = self._metrics.get(device_id) or initial_metrics(device_id)
+                if len(device_fixes) >= BATCH_THRESHOLD:
+                    _, state = recompute([fix['latitude'] for fix in device_fixes],
+                                         [fix['longitude'] for fix in device_fixes],
+                                         [fix_time(fix) for fix in device_fixes], state)
+                else:
+                    for fix in device_fixes:
+                        state = step(state, float(fix['latitude']), float(fix['longitude']), fix_time(fix))
+                self._metrics[device_id] = state
+            updated.append(state)
+        return updated
+
+    def get(self, device_id):
+        return self._metrics.get(device_id)
+
+    def all(self):
+        return self._metrics.copy()
+
+    def __len__(self):
+        return len(self._metrics)
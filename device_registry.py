@@ -0,0 +1,91 @@
+# ============================================================================
+# FILE 4: device_registry.py (Per-device latest state for a fleet of rovers)
+# ============================================================================
+#
+# Each device's latest fix is kept as an immutable snapshot. Writers build a
+# new snapshot and swap it into the table with a single dict assignment, so
+# readers never take a lock and never see a lat from one fix mixed with a lon
+# from another. Writers only serialize per device (striped locks), so ingest
+# for hundreds of devices is not funnelled through one global lock.
+
+import threading
+import time
+import zlib
+from dataclasses import dataclass, asdict
+
+DEFAULT_DEVICE_ID = 'default'
+MAX_DEVICE_ID_BYTES = 16  # matches the track log record layout
+
+
+@dataclass(frozen=True)
+class DeviceSnapshot:
+    """Latest known state of one device; never mutated after creation"""
+    device_id: str
+    latitude: float
+    longitude: float
+    timestamp: str
+    accuracy: object
+    received_at: float
+    fix_count: int
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class DeviceRegistry:
+    """device_id -> DeviceSnapshot table with lock-free reads"""
+
+    def __init__(self, lock_stripes=64):
+        self._snapshots = {}
+        self._latest = None
+        self._locks = [threading.Lock() for _ in range(lock_stripes)]
+
+    def _lock_for(self, device_id):
+        return self._locks[zlib.crc32(device_id.encode('utf-8')) % len(self._locks)]
+
+    def update(self, fix):
+        """Swap in a new snapshot for the fix's device; returns the snapshot"""
+        return self.update_many([fix])[0]
+
+    def update_many(self, fixes):
+        """Apply a batch: one snapshot swap per device, from its last fix"""
+        last_per_device = {}
+        counts = {}
+        for fix in fixes:
+            device_id = fix.get('device_id') or DEFAULT_DEVICE_ID
+            last_per_device[device_id] = fix
+            counts[device_id] = counts.get(device_id, 0) + 1
+
+        snapshots = []
+        now = time.time()
+        for device_id, fix in last_per_device.items():
+            with self._lock_for(device_id):
+                previous = self._snapshots.get(device_id)
+                snapshot = DeviceSnapshot(
+                    device_id=device_id,
+                    latitude=fix['latitude'],
+                    longitude=fix['longitude'],
+                    timestamp=fix['timestamp'],
+                    accuracy=fix.get('accuracy'),
+                    received_at=now,
+                    fix_count=(previous.fix_count if previous else 0) + counts[device_id]
+                )
+                self._snapshots[device_id] = snapshot
+            snapshots.append(snapshot)
+
+        if snapshots:
+            self._latest = snapshots[-1]
+        return snapshots
+
+    def get(self, device_id=None):
+        """Snapshot for one device, or the most recently updated device if None"""
+        if device_id is None:
+            return self._latest
+        return self._snapshots.get(device_id)
+
+    def all(self):
+        """Consistent copy of every device's snapshot (dict.copy is atomic)"""
+        return self._snapshots.copy()
+
+    def __len__(self):
+        return len(self._snapshots)
@@ -0,0 +1,135 @@
+# ============================================================================
+# FILE 6: file_watcher.py (Event-driven change detection for the GPS file)
+# ============================================================================
+#
+# On Linux the watcher uses inotify on the file's directory (the server
+# replaces the file with a rename, so the inode changes on every write).
+# Elsewhere it falls back to comparing (inode, size, mtime) signatures.
+# Either way a change is only reported when the stat signature really
+# differs, so consumers only re-parse the file when its content changed.
+#
+# Changes are counted in `version`; every consumer remembers the last
+# version it handled, which lets several consumers share one watcher.
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class FileWatcher:
+    """Watch one file; `version` increases every time its content changes"""
+
+    def __init__(self, path, stat_interval=0.5):
+        self.path = os.path.abspath(path)
+        self.name = os.path.basename(self.path).encode()
+        self.stat_interval = stat_interval  # polling period of the fallback backend
+        self.version = 0
+        self.lock = threading.Lock()
+        self.inotify_fd = None
+        self.backend = 'stat'
+
+        if sys.platform.startswith('linux'):
+            self._init_inotify()
+
+        self.signature = self._stat()
+
+    def _init_inotify(self):
+        """Set up an inotify watch on the file's directory; keeps the stat backend on failure"""
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                return
+            directory = os.path.dirname(self.path).encode()
+            if libc.inotify_add_watch(fd, directory, WATCH_MASK) < 0:
+                os.close(fd)
+                return
+            self.inotify_fd = fd
+            self.backend = 'inotify'
+        except (OSError, AttributeError):
+            pass
+
+    def _stat(self):
+        """(inode, size, mtime_ns) of the file, or None if it does not exist"""
+        try:
+            st = os.stat(self.path)
+            return (st.st_ino, st.st_size, st.st_mtime_ns)
+        except OSError:
+            return None
+
+    def _drain_events(self):
+        """Read pending inotify events; True if any of them concern our file"""
+        relevant = False
+        while True:
+            try:
+                buffer = os.read(self.inotify_fd, 4096)
+            except BlockingIOError:
+                return relevant
+            offset = 0
+            while offset < len(buffer):
+                _, _, _, name_len = EVENT_HEADER.unpack_from(buffer, offset)
+                offset += EVENT_HEADER.size
+                name = buffer[offset:offset + name_len].rstrip(b'\0')
+                offset += name_len
+                if name == self.name:
+                    relevant = True
+
+    def _refresh(self):
+        """Re-stat the file and bump the version if the signature changed"""
+        signature = self._stat()
+        if signature != self.signature:
+            self.signature = signature
+            self.version += 1
+
+    def exists(self):
+        """Whether the file existed at the last check (no syscall)"""
+        return self.signature is not None
+
+    def check(self, timeout=0):
+        """Wait up to `timeout` seconds for a change; returns the current version"""
+        if self.backend == 'inotify':
+            readable, _, _ = select.select([self.inotify_fd], [], [], timeout)
+            if readable:
+                with self.lock:
+                    if self._drain_events():
+                        self._refresh()
+        else:
+            if timeout:
+                time.sleep(timeout)
+            with self.lock:
+                self._refresh()
+        return self.version
+
+    def wait(self, since_version, timeout):
+        """Block until version > since_version or `timeout` seconds pass; returns the version"""
+        deadline = time.monotonic() + timeout
+        while self.version <= since_version:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            step = remaining if self.backend == 'inotify' else min(remaining, self.stat_interval)
+            self.check(step)
+        return self.version
+
+    def close(self):
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
+            self.backend = 'stat'
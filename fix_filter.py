@@ -0,0 +1,139 @@
+# ============================================================================
+# FILE 25: fix_filter.py (Accuracy-weighted Kalman filter for GPS fixes)
+# ============================================================================
+#
+# Raw fixes jitter by their accuracy radius, so a parked rover used to look
+# like it was moving (and a real small move on a precise fix could fall
+# under the fixed 0.00001 degree threshold). Each device's fixes go through a
+# constant-velocity Kalman filter in local metres instead:
+#   - a fix's reported accuracy is its measurement noise, so a 3 m fix pulls
+#     the estimate far more than a 30 m one (DEFAULT_ACCURACY when missing)
+#   - a fix whose innovation is improbable for that noise (Mahalanobis gate,
+#     chi-square with 2 degrees of freedom) is rejected as an outlier; after
+#     MAX_REJECTIONS in a row the filter accepts that the rover really is
+#     over there and restarts from the latest fix
+# East and north share the same motion model and noise, so one 2x2
+# covariance serves both axes and an update is a handful of float ops.
+# should_redraw() then decides whether the filtered state differs visibly
+# (by a pixel or more at the current zoom) from what is on screen.
+
+import math
+
+from derived_metrics import EARTH_RADIUS, fix_time
+from web_mercator import meters_per_pixel
+
+DEFAULT_ACCURACY = 10.0   # metres, for fixes that don't report one
+MIN_ACCURACY = 1.0        # metres; no fix is trusted more than this
+ACCELERATION_NOISE = 0.1  # m/s^2 (process noise), how quickly a slow rover changes velocity
+GATE = 13.8               # chi-square (2 dof) at 99.9 %: beyond this a fix is an outlier
+MAX_REJECTIONS = 5        # consecutive outliers before restarting from the latest fix
+MAX_GAP = 60.0            # seconds without fixes after which the filter restarts
+
+
+class FilteredFix:
+    """Filter output: position, 1-sigma uncertainty (m), and whether the fix was used"""
+
+    def __init__(self, lat, lon, accuracy, accepted):
+        self.lat = lat
+        self.lon = lon
+        self.accuracy = accuracy
+        self.accepted = accepted
+
+
+class FixFilter:
+    """Constant-velocity Kalman filter of one device's fixes"""
+
+    def __init__(self, acceleration_noise=ACCELERATION_NOISE, gate=GATE, max_rejections=MAX_REJECTIONS):
+        self.acceleration_noise = acceleration_noise
+        self.gate = gate
+        self.max_rejections = max_rejections
+        self.lat = None
+        self.lon = None
+        self.time = None
+        self.east_velocity = 0.0
+        self.north_velocity = 0.0
+        self.covariance = None  # [[p_pos, p_cross], [p_cross, p_vel]], the same for both axes
+        self.rejections = 0
+        self.counts = {'accepted': 0, 'outliers': 0, 'restarts': 0}
+
+    def reset(self, lat, lon, variance, t):
+        self.lat, self.lon, self.time = lat, lon, t
+        self.east_velocity = self.north_velocity = 0.0
+        self.covariance = [[variance, 0.0], [0.0, 25.0]]  # velocity unknown: sigma 5 m/s
+        self.rejections = 0
+
+    def update(self, lat, lon, accuracy=None, t=None):
+        """Feed one fix (t in epoch seconds, None/NaN = unknown); returns a FilteredFix"""
+        accuracy = max(float(accuracy), MIN_ACCURACY) if accuracy else DEFAULT_ACCURACY
+        variance = accuracy * accuracy
+        if t is not None and t != t:
+            t = None
+
+        if self.covariance is None or (t is not None and self.time is not None and t - self.time > MAX_GAP):
+            if self.covariance is not None:
+                self.counts['restarts'] += 1
+            self.reset(lat, lon, variance, t)
+            self.counts['accepted'] += 1
+            return FilteredFix(lat, lon, accuracy, True)
+
+        # Predict: move on at the estimated velocity, uncertainty grows with dt
+        dt = t - self.time if t is not None and self.time is not None and t > self.time else 0.0
+        (p00, p01), (_, p11) = self.covariance
+        q = self.acceleration_noise ** 2
+        p00 += dt * (2 * p01 + dt * p11) + q * dt ** 3 / 3
+        p01 += dt * p11 + q * dt ** 2 / 2
+        p11 += q * dt
+        cos_lat = math.cos(math.radians(self.lat))
+        predicted_east = self.east_velocity * dt
+        predicted_north = self.north_velocity * dt
+
+        # Innovation in local metres relative to the last estimate
+        east = math.radians(lon - self.lon) * EARTH_RADIUS * cos_lat - predicted_east
+        north = math.radians(lat - self.lat) * EARTH_RADIUS - predicted_north
+        s = p00 + variance
+        if (east * east + north * north) / s > self.gate:
+            self.rejections += 1
+            self.counts['outliers'] += 1
+            if self.rejections >= self.max_rejections:
+                self.counts['restarts'] += 1
+                self.reset(lat, lon, variance, t)
+                return FilteredFix(lat, lon, accuracy, True)
+            return FilteredFix(self.lat, self.lon, math.sqrt(self.covariance[0][0]), False)
+
+        # Correct
+        gain_position, gain_velocity = p00 / s, p01 / s
+        east_offset = predicted_east + gain_position * east
+        north_offset = predicted_north + gain_position * north
+        self.east_velocity += gain_velocity * east
+        self.north_velocity += gain_velocity * north
+        self.covariance = [[(1 - gain_position) * p00, (1 - gain_position) * p01],
+                           [(1 - gain_position) * p01, p11 - gain_velocity * p01]]
+        self.lat += math.degrees(north_offset / EARTH_RADIUS)
+        self.lon += math.degrees(east_offset / (EARTH_RADIUS * cos_lat))
+        if t is not None:
+            self.time = t
+        self.rejections = 0
+        self.counts['accepted'] += 1
+        return FilteredFix(self.lat, self.lon, math.sqrt(self.covariance[0][0]), True)
+
+    def update_fix(self, fix):
+        """update() with a fix dict"""
+        return self.update(float(fix['latitude']), float(fix['longitude']), fix.get('accuracy'), fix_time(fix))
+
+
+def should_redraw(shown_lat, shown_lon, shown_accuracy, lat, lon, accuracy, zoom, min_pixels=1.0):
+    """
+    Whether a new position/accuracy differs visibly from what is on screen:
+    the marker moves by min_pixels or more at `zoom`, or the accuracy circle's
+    radius changes by that much (or appears/disappears).
+    """
+    if shown_lat is None:
+        return True
+    pixel = meters_per_pixel(lat, zoom) * min_pixels
+    dy = math.radians(lat - shown_lat) * EARTH_RADIUS
+    dx = math.radians(lon - shown_lon) * EARTH_RADIUS * math.cos(math.radians(lat))
+    if dx * dx + dy * dy >= pixel * pixel:
+        return True
+    if bool(shown_accuracy) != bool(accuracy):
+        return True
+    return bool(accuracy) and abs(float(accuracy) - float(shown_accuracy)) >= pixel
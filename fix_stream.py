@@ -0,0 +1,61 @@
+# ============================================================================
+# FILE 5: fix_stream.py (In-memory fan-out of fixes with a sequence cursor)
+# ============================================================================
+#
+# Every accepted fix is published with a monotonically increasing sequence
+# number. Subscribers (SSE clients, long-poll requests) remember the last
+# sequence they saw and block until something newer arrives, so they wake up
+# as soon as data comes in instead of polling. A cursor ahead of the stream
+# comes from before a server restart (sequence numbers start again at 1):
+# it is treated as 0, so the subscriber gets everything since the restart.
+
+import threading
+from collections import deque
+from itertools import islice
+
+
+class FixStream:
+    """Bounded ring of recent events; waiters are woken on publish"""
+
+    def __init__(self, capacity=10000):
+        self._events = deque(maxlen=capacity)
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    @property
+    def last_seq(self):
+        return self._seq
+
+    def publish(self, fixes, event='fix'):
+        """Append fixes to the stream; returns the last sequence number assigned"""
+        with self._cond:
+            for fix in fixes:
+                self._seq += 1
+                self._events.append((self._seq, event, dict(fix, seq=self._seq)))
+            self._cond.notify_all()
+            return self._seq
+
+    def since(self, after):
+        """
+        Events with seq > after, oldest first.
+        Returns (events, missed) where missed is True if older events were
+        already dropped from the ring and the subscriber skipped some, or if
+        the cursor is from before a server restart.
+        """
+        with self._cond:
+            restarted = after > self._seq
+            if restarted:
+                after = 0
+            if not self._events or after >= self._seq:
+                return [], restarted
+            first_seq = self._events[0][0]
+            missed = restarted or after + 1 < first_seq
+            start = max(after + 1 - first_seq, 0)
+            return list(islice(self._events, start, None)), missed
+
+    def wait(self, after, timeout):
+        """Block until there is an event newer than `after` (or timeout), then return since(after)"""
+        with self._cond:
+            if after <= self._seq:
+                self._cond.wait_for(lambda: self._seq > after, timeout)
+        return self.since(after)
@@ -0,0 +1,78 @@
+# ============================================================================
+# FILE 26: fleet_view.py (Per-device display state for the multi-device viewer)
+# ============================================================================
+#
+# The viewer keeps one DeviceTrack per device: its filtered position, its
+# own track history and fix filter, a colour and the canvas layer (a
+# MapOverlay) it is drawn with. All layers are drawn over the same basemap
+# in one overlay pass per frame, so N devices still cost one basemap fetch.
+# fit_zoom/bounds_center size and centre the shared viewport so that every
+# device is in view ("fit all").
+
+import math
+
+import numpy as np
+
+from fix_filter import FixFilter
+from track_history import TrackHistory
+from web_mercator import latlon_to_world, world_to_latlon
+
+# First colour matches the single-device overlay (blue path); the rest are easy to tell apart
+PALETTE = ['#1a57e6', '#dc0000', '#1e9e3a', '#8e44ad', '#e67e00', '#00a3a3', '#c2185b', '#6d4c41']
+FRESH_SECONDS = 10   # a fix newer than this is live
+STALE_SECONDS = 60   # older than this the device is considered lost
+MAX_FIT_ZOOM = 18
+
+
+class DeviceTrack:
+    """Display state of one device (written by the GPS thread, drawn by the Tk thread)"""
+
+    def __init__(self, device_id, color):
+        self.device_id = device_id
+        self.color = color
+        self.latitude = None
+        self.longitude = None
+        self.accuracy = None
+        self.last_update = None
+        self.last_fix_at = 0
+        self.shown = None  # (latitude, longitude, accuracy) when the map was last redrawn for it
+        self.history = TrackHistory()
+        self.fix_filter = FixFilter()
+        self.layer = None  # MapOverlay, created on the Tk thread when first drawn
+
+
+def staleness(last_fix_at, now):
+    """(indicator, text) for how long ago a device's last fix arrived"""
+    if not last_fix_at:
+        return '⚪', "no fix"
+    age = max(now - last_fix_at, 0)
+    indicator = '🟢' if age < FRESH_SECONDS else '🟡' if age < STALE_SECONDS else '🔴'
+    if age < 60:
+        return indicator, f"{age:.0f}s ago"
+    if age < 3600:
+        return indicator, f"{age // 60:.0f}m ago"
+    return indicator, f"{age // 3600:.0f}h ago"
+
+
+def bounds_center(lats, lons):
+    """Centre of the points' bounding box (in Web Mercator, as the map shows it)"""
+    xs, ys = latlon_to_world(np.asarray(lats, dtype=float), np.asarray(lons, dtype=float), 0)
+    lat, lon = world_to_latlon((xs.min() + xs.max()) / 2, (ys.min() + ys.max()) / 2, 0)
+    return float(lat), float(lon)
+
+
+def fit_zoom(lats, lons, width, height, padding=0.25, max_zoom=MAX_FIT_ZOOM):
+    """
+    Highest zoom at which all points fit in a width x height viewport,
+    keeping `padding` of each dimension clear on every side.
+    """
+    xs, ys = latlon_to_world(np.asarray(lats, dtype=float), np.asarray(lons, dtype=float), 0)
+    span_x, span_y = float(xs.max() - xs.min()), float(ys.max() - ys.min())
+    usable = 1 - 2 * padding
+    zoom = max_zoom
+    for span, size in ((span_x, width), (span_y, height)):
+        if span > 0:
+            # World pixels double with every zoom level
+            zoom = min(zoom, math.floor(math.log2(size * usable / span)))
+    return int(min(max(zoom, 1), max_zoom))
+
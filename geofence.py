@@ -0,0 +1,293 @@
+# ============================================================================
+# FILE 24: geofence.py (Grid-indexed geofences with enter/exit alerts)
+# ============================================================================
+#
+# Fences are polygons (holes and multi-polygons allowed) and circles, loaded
+# from a GeoJSON FeatureCollection. Each has a kind:
+#   keep_in   (e.g. the competition arena): leaving it is a violation
+#   keep_out  (e.g. a hazard zone): entering it is a violation
+# Fence bounding boxes are bucketed into a uniform lat/lon grid, so a fix is
+# only tested against the fences of its own cell (plus the few fences too big
+# to bucket). A batch of fixes is tested fence by fence with NumPy, and
+# per-device enter/exit transitions fall out of comparing consecutive rows
+# of the inside matrix. A device's first fix is compared against the expected
+# state (inside every keep_in fence, outside every keep_out one), so a rover
+# that starts outside the arena raises an alert right away.
+#
+# Fence file (GeoJSON, [longitude, latitude] order):
+#   {"type": "FeatureCollection", "features": [
+#     {"type": "Feature", "properties": {"id": "arena", "name": "Arena", "kind": "keep_in"},
+#      "geometry": {"type": "Polygon", "coordinates": [[[90.37, 23.74], ...]]}},
+#     {"type": "Feature", "properties": {"id": "pit", "kind": "keep_out", "radius": 15},
+#      "geometry": {"type": "Point", "coordinates": [90.376, 23.746]}}]}
+#
+#   python geofence.py check fences.geojson --lat 23.7465 --lon 90.3763
+
+import argparse
+import json
+import math
+import threading
+from collections import deque
+
+import numpy as np
+
+from derived_metrics import EARTH_RADIUS, haversine
+from device_registry import DEFAULT_DEVICE_ID
+
+KEEP_IN = 'keep_in'
+KEEP_OUT = 'keep_out'
+KINDS = (KEEP_IN, KEEP_OUT)
+DEFAULT_CELL_SIZE = 0.01  # degrees (~1 km); a few hazard zones per cell at most
+MAX_CELLS_PER_FENCE = 4096  # larger fences are tested for every fix instead of being bucketed
+
+
+class Fence:
+    """A named area; contains() tests arrays of points"""
+
+    shape = None
+
+    def __init__(self, fence_id, name, kind):
+        if kind not in KINDS:
+            raise ValueError(f"fence {fence_id}: kind must be one of {', '.join(KINDS)}")
+        self.id = fence_id
+        self.name = name or fence_id
+        self.kind = kind
+        self.bbox = None  # (south, west, north, east)
+
+    def is_violation(self, inside):
+        return inside != (self.kind == KEEP_IN)
+
+    def to_dict(self):
+        return {'id': self.id, 'name': self.name, 'kind': self.kind, 'shape': self.shape,
+                'bbox': list(self.bbox)}
+
+
+class PolygonFence(Fence):
+    """Even-odd rule over all rings, so holes and disjoint parts just work"""
+
+    shape = 'polygon'
+
+    def __init__(self, fence_id, name, kind, rings):
+        super().__init__(fence_id, name, kind)
+        self.rings = [np.asarray(ring, dtype=float) for ring in rings]  # (lat, lon) rows
+        if not self.rings or any(len(ring) < 3 for ring in self.rings):
+            raise ValueError(f"fence {fence_id}: polygon rings need at least 3 points")
+        starts = np.concatenate(self.rings)
+        ends = np.concatenate([np.roll(ring, -1, axis=0) for ring in self.rings])
+        self.lat0, self.lon0 = starts[:, 0], starts[:, 1]
+        self.lat1 = ends[:, 0]
+        dlat = self.lat1 - self.lat0
+        # Longitude change per degree of latitude along each edge (horizontal edges never cross)
+        self.slope = np.divide(ends[:, 1] - self.lon0, dlat, out=np.zeros_like(dlat), where=dlat != 0)
+        self.bbox = (float(starts[:, 0].min()), float(starts[:, 1].min()),
+                     float(starts[:, 0].max()), float(starts[:, 1].max()))
+
+    def contains(self, lats, lons):
+        lats, lons = lats[:, None], lons[:, None]
+        crosses = ((self.lat0 > lats) != (self.lat1 > lats)) & (
+            lons < self.lon0 + (lats - self.lat0) * self.slope)
+        return np.count_nonzero(crosses, axis=1) % 2 == 1
+
+
+class CircleFence(Fence):
+    shape = 'circle'
+
+    def __init__(self, fence_id, name, kind, lat, lon, radius):
+        super().__init__(fence_id, name, kind)
+        if not radius or radius <= 0:
+            raise ValueError(f"fence {fence_id}: circles need a positive radius (metres)")
+        self.lat, self.lon, self.radius = float(lat), float(lon), float(radius)
+        dlat = math.degrees(self.radius / EARTH_RADIUS)
+        dlon = dlat / max(math.cos(math.radians(self.lat)), 1e-6)
+        self.bbox = (self.lat - dlat, self.lon - dlon, self.lat + dlat, self.lon + dlon)
+
+    def contains(self, lats, lons):
+        return haversine(self.lat, self.lon, lats, lons) <= self.radius
+
+
+def fence_from_feature(feature, number):
+    """One GeoJSON feature -> Fence"""
+    properties = feature.get('properties') or {}
+    geometry = feature.get('geometry') or {}
+    fence_id = str(properties.get('id', feature.get('id', f"fence-{number}")))
+    name = properties.get('name')
+    kind = properties.get('kind', KEEP_OUT)
+    kind_of_geometry = geometry.get('type')
+    coordinates = geometry.get('coordinates')
+
+    def latlon(ring):
+        return [(point[1], point[0]) for point in ring]
+
+    if kind_of_geometry == 'Polygon':
+        return PolygonFence(fence_id, name, kind, [latlon(ring) for ring in coordinates])
+    if kind_of_geometry == 'MultiPolygon':
+        return PolygonFence(fence_id, name, kind, [latlon(ring) for polygon in coordinates for ring in polygon])
+    if kind_of_geometry == 'Point':
+        return CircleFence(fence_id, name, kind, coordinates[1], coordinates[0], properties.get('radius'))
+    raise ValueError(f"fence {fence_id}: unsupported geometry {kind_of_geometry!r}")
+
+
+def load_fences(path):
+    """Fences of a GeoJSON FeatureCollection file"""
+    with open(path, 'r') as f:
+        collection = json.load(f)
+    fences = [fence_from_feature(feature, number)
+              for number, feature in enumerate(collection.get('features', []))]
+    ids = [fence.id for fence in fences]
+    if len(set(ids)) != len(ids):
+        raise ValueError("fence ids must be unique")
+    return fences
+
+
+class FenceGrid:
+    """Uniform grid over fence bounding boxes: cell -> fences that may contain its points"""
+
+    def __init__(self, fences, cell_size=DEFAULT_CELL_SIZE, max_cells=MAX_CELLS_PER_FENCE):
+        self.fences = fences
+        self.cell_size = cell_size
+        self.cells = {}
+        self.everywhere = []  # fences spanning more than max_cells cells
+        for number, fence in enumerate(fences):
+            south, west, north, east = fence.bbox
+            rows = range(math.floor(south / cell_size), math.floor(north / cell_size) + 1)
+            columns = range(math.floor(west / cell_size), math.floor(east / cell_size) + 1)
+            if len(rows) * len(columns) > max_cells:
+                self.everywhere.append(number)
+                continue
+            for row in rows:
+                for column in columns:
+                    self.cells.setdefault((row, column), []).append(number)
+        self.cells = {cell: np.array(numbers) for cell, numbers in self.cells.items()}
+        self.everywhere = np.array(self.everywhere, dtype=np.intp)
+
+    def contains(self, lats, lons):
+        """
+        (inside, tests): inside is an (n fixes, n fences) bool matrix, tests
+        the number of point-in-fence tests that were needed to fill it.
+        """
+        inside = np.zeros((len(lats), len(self.fences)), dtype=bool)
+        candidates = {}  # fence -> fix indices
+        rows = np.floor(lats / self.cell_size).astype(np.int64)
+        columns = np.floor(lons / self.cell_size).astype(np.int64)
+        if len(lats) == 1:
+            # Single fix (the usual HTTP/UDP ingest): no grouping needed
+            for number in self.cells.get((int(rows[0]), int(columns[0])), ()):
+                candidates[int(number)] = [np.zeros(1, dtype=np.intp)]
+        else:
+            # Group fixes by cell: one lookup per occupied cell
+            keys = (rows << 32) | (columns & 0xFFFFFFFF)
+            cells, of_fix = np.unique(keys, return_inverse=True)
+            order = np.argsort(of_fix, kind='stable')
+            groups = np.split(order, np.cumsum(np.bincount(of_fix, minlength=len(cells)))[:-1])
+            for row, column, fixes in zip(cells >> 32, (cells & 0xFFFFFFFF).astype(np.int32), groups):
+                for number in self.cells.get((int(row), int(column)), ()):
+                    candidates.setdefault(int(number), []).append(fixes)
+        everything = np.arange(len(lats))
+        for number in self.everywhere:
+            candidates[int(number)] = [everything]
+
+        tests = 0
+        for number, parts in candidates.items():
+            fixes = np.concatenate(parts) if len(parts) > 1 else parts[0]
+            inside[fixes, number] = self.fences[number].contains(lats[fixes], lons[fixes])
+            tests += len(fixes)
+        return inside, tests
+
+
+class GeofenceEngine:
+    """Per-device inside/outside state of every fence, advanced by batches of fixes"""
+
+    def __init__(self, fences, cell_size=DEFAULT_CELL_SIZE, max_alerts=1000):
+        self.fences = fences
+        self.grid = FenceGrid(fences, cell_size)
+        self.expected = np.array([fence.kind == KEEP_IN for fence in fences], dtype=bool)
+        self.inside = {}  # device_id -> bool array, one entry per fence
+        self.recent = deque(maxlen=max_alerts)
+        self.lock = threading.Lock()
+        self.counts = {'fixes': 0, 'tests': 0, 'alerts': 0, 'violations': 0}
+
+    def process(self, fixes):
+        """Advance device state by fixes (in order); returns the alerts they caused, oldest first"""
+        if not fixes or not self.fences:
+            return []
+        lats = np.array([fix['latitude'] for fix in fixes], dtype=float)
+        lons = np.array([fix['longitude'] for fix in fixes], dtype=float)
+        inside, tests = self.grid.contains(lats, lons)
+
+        per_device = {}
+        for index, fix in enumerate(fixes):
+            per_device.setdefault(fix.get('device_id') or DEFAULT_DEVICE_ID, []).append(index)
+
+        transitions = []  # (fix index, alert)
+        with self.lock:
+            for device_id, indices in per_device.items():
+                rows = inside[indices]
+                previous = self.inside.get(device_id, self.expected)
+                states = np.vstack((previous, rows))
+                # Row-major order: transitions come out in fix order
+                for row, number in zip(*np.nonzero(states[1:] != states[:-1])):
+                    transitions.append((indices[row], self._alert(fixes[indices[row]], device_id,
+                                                                  self.fences[number], bool(rows[row, number]))))
+                self.inside[device_id] = rows[-1].copy()
+            transitions.sort(key=lambda transition: transition[0])  # stable: fence order within a fix
+            alerts = [alert for _, alert in transitions]
+            self.recent.extend(alerts)
+            self.counts['fixes'] += len(fixes)
+            self.counts['tests'] += tests
+            self.counts['alerts'] += len(alerts)
+            self.counts['violations'] += sum(alert['violation'] for alert in alerts)
+        return alerts
+
+    @staticmethod
+    def _alert(fix, device_id, fence, entered):
+        return {
+            'device_id': device_id,
+            'fence_id': fence.id,
+            'fence': fence.name,
+            'kind': fence.kind,
+            'transition': 'enter' if entered else 'exit',
+            'violation': fence.is_violation(entered),
+            'latitude': fix['latitude'],
+            'longitude': fix['longitude'],
+            'timestamp': fix.get('timestamp'),
+        }
+
+    def state(self, device_id=None):
+        """device_id -> {'inside': [fence ids], 'violations': [fence ids]}"""
+        with self.lock:
+            items = list(self.inside.items())
+        return {
+            device: {
+                'inside': [fence.id for fence, flag in zip(self.fences, inside) if flag],
+                'violations': [fence.id for fence, flag in zip(self.fences, inside) if fence.is_violation(flag)],
+            }
+            for device, inside in items if device_id is None or device == device_id
+        }
+
+    def alerts(self, device_id=None, limit=100):
+        """Most recent alerts, oldest first"""
+        with self.lock:
+            alerts = [alert for alert in self.recent if device_id is None or alert['device_id'] == device_id]
+        return alerts[-limit:] if limit else []
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, fences=len(self.fences), cells=len(self.grid.cells),
+                        unbucketed=len(self.grid.everywhere), devices=len(self.inside))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Geofence tools")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    check_parser = subparsers.add_parser('check', help="Which fences contain a point")
+    check_parser.add_argument('fences')
+    check_parser.add_argument('--lat', type=float, required=True)
+    check_parser.add_argument('--lon', type=float, required=True)
+    args = parser.parse_args()
+
+    fences = load_fences(args.fences)
+    inside, _ = FenceGrid(fences).contains(np.array([args.lat]), np.array([args.lon]))
+    print(f"🗺️ {len(fences)} fence(s) loaded")
+    for fence, flag in zip(fences, inside[0]):
+        marker = '🚨' if fence.is_violation(flag) else '✅'
+        print(f"{marker} {fence.id} ({fence.kind}): {'inside' if flag else 'outside'}")
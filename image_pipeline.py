@@ -0,0 +1,152 @@
+# ============================================================================
+# FILE 19: image_pipeline.py (Cached, size-aware basemap image pipeline)
+# ============================================================================
+#
+# Decoding a basemap and scaling it to the canvas are the expensive steps of
+# a map update, so both are cached:
+#   - decoded basemaps at their native resolution (Static Maps), keyed by
+#     (source, map type, zoom, centre on the world-pixel grid); tile
+#     composites already come out at canvas size from the tile LRU
+#   - scaled copies keyed by the decoded key plus the target size and quality,
+#     so a basemap is only re-scaled when the window size changes
+# Scaling uses cheap BILINEAR resampling while tracking live and LANCZOS when
+# idle; the viewer re-requests the current basemap at 'high' quality once
+# tracking pauses, which is served from the decoded cache (no download).
+# Turning images into Tk PhotoImages stays on the Tk thread (see
+# PhotoBuffer), where the same PhotoImage is pasted into while the size holds.
+
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from map_renderer import fit_to_viewport
+from web_mercator import latlon_to_world
+
+RESAMPLING = {
+    'fast': Image.Resampling.BILINEAR,
+    'high': Image.Resampling.LANCZOS,
+}
+
+
+class LRUCache:
+    """Small thread-safe LRU (a few multi-megabyte images at most)"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class ImagePipeline:
+    """Basemap source -> decoded (cached) -> scaled to the canvas (cached)"""
+
+    def __init__(self, max_decoded=8, max_scaled=4):
+        self.decoded = LRUCache(max_decoded)
+        self.scaled = LRUCache(max_scaled)
+
+    @staticmethod
+    def center_key(viewport):
+        """Centre snapped to whole world pixels: revisiting a spot hits the same entry"""
+        x, y = latlon_to_world(viewport.lat, viewport.lon, viewport.zoom)
+        return int(round(float(x))), int(round(float(y)))
+
+    def basemap(self, source, source_key, viewport, quality='high'):
+        """
+        (image, view, scaled_quality) for a viewport. scaled_quality is the
+        resampling quality used to fit the image to the viewport, or None if
+        the basemap needed no scaling (tiles are composed at canvas size).
+        """
+        fetch_native = getattr(source, 'fetch_native', None)
+        if fetch_native is None:
+            # Tiles are composed at viewport size from their own tile LRU; caching the
+            # composite would keep gaps from tiles that were missing at the time
+            image, view = source.fetch(viewport)
+            return image, view, None
+
+        decoded_key = (source_key, viewport.zoom, self.center_key(viewport))
+        native = self.decoded.get(decoded_key)
+        if native is None:
+            native = fetch_native(viewport)
+            self.decoded.put(decoded_key, native)
+
+        image, view = native
+        scale_factor = min(viewport.width / image.size[0], viewport.height / image.size[1])
+        if scale_factor <= 1:
+            return image, view, None
+
+        scaled_key = decoded_key + ((viewport.width, viewport.height), quality)
+        scaled = self.scaled.get(scaled_key)
+        if scaled is None:
+            scaled = fit_to_viewport(image, view, viewport.width, viewport.height, RESAMPLING[quality])
+            self.scaled.put(scaled_key, scaled)
+        return scaled + (quality,)
+
+    def prefetch(self, source, source_key, viewport):
+        """Download and decode a basemap into the decoded cache ahead of time; returns it"""
+        decoded_key = (source_key, viewport.zoom, self.center_key(viewport))
+        native = self.decoded.entries.get(decoded_key)  # peek: don't count prefetches as hits
+        if native is None:
+            native = source.fetch_native(viewport)
+            self.decoded.put(decoded_key, native)
+        return native
+
+    def is_decoded(self, source_key, viewport):
+        return (source_key, viewport.zoom, self.center_key(viewport)) in self.decoded.entries
+
+    def clear(self):
+        self.decoded.clear()
+        self.scaled.clear()
+
+    def stats(self):
+        return {name: {'entries': len(cache.entries), 'hits': cache.hits, 'misses': cache.misses}
+                for name, cache in (('decoded', self.decoded), ('scaled', self.scaled))}
+
+
+class PhotoBuffer:
+    """
+    One Tk PhotoImage reused across basemap updates: same size -> paste the
+    new pixels into it, new size -> allocate a new one. Tk thread only.
+    """
+
+    def __init__(self, photo_factory):
+        self.photo_factory = photo_factory  # e.g. ImageTk.PhotoImage
+        self.photo = None
+        self.size = None
+        self.source = None
+
+    def update(self, image):
+        """PhotoImage showing `image`; returns (photo, reused)"""
+        if image is self.source and self.photo is not None:
+            return self.photo, True  # the same cached image: nothing to copy
+        if self.photo is not None and image.size == self.size:
+            self.photo.paste(image)
+            self.source = image
+            return self.photo, True
+        self.photo = self.photo_factory(image)
+        self.size = image.size
+        self.source = image
+        return self.photo, False
@@ -0,0 +1,151 @@
+# ============================================================================
+# FILE 12: latency_metrics.py (Prometheus-style counters and histograms)
+# ============================================================================
+#
+# Shared by the server (/metrics) and the viewer (diagnostics panel). Each
+# fix is stamped at every stage of the pipeline (device, server receive,
+# persist, viewer read, overlay ready, displayed); the differences between
+# stamps are observed into fixed-bucket histograms. Quantiles are estimated
+# from the buckets, the same way Prometheus' histogram_quantile does.
+
+import bisect
+import threading
+
+# Seconds; spans sub-millisecond handler times up to minutes of link lag
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in sorted(labels.items())) + '}'
+
+
+class Counter:
+    """Monotonically increasing count"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=None):
+        self.name = name
+        self.help = help_text
+        self.labels = labels or {}
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        return [(self.name, self.labels, self.value)]
+
+    def summary(self):
+        return {'count': self.value}
+
+
+class Histogram:
+    """Cumulative-bucket histogram with quantile estimates"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=None, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels or {}
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        """Estimate the q-quantile by linear interpolation inside the bucket"""
+        with self.lock:
+            if self.count == 0:
+                return None
+            rank = q * self.count
+            cumulative = 0
+            for i, bucket_count in enumerate(self.counts):
+                if cumulative + bucket_count >= rank and bucket_count:
+                    lower = self.buckets[i - 1] if i > 0 else 0.0
+                    if i == len(self.buckets):
+                        return lower  # +Inf bucket: best we can say is "at least"
+                    upper = self.buckets[i]
+                    return lower + (upper - lower) * (rank - cumulative) / bucket_count
+                cumulative += bucket_count
+            return self.buckets[-1]
+
+    def samples(self):
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        samples = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            samples.append((self.name + '_bucket', dict(self.labels, le=le), cumulative))
+        samples.append((self.name + '_sum', self.labels, total))
+        samples.append((self.name + '_count', self.labels, count))
+        return samples
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+        }
+
+
+class MetricsRegistry:
+    """Named metrics, rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, help_text, labels, **kwargs):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            metric = self.metrics.get(key)
+            if metric is None:
+                metric = cls(name, help_text, labels, **kwargs)
+                self.metrics[key] = metric
+            return metric
+
+    def counter(self, name, help_text, labels=None):
+        return self._get_or_create(Counter, name, help_text, labels)
+
+    def histogram(self, name, help_text, labels=None, buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, labels, buckets=buckets)
+
+    def render_prometheus(self):
+        """Text exposition format (version 0.0.4)"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        described = set()
+        for metric in sorted(metrics, key=lambda m: m.name):
+            if metric.name not in described:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                described.add(metric.name)
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{format_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """{'name{labels}': {count, mean, p50, p95, p99}} for dashboards and JSON"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {metric.name + format_labels(metric.labels): metric.summary()
+                for metric in sorted(metrics, key=lambda m: m.name)}
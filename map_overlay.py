@@ -0,0 +1,168 @@
+# ============================================================================
+# FILE 9: map_overlay.py (Client-side marker/path overlay on a cached basemap)
+# ============================================================================
+#
+# The basemap image is fetched without any markers or paths. Its geometry
+# (BasemapView) is enough to project any lat/lon onto it with Web Mercator,
+# so the position marker, accuracy circle and track polyline are drawn as
+# Tk canvas items on top. A new fix only costs a few canvas updates; the
+# basemap is refetched only when the rover leaves the cached extent or the
+# zoom/map type changes.
+
+import numpy as np
+
+from web_mercator import latlon_to_world, meters_per_pixel
+
+OVERLAY_TAG = 'overlay'
+FENCE_COLORS = {'keep_in': '#1e9e3a', 'keep_out': '#e67e00'}
+
+
+class BasemapView:
+    """Where a basemap image sits in the world: lat/lon <-> image pixels"""
+
+    def __init__(self, origin_x, origin_y, zoom, width, height, pixel_ratio=1.0):
+        self.origin_x = origin_x        # world pixel of the image's top-left corner
+        self.origin_y = origin_y
+        self.zoom = zoom
+        self.width = width              # image size in image pixels
+        self.height = height
+        self.pixel_ratio = pixel_ratio  # image pixels per world pixel
+
+    @classmethod
+    def centered(cls, lat, lon, zoom, width, height, pixel_ratio=1.0):
+        """View of a width x height image centred on a point (e.g. a Static Maps image)"""
+        center_x, center_y = latlon_to_world(lat, lon, zoom)
+        return cls(float(center_x) - width / pixel_ratio / 2, float(center_y) - height / pixel_ratio / 2,
+                   zoom, width, height, pixel_ratio)
+
+    def scaled(self, factor):
+        """Same extent after the image was resized by `factor`"""
+        return BasemapView(self.origin_x, self.origin_y, self.zoom,
+                           int(self.width * factor), int(self.height * factor), self.pixel_ratio * factor)
+
+    def project(self, lat, lon):
+        """lat/lon (scalars or arrays) -> image pixel x, y"""
+        x, y = latlon_to_world(lat, lon, self.zoom)
+        return (x - self.origin_x) * self.pixel_ratio, (y - self.origin_y) * self.pixel_ratio
+
+    def meters_to_pixels(self, meters, lat):
+        """Convert a ground distance at a latitude into image pixels"""
+        return meters / meters_per_pixel(lat, self.zoom) * self.pixel_ratio
+
+
+class MapOverlay:
+    """
+    Track polyline, accuracy circle and marker as persistent canvas items:
+    created once (in that stacking order), then moved with coords/itemconfig
+    on every frame instead of being deleted and recreated.
+    """
+
+    def __init__(self, canvas, path_color='#1a57e6', marker_color='#dc0000'):
+        self.canvas = canvas
+        self.path_color = path_color
+        self.marker_color = marker_color
+        self.path_item = canvas.create_line(0, 0, 0, 0, fill=path_color, width=3, capstyle='round',
+                                            joinstyle='round', state='hidden', tags=OVERLAY_TAG)
+        self.accuracy_item = canvas.create_oval(0, 0, 0, 0, outline=path_color, fill=path_color,
+                                                stipple='gray25', state='hidden', tags=OVERLAY_TAG)
+        self.marker_item = canvas.create_oval(0, 0, 0, 0, fill=marker_color, outline='white', width=2,
+                                              state='hidden', tags=OVERLAY_TAG)
+        self.item_states = {}
+        self.fence_items = []        # (item, fence, ring or None for circles)
+        self.fence_placement = None  # (view, offset) the fence outlines were last projected for
+
+    def set_fences(self, fences):
+        """Outline geofences (see geofence.py) below the track; they only move with the basemap"""
+        for item, _, _ in self.fence_items:
+            self.canvas.delete(item)
+            self.item_states.pop(item, None)
+        self.fence_items = []
+        for fence in fences:
+            color = FENCE_COLORS[fence.kind]
+            fill = color if fence.kind == 'keep_out' else ''
+            for ring in (fence.rings if fence.shape == 'polygon' else [None]):
+                if ring is None:
+                    item = self.canvas.create_oval(0, 0, 0, 0, outline=color, fill=fill, stipple='gray12',
+                                                   width=2, dash=(6, 4), state='hidden', tags=OVERLAY_TAG)
+                else:
+                    item = self.canvas.create_polygon(0, 0, 0, 0, 0, 0, outline=color, fill=fill, stipple='gray12',
+                                                      width=2, dash=(6, 4), state='hidden', tags=OVERLAY_TAG)
+                self.canvas.tag_lower(item, self.path_item)
+                self.fence_items.append((item, fence, ring))
+        self.fence_placement = None
+
+    def _draw_fences(self, view, offset):
+        offset_x, offset_y = offset
+        for item, fence, ring in self.fence_items:
+            if ring is None:
+                x, y = view.project(fence.lat, fence.lon)
+                x, y = float(x) + offset_x, float(y) + offset_y
+                radius = float(view.meters_to_pixels(fence.radius, fence.lat))
+                self._set(item, (x - radius, y - radius, x + radius, y + radius))
+            else:
+                xs, ys = view.project(ring[:, 0], ring[:, 1])
+                coords = np.empty(len(ring) * 2)
+                coords[0::2] = xs + offset_x
+                coords[1::2] = ys + offset_y
+                self._set(item, coords.tolist())
+        self.fence_placement = (view, offset)
+
+    def _set(self, item, coords=None):
+        """Move an item (None hides it); Tk is only called for items that changed"""
+        state = 'hidden' if coords is None else 'normal'
+        if self.item_states.get(item) != state:
+            self.canvas.itemconfigure(item, state=state)
+            self.item_states[item] = state
+        if coords is not None:
+            self.canvas.coords(item, coords)
+
+    def draw(self, view, offset, lat, lon, accuracy=None, path=None):
+        """
+        Update the overlay for a basemap `view` drawn at canvas `offset`.
+        `path` is a sequence of (lat, lon) points, oldest first.
+        """
+        offset_x, offset_y = offset
+        if self.fence_items and self.fence_placement != (view, offset):
+            self._draw_fences(view, offset)
+
+        path_coords = None
+        if path is not None and len(path) > 1:
+            points = np.asarray(path, dtype=float)
+            xs, ys = view.project(points[:, 0], points[:, 1])
+            coords = np.empty(len(points) * 2)
+            coords[0::2] = xs + offset_x
+            coords[1::2] = ys + offset_y
+            path_coords = coords.tolist()
+        self._set(self.path_item, path_coords)
+
+        x, y = view.project(lat, lon)
+        x, y = float(x) + offset_x, float(y) + offset_y
+
+        accuracy_coords = None
+        if accuracy:
+            try:
+                radius = float(view.meters_to_pixels(float(accuracy), lat))
+            except (TypeError, ValueError):
+                radius = 0
+            if radius > 2:
+                accuracy_coords = (x - radius, y - radius, x + radius, y + radius)
+        self._set(self.accuracy_item, accuracy_coords)
+
+        self._set(self.marker_item, (x - 8, y - 8, x + 8, y + 8))
+        return x, y
+
+    def hide(self):
+        for item in (self.path_item, self.accuracy_item, self.marker_item):
+            self._set(item, None)
+        for item, _, _ in self.fence_items:
+            self._set(item, None)
+        self.fence_placement = None
+
+    def delete(self):
+        """Remove the overlay's canvas items (the overlay is not used afterwards)"""
+        for item in (self.path_item, self.accuracy_item, self.marker_item):
+            self.canvas.delete(item)
+        for item, _, _ in self.fence_items:
+            self.canvas.delete(item)
+        self.fence_items = []
+        self.item_states.clear()
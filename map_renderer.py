@@ -0,0 +1,267 @@
+# ============================================================================
+# FILE 18: map_renderer.py (UI-independent map rendering with Pillow)
+# ============================================================================
+#
+# Everything needed to draw the map without Tk: a Viewport says what to show
+# (centre, zoom, size in pixels), a basemap source turns it into a Pillow
+# image plus its BasemapView geometry, and MapRenderer draws the track,
+# accuracy circle and marker on top. The Tk viewer uses the same sources for
+# its basemap and only keeps the canvas-item overlay for cheap live updates;
+# servers, benchmarks and the CLI below render straight to images.
+#
+# Render a recorded track to frames at batch speed (offline with cached tiles):
+#   python map_renderer.py --trace track_log/ --out frames/ --every 10
+#   python map_renderer.py --trace drive.gpx --gif drive.gif --source tiles --offline
+
+import argparse
+import os
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from map_overlay import BasemapView
+from track_history import TrackHistory
+
+PATH_COLOR = (26, 87, 230)
+MARKER_COLOR = (220, 0, 0)
+BLANK_COLOR = (242, 239, 233)
+ACCURACY_ALPHA = 64
+
+
+def fit_to_viewport(image, view, width, height, resample=Image.Resampling.LANCZOS):
+    """Scale a basemap up (never down) until it fills width x height; returns (image, view)"""
+    scale_factor = min(width / image.size[0], height / image.size[1])
+    if scale_factor <= 1:
+        return image, view
+    size = (int(image.size[0] * scale_factor), int(image.size[1] * scale_factor))
+    return image.resize(size, resample), view.scaled(scale_factor)
+
+
+class Viewport:
+    """What to show: a width x height image centred on lat/lon at a zoom level"""
+
+    def __init__(self, lat, lon, zoom, width, height):
+        self.lat = lat
+        self.lon = lon
+        self.zoom = zoom
+        self.width = width
+        self.height = height
+
+
+class BlankBasemap:
+    """Plain background (no network, no cache): for tests, profiling and track-only renders"""
+
+    def __init__(self, color=BLANK_COLOR):
+        self.color = color
+
+    def fetch(self, viewport):
+        image = Image.new('RGB', (viewport.width, viewport.height), self.color)
+        return image, BasemapView.centered(viewport.lat, viewport.lon, viewport.zoom,
+                                           viewport.width, viewport.height)
+
+
+class TileBasemap:
+    """Slippy-map tiles composited by a TileProvider (memory LRU, MBTiles, network)"""
+
+    def __init__(self, provider):
+        self.provider = provider
+
+    def fetch(self, viewport):
+        try:
+            image, (origin_x, origin_y) = self.provider.compose(viewport.lat, viewport.lon, viewport.zoom,
+                                                                viewport.width, viewport.height)
+        except Exception as e:
+            raise Exception(f"Tile rendering failed: {str(e)}")
+        return image, BasemapView(origin_x, origin_y, viewport.zoom, viewport.width, viewport.height)
+
+
+class StaticMapsBasemap:
+    """Google Static Maps image, scaled up to fill the viewport"""
+
+    BASE_URL = "https://maps.googleapis.com/maps/api/staticmap"
+
+    def __init__(self, api_key, session, map_type='roadmap', size="640x640", scale=2):
+        self.api_key = api_key
+        self.session = session
+        self.map_type = map_type
+        self.size = size
+        self.scale = scale
+
+    def url(self, viewport):
+        """Static Maps URL for the basemap (marker and path are drawn locally)"""
+        params = {
+            'center': f"{viewport.lat},{viewport.lon}",
+            'zoom': viewport.zoom,
+            'size': self.size,
+            'scale': self.scale,
+            'maptype': self.map_type,
+            'key': self.api_key
+        }
+        return self.BASE_URL + "?" + "&".join([f"{key}={value}" for key, value in params.items()])
+
+    def fetch_native(self, viewport):
+        """Decoded image at the API's own resolution (size x scale), not fitted to the viewport"""
+        try:
+            response = self.session.get(self.url(viewport), timeout=15)
+            response.raise_for_status()
+
+            if 'image' not in response.headers.get('content-type', ''):
+                error_text = response.text
+                if 'API key' in error_text:
+                    raise Exception("Invalid Google Maps API key!")
+                elif 'quota' in error_text.lower():
+                    raise Exception("API quota exceeded!")
+                else:
+                    raise Exception(f"API Error: {error_text}")
+
+            image = Image.open(BytesIO(response.content)).convert('RGB')
+            return image, BasemapView.centered(viewport.lat, viewport.lon, viewport.zoom,
+                                               image.size[0], image.size[1], pixel_ratio=self.scale)
+
+        except Exception as e:
+            raise Exception(f"Map download failed: {str(e)}")
+
+    def fetch(self, viewport):
+        image, view = self.fetch_native(viewport)
+        return fit_to_viewport(image, view, viewport.width, viewport.height)
+
+
+class MapRenderer:
+    """Basemap + track overlay -> Pillow image, without any UI toolkit"""
+
+    def __init__(self, basemap=None, path_color=PATH_COLOR, marker_color=MARKER_COLOR, path_width=3):
+        self.basemap = basemap or BlankBasemap()
+        self.path_color = path_color
+        self.marker_color = marker_color
+        self.path_width = path_width
+
+    def render_basemap(self, viewport):
+        """(image, BasemapView) of the basemap alone"""
+        return self.basemap.fetch(viewport)
+
+    def draw_overlay(self, image, view, lat, lon, accuracy=None, path=None, offset=(0, 0)):
+        """
+        Draw path, accuracy circle and marker onto `image` (modified in place).
+        `path` is a sequence of (lat, lon) points, oldest first; `offset` is
+        where the basemap's top-left corner sits in `image`.
+        """
+        offset_x, offset_y = offset
+        draw = ImageDraw.Draw(image)
+
+        if path is not None and len(path) > 1:
+            points = np.asarray(path, dtype=float)
+            xs, ys = view.project(points[:, 0], points[:, 1])
+            coords = np.column_stack((xs + offset_x, ys + offset_y)).ravel().tolist()
+            draw.line(coords, fill=self.path_color, width=self.path_width, joint='curve')
+
+        x, y = view.project(lat, lon)
+        x, y = float(x) + offset_x, float(y) + offset_y
+
+        if accuracy:
+            try:
+                radius = float(view.meters_to_pixels(float(accuracy), lat))
+            except (TypeError, ValueError):
+                radius = 0
+            if radius > 2:
+                box = (max(int(x - radius) - 1, 0), max(int(y - radius) - 1, 0),
+                       min(int(x + radius) + 2, image.width), min(int(y + radius) + 2, image.height))
+                if box[0] < box[2] and box[1] < box[3]:
+                    self._blend_circle(image, box, x, y, radius)
+
+        draw.ellipse((x - 8, y - 8, x + 8, y + 8), fill=self.marker_color, outline='white', width=2)
+        return x, y
+
+    def _blend_circle(self, image, box, x, y, radius):
+        """Translucent accuracy circle, blended on just the patch it covers"""
+        patch = image.crop(box).convert('RGBA')
+        layer = Image.new('RGBA', patch.size, (0, 0, 0, 0))
+        ImageDraw.Draw(layer).ellipse((x - radius - box[0], y - radius - box[1],
+                                       x + radius - box[0], y + radius - box[1]),
+                                      fill=self.path_color + (ACCURACY_ALPHA,),
+                                      outline=self.path_color + (255,))
+        image.paste(Image.alpha_composite(patch, layer).convert(image.mode), box[:2])
+
+    def render(self, viewport, lat=None, lon=None, accuracy=None, path=None):
+        """Full frame: basemap of `viewport` with the overlay (marker defaults to the centre)"""
+        image, view = self.render_basemap(viewport)
+        self.draw_overlay(image, view,
+                          viewport.lat if lat is None else lat, viewport.lon if lon is None else lon,
+                          accuracy, path)
+        return image
+
+    def render_array(self, viewport, **overlay):
+        """Same as render(), as an (height, width, 3) uint8 array"""
+        return np.asarray(self.render(viewport, **overlay))
+
+
+def render_track_frames(renderer, fixes, zoom, width, height, every=1, max_vertices=500):
+    """
+    Yield (index, image) frames replaying a track: one frame every `every` fixes
+    (and one for the last fix), camera following the rover, path so far drawn.
+    """
+    history = TrackHistory()
+    for i, fix in enumerate(fixes):
+        history.append(fix['latitude'], fix['longitude'], i)
+        if i % every and i != len(fixes) - 1:
+            continue
+        lats, lons = history.simplified(zoom, max_vertices)
+        viewport = Viewport(fix['latitude'], fix['longitude'], zoom, width, height)
+        yield i, renderer.render(viewport, accuracy=fix.get('accuracy'), path=np.column_stack((lats, lons)))
+
+
+if __name__ == '__main__':
+    from tile_engine import TileProvider, TILE_URLS, DEFAULT_CACHE_DIR
+    from trace_io import load_trace
+
+    parser = argparse.ArgumentParser(description="Render a recorded track to PNG frames or an animated GIF")
+    parser.add_argument('--trace', required=True, help="track log directory, GPX, CSV or NDJSON file")
+    parser.add_argument('--device', help="only this device's fixes")
+    parser.add_argument('--out', help="directory for frame-NNNNNN.png files")
+    parser.add_argument('--gif', help="write an animated GIF instead of (or as well as) PNG frames")
+    parser.add_argument('--fps', type=float, default=10, help="GIF frame rate")
+    parser.add_argument('--every', type=int, default=1, help="render one frame every N fixes")
+    parser.add_argument('--zoom', type=int, default=17)
+    parser.add_argument('--size', default='800x600', help="frame size WIDTHxHEIGHT")
+    parser.add_argument('--source', choices=['blank', 'tiles'], default='blank')
+    parser.add_argument('--map-type', default='roadmap', choices=sorted(TILE_URLS))
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--offline', action='store_true', help="tiles from the cache only")
+    args = parser.parse_args()
+    if not args.out and not args.gif:
+        parser.error("give --out and/or --gif")
+
+    fixes = load_trace(args.trace)
+    if args.device:
+        fixes = [fix for fix in fixes if fix.get('device_id') == args.device]
+    if not fixes:
+        parser.error("the trace has no fixes")
+    width, height = (int(v) for v in args.size.lower().split('x'))
+
+    provider = None
+    if args.source == 'tiles':
+        provider = TileProvider(args.map_type, args.cache_dir, offline=args.offline)
+        renderer = MapRenderer(TileBasemap(provider))
+    else:
+        renderer = MapRenderer()
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+
+    print(f"🎞️ Rendering {len(fixes)} fixes ({args.source}, zoom {args.zoom}, {width}x{height}, every {args.every})")
+    started = time.perf_counter()
+    gif_frames = []
+    count = 0
+    for index, image in render_track_frames(renderer, fixes, args.zoom, width, height, args.every):
+        if args.out:
+            image.save(os.path.join(args.out, f"frame-{index:06d}.png"), compress_level=1)
+        if args.gif:
+            gif_frames.append(image.quantize(method=Image.Quantize.FASTOCTREE))
+        count += 1
+    if args.gif:
+        gif_frames[0].save(args.gif, save_all=True, append_images=gif_frames[1:],
+                           duration=int(1000 / args.fps), loop=0)
+    elapsed = time.perf_counter() - started
+    print(f"✅ {count} frames in {elapsed:.2f}s ({count / elapsed:.1f} frames/s)")
+    if provider:
+        provider.close()
@@ -3,15 +3,30 @@
 # ============================================================================
 
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 import threading
-import requests
-from PIL import Image, ImageTk
-from io import BytesIO
+import numpy as np
 import time
 import json
 import os
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timezone
+from functools import partial
+from track_log import TrackLogReader, records_to_fixes, parse_timestamp
+from file_watcher import FileWatcher
+from map_overlay import MapOverlay
+from render_scheduler import RenderScheduler, create_session
+from track_history import TrackHistory
+from tile_prefetch import Prefetcher, estimate_motion, plan_tiles, plan_extent, extent_covers
+from web_mercator import world_to_latlon
+from latency_metrics import MetricsRegistry
+from derived_metrics import DerivedMetrics, DeviceMetrics, recompute, initial_metrics
+from device_registry import DEFAULT_DEVICE_ID
+from track_archive import TrackArchive
+from geofence import GeofenceEngine, load_fences
+from fix_filter import should_redraw
+from fleet_view import PALETTE, DeviceTrack, staleness, bounds_center, fit_zoom
+from viewer_state import DEFAULT_STATE_FILE, load_state, save_state, snapshot_info, snapshot_path, snapshot_view
 
 class LiveGPSMapsViewer:
     def __init__(self):
@@ -21,6 +36,25 @@ class LiveGPSMapsViewer:
         # GPS data file (matches Flask server)
         self.gps_file = 'live_gps_coordinates.json'
         
+        # One watcher shared by the status check and the tracking loop (inotify on Linux,
+        # stat signature elsewhere); the file is only parsed when its version changes
+        self.gps_watcher = FileWatcher(self.gps_file)
+        self.gps_file_version = None
+        
+        # GPS source: 'json' (latest-fix file), 'tracklog' (server's append-only log,
+        # start the server with GPS_STORAGE_MODE=tracklog), 'stream' (subscribe to
+        # the server's /stream endpoint over the network, no shared filesystem needed)
+        # or 'fleet' (poll the server's /devices endpoint: every device's latest fix)
+        self.gps_source = os.environ.get('GPS_STORAGE_MODE', 'json')
+        self.track_log_dir = os.environ.get('GPS_TRACK_LOG_DIR', 'track_log')
+        self.track_log_reader = None
+        
+        # Flask server (used by 'stream' mode and the server test)
+        self.server_url = os.environ.get('GPS_SERVER_URL', 'http://localhost:5000').rstrip('/')
+        self.stream_device = os.environ.get('GPS_DEVICE_ID')  # None = follow every device
+        self.stream_response = None
+        self.stream_last_seq = None
+        
         # Default coordinates (Dhaka, Bangladesh)
         self.latitude = 23.7465
         self.longitude = 90.3763
@@ -39,9 +73,123 @@ class LiveGPSMapsViewer:
         self.map_type = "roadmap"
         self.scale = 2
         
+        # Map source: 'google' (Static Maps API, needs a key and a connection) or
+        # 'tiles' (z/x/y tiles from the local MBTiles cache, downloading misses
+        # unless offline; pre-seed with `python tile_engine.py seed ...`)
+        self.map_source = os.environ.get('GPS_MAP_SOURCE', 'google')
+        self.tile_cache_dir = os.environ.get('GPS_TILE_CACHE_DIR')  # None = tile_engine's default
+        self.tile_offline = os.environ.get('GPS_MAP_OFFLINE') == '1'
+        self.tile_providers = {}
+        self.tile_provider_lock = threading.Lock()
+        
+        # Cached basemap: only refetched when the position nears its edge
+        # (basemap_margin of the visible size) or zoom/type/source change
+        self.basemap_view = None
+        self.basemap_offset = (0, 0)
+        self.basemap_key = None
+        self.basemap_margin = 0.2
+        
+        # Fast start (see viewer_state.py): the last position, zoom, map type and source
+        # are restored, and the basemap shown at exit paints the first frame
+        # (GPS_VIEWER_STATE=0 turns it off). GPS_MAP_SOURCE still wins over the saved source
+        state_file = os.environ.get('GPS_VIEWER_STATE', DEFAULT_STATE_FILE)
+        self.state_file = None if state_file == '0' else state_file
+        self.saved_state = load_state(self.state_file) if self.state_file else None
+        if self.saved_state:
+            self.latitude = self.saved_state['latitude']
+            self.longitude = self.saved_state['longitude']
+            self.zoom_level = self.saved_state['zoom']
+            self.map_type = self.saved_state['map_type']
+            if 'GPS_MAP_SOURCE' not in os.environ:
+                self.map_source = self.saved_state['map_source']
+        self.snapshot_photo = None
+        self.startup_map_delay = 50  # ms after the first paint before the first basemap request
+        
+        # One keep-alive connection pool for every map download (created, and requests
+        # imported, on the first download), and a single render worker that coalesces
+        # bursts (latest request wins)
+        self.lazy_lock = threading.Lock()
+        self._http = None
+        self.render_scheduler = RenderScheduler(self.render_basemap, self.on_basemap_rendered)
+        
+        # Decoded/scaled basemap caches; cheap resampling while fixes are streaming in,
+        # upgraded to high quality once tracking has been idle for idle_upgrade_delay ms.
+        # Pillow is only imported with the first basemap
+        self._image_pipeline = None
+        self.basemap_photo = None
+        self.basemap_image = None  # Pillow image on the canvas (None while the snapshot is shown)
+        self.basemap_request = None
+        self.viewport_size = None
+        self.last_fix_at = 0
+        self.live_quality_window = 5.0  # seconds since the last fix that count as "live"
+        self.idle_upgrade_delay = 1500
+        self.upgrade_job = None
+        
+        # Frame-rate cap: fixes arriving faster than this (several fast devices) are
+        # coalesced, each frame draws whatever is newest when it runs
+        self.max_fps = float(os.environ.get('GPS_VIEWER_FPS', 30))
+        self.frame_lock = threading.Lock()
+        self.frame_pending = False
+        self.last_frame_at = 0
+        
+        # Predictive prefetch: basemap data along the rover's heading is fetched ahead
+        # of time on low-priority workers (GPS_PREFETCH=0 turns it off)
+        self.prefetch_enabled = os.environ.get('GPS_PREFETCH', '1') != '0'
+        self.prefetcher = Prefetcher(workers=2 if self.prefetch_enabled else 0)
+        self.prefetch_center = None  # ((lat, lon), key, visible world size) of the next Static Maps basemap
+        
+        # Speed, heading, odometer and stop time of each device, updated per fix
+        # (the same engine the server runs on ingest)
+        self.derived = DerivedMetrics()
+        
+        # Every device gets its own track, fix filter, colour and canvas layer (see
+        # fleet_view.py); all layers share one basemap and are drawn in one pass per
+        # frame. The followed device (picked in the device list, else the first one
+        # seen) is mirrored into latitude/longitude/location_history and centres the
+        # map, unless "Fit All Devices" sizes the view around every device
+        # The GPS thread adds devices and switches the followed one while the Tk thread
+        # draws them: both go through devices_lock, and readers iterate over a snapshot
+        self.devices = {}  # device_id -> DeviceTrack
+        self.current_device = None
+        self.devices_lock = threading.Lock()
+        self.device_refresh_interval = 1000  # ms between device list updates
+        
+        # Geofences (GPS_GEOFENCE_FILE, see geofence.py): outlined on the map. In 'stream'
+        # mode the server checks them and pushes alerts; otherwise the viewer checks the
+        # fixes it reads itself
+        geofence_file = os.environ.get('GPS_GEOFENCE_FILE')
+        self.geofences = GeofenceEngine(load_fences(geofence_file)) if geofence_file else None
+        self.alerts = deque(maxlen=50)
+        self.fence_violations = {}  # (device_id, fence_id) -> alert that started the violation
+        
+        # Mission playback from a track archive (see track_archive.py): the device's
+        # columns are decoded once, scrubbing/replay only slices the arrays
+        self.playback_track = None    # time/latitude/longitude/accuracy arrays + derived series
+        self.playback_shown = 0       # fixes of the track currently in the history
+        self.playback_time = None     # mission time (epoch seconds) at the playhead
+        self.playback_playing = False
+        self.playback_job = None
+        self.playback_tick = 50       # ms between playback steps
+        self.playback_clock = None
+        
         # Location history for path tracking
-        self.location_history = []
-        self.max_history = 25
+        # (full mission, NumPy-backed; drawn through a zoom-dependent simplification)
+        self.location_history = TrackHistory()
+        self.max_path_vertices = 500
+        
+        # Pipeline latency: each accepted fix carries stamps (device, server receive,
+        # viewer read, overlay ready, displayed) that feed the diagnostics panel
+        self.metrics = MetricsRegistry()
+        self.pending_stamps = None
+        self.diagnostics_window = None
+        self.server_metrics = {}
+        
+        # Fixes are Kalman-filtered per device (accuracy-weighted, outliers rejected); a
+        # frame is only requested when the filtered marker or accuracy circle would move
+        # by a pixel or more at the current zoom
+        self.fix_outliers = self.metrics.counter('viewer_fix_outliers_total', "Fixes rejected as outliers")
+        self.fixes_suppressed = self.metrics.counter('viewer_fixes_unchanged_total',
+                                                     "Fixes that moved the marker by less than a pixel")
         
         self.setup_gui()
         
@@ -85,6 +233,29 @@ class LiveGPSMapsViewer:
         ttk.Button(controls_row, text="📡 Test Server", 
                   command=self.test_server_connection).pack(side=tk.LEFT, padx=5)
         
+        ttk.Button(controls_row, text="📈 Diagnostics", 
+                  command=self.open_diagnostics).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Button(controls_row, text="🎞️ Playback", 
+                  command=self.open_playback).pack(side=tk.LEFT, padx=5)
+        
+        # Device list: one row per device in its layer colour; selecting a row follows it
+        devices_frame = ttk.Frame(gps_frame)
+        devices_frame.pack(side=tk.RIGHT, fill=tk.Y, padx=(10, 0))
+        
+        self.device_tree = ttk.Treeview(devices_frame, columns=('seen', 'speed', 'fixes'), height=5,
+                                        selectmode='browse')
+        self.device_tree.heading('#0', text="Device")
+        self.device_tree.heading('seen', text="Last Fix")
+        self.device_tree.heading('speed', text="Speed")
+        self.device_tree.heading('fixes', text="Fixes")
+        self.device_tree.column('#0', width=120)
+        self.device_tree.column('seen', width=90)
+        self.device_tree.column('speed', width=80, anchor=tk.E)
+        self.device_tree.column('fixes', width=60, anchor=tk.E)
+        self.device_tree.pack(fill=tk.Y, expand=True)
+        self.device_tree.bind('<<TreeviewSelect>>', self.on_device_select)
+        
         # GPS info display
         info_frame = ttk.Frame(gps_frame)
         info_frame.pack(fill=tk.X)
@@ -120,34 +291,141 @@ class LiveGPSMapsViewer:
                     values=["roadmap", "satellite", "terrain", "hybrid"],
                     state="readonly", width=10).pack(side=tk.LEFT, padx=10)
         
+        # Map source
+        source_frame = ttk.Frame(controls_container)
+        source_frame.pack(side=tk.LEFT, padx=(0, 20))
+        
+        ttk.Label(source_frame, text="Source:", font=('Arial', 10, 'bold')).pack(side=tk.LEFT)
+        self.map_source_var = tk.StringVar(value=self.map_source)
+        ttk.Combobox(source_frame, textvariable=self.map_source_var,
+                    values=["google", "tiles"], state="readonly", width=8).pack(side=tk.LEFT, padx=10)
+        self.tile_offline_var = tk.BooleanVar(value=self.tile_offline)
+        ttk.Checkbutton(source_frame, text="📴 Offline", variable=self.tile_offline_var,
+                       command=self.toggle_tile_offline).pack(side=tk.LEFT)
+        
         # Action buttons
         buttons_frame = ttk.Frame(controls_container)
         buttons_frame.pack(side=tk.RIGHT)
         
         ttk.Button(buttons_frame, text="🔄 Update Map", 
-                  command=self.update_map).pack(side=tk.LEFT, padx=5)
+                  command=lambda: self.update_map(force=True)).pack(side=tk.LEFT, padx=5)
         ttk.Button(buttons_frame, text="🗑️ Clear Path", 
                   command=self.clear_history).pack(side=tk.LEFT, padx=5)
+        self.auto_fit_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(buttons_frame, text="🔭 Fit All Devices", variable=self.auto_fit_var,
+                       command=lambda: self.update_map(force=True)).pack(side=tk.LEFT, padx=5)
+        
+        # === PLAYBACK (shown while an archive is open) ===
+        self.playback_frame = ttk.LabelFrame(main_frame, text="🎞️ Mission Playback", padding=10)
+        
+        self.playback_button = ttk.Button(self.playback_frame, text="▶ Play", width=8,
+                                          command=self.toggle_playback)
+        self.playback_button.pack(side=tk.LEFT, padx=5)
+        
+        self.playback_var = tk.DoubleVar(value=0)
+        self.playback_scale = ttk.Scale(self.playback_frame, from_=0, to=1, orient=tk.HORIZONTAL,
+                                        variable=self.playback_var, command=self.on_playback_scrub)
+        self.playback_scale.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=10)
+        
+        self.playback_time_label = ttk.Label(self.playback_frame, text="--", font=('Arial', 10))
+        self.playback_time_label.pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(self.playback_frame, text="Speed:", font=('Arial', 10, 'bold')).pack(side=tk.LEFT, padx=(10, 0))
+        self.playback_speed_var = tk.StringVar(value="20x")
+        ttk.Combobox(self.playback_frame, textvariable=self.playback_speed_var,
+                    values=["1x", "5x", "20x", "100x", "1000x"], state="readonly", width=6).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Button(self.playback_frame, text="⏏ Close", 
+                  command=self.close_playback).pack(side=tk.LEFT, padx=5)
         
         # === MAP DISPLAY ===
         map_frame = ttk.LabelFrame(main_frame, text="🗺️ Live GPS Map", padding=5)
         map_frame.pack(fill=tk.BOTH, expand=True)
+        self.map_frame = map_frame
         
         self.canvas = tk.Canvas(map_frame, bg='white', relief=tk.SUNKEN, bd=2)
         self.canvas.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        # Persistent layers, bottom to top: basemap, path/accuracy/marker, HUD text.
+        # Frames move and reconfigure these items; nothing is deleted and recreated
+        self.basemap_item = self.canvas.create_image(0, 0, anchor=tk.NW, state='hidden')
+        self.map_overlay = MapOverlay(self.canvas)
+        if self.geofences is not None:
+            self.map_overlay.set_fences(self.geofences.fences)
+        self.hud_item = self.canvas.create_text(0, 0, text="", fill="red", font=('Arial', 12, 'bold'),
+                                                justify=tk.CENTER, state='hidden')
+        self.canvas.bind('<Configure>', self.on_canvas_configure)
         
         # Status bar
         self.status_var = tk.StringVar(value="Ready - Enable Live Tracking to start")
         ttk.Label(main_frame, textvariable=self.status_var, 
                  relief=tk.SUNKEN, anchor=tk.W).pack(fill=tk.X, pady=(5, 0))
         
-        # Initialize
-        self.update_map()
+        # Initialize: the saved snapshot (if any) is the first frame; the first basemap
+        # request, and with it Pillow, requests and the network, waits until the window is up
+        self.show_snapshot()
+        self.root.after(self.startup_map_delay, self.update_map)
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         
         # Auto-check for GPS file
         self.root.after(2000, self.auto_check_gps)
+        self.root.after(self.device_refresh_interval, self.refresh_device_list)
+        
+    @property
+    def http(self):
+        """Shared keep-alive session, created on first use (any thread)"""
+        with self.lazy_lock:
+            if self._http is None:
+                from tile_engine import USER_AGENT
+                self._http = create_session(pool_size=4, user_agent=USER_AGENT)
+            return self._http
+    
+    @property
+    def image_pipeline(self):
+        """Basemap decode/scale caches, created on first use (any thread)"""
+        with self.lazy_lock:
+            if self._image_pipeline is None:
+                from image_pipeline import ImagePipeline
+                self._image_pipeline = ImagePipeline()
+            return self._image_pipeline
+    
+    def show_snapshot(self):
+        """Fast start: show the basemap saved at the last exit as the cached basemap"""
+        snapshot = self.saved_state.get('snapshot') if self.saved_state else None
+        if snapshot is None or tuple(snapshot['key']) != self.get_basemap_key():
+            return False
+        try:
+            # Tk decodes the PNG itself: no Pillow needed for the first frame
+            photo = tk.PhotoImage(file=snapshot_path(self.state_file))
+        except tk.TclError as e:
+            print(f"Cannot load the basemap snapshot: {e}")
+            return False
         
+        self.root.update_idletasks()  # lay the window out so the canvas has its size
+        x, y = self.basemap_position((photo.width(), photo.height()))
+        self.snapshot_photo = photo  # Tk keeps no reference of its own
+        self.canvas.coords(self.basemap_item, x, y)
+        self.canvas.itemconfigure(self.basemap_item, image=photo, state='normal')
+        self.basemap_view = snapshot_view(snapshot)
+        self.basemap_offset = (x, y)
+        self.basemap_key = self.get_basemap_key()
+        self.viewport_size = tuple(snapshot['viewport'])
+        self.draw_overlay()
+        self.status_var.set("Restored the last map view - Enable Live Tracking to start")
+        return True
+    
+    def save_viewer_state(self):
+        """Remember the viewport and the basemap on screen for the next start"""
+        if self.state_file is None:
+            return
+        snapshot = None
+        if self.basemap_view is not None and self.basemap_key is not None:
+            snapshot = snapshot_info(self.basemap_view, self.basemap_key, self.viewport_size)
+        try:
+            save_state(self.state_file, self.latitude, self.longitude, self.zoom_var.get(),
+                       self.map_type_var.get(), self.map_source_var.get(), snapshot, self.basemap_image)
+        except Exception as e:
+            print(f"Error saving viewer state: {e}")
+    
     def create_info_labels(self, parent):
         """Create GPS information labels"""
         ttk.Label(parent, text="📍 Location:", font=('Arial', 11, 'bold')).pack(anchor=tk.W)
@@ -164,12 +442,26 @@ class LiveGPSMapsViewer:
         
         self.last_update_label = ttk.Label(parent, text="Last Update: Never", font=('Arial', 10))
         self.last_update_label.pack(anchor=tk.W)
+        
+        self.speed_label = ttk.Label(parent, text="Speed: --", font=('Arial', 10))
+        self.speed_label.pack(anchor=tk.W)
+        
+        self.heading_label = ttk.Label(parent, text="Heading: --", font=('Arial', 10))
+        self.heading_label.pack(anchor=tk.W)
+        
+        self.distance_label = ttk.Label(parent, text="Distance: 0 m", font=('Arial', 10))
+        self.distance_label.pack(anchor=tk.W)
+        
+        self.geofence_label = ttk.Label(parent, text="Geofence: No alerts", font=('Arial', 10))
+        self.geofence_label.pack(anchor=tk.W)
     
     def toggle_live_gps(self):
         """Toggle live GPS tracking"""
         self.live_gps_enabled = self.live_gps_var.get()
         
         if self.live_gps_enabled:
+            if self.playback_track is not None:
+                self.close_playback()
             self.start_gps_monitoring()
         else:
             self.stop_gps_monitoring()
@@ -187,11 +479,22 @@ class LiveGPSMapsViewer:
     def stop_gps_monitoring(self):
         """Stop GPS monitoring"""
         self.live_gps_enabled = False
+        response = self.stream_response
+        if response is not None:
+            # Unblocks the stream thread waiting on the socket
+            response.close()
         self.gps_status_label.config(text="🔴 Monitoring Stopped", foreground='red')
         self.status_var.set("GPS monitoring stopped")
     
     def gps_monitoring_loop(self):
         """Background GPS monitoring loop"""
+        if self.gps_source == 'stream':
+            self.stream_monitoring_loop()
+            return
+        if self.gps_source == 'fleet':
+            self.fleet_monitoring_loop()
+            return
+        
         consecutive_failures = 0
         
         while self.live_gps_enabled:
@@ -199,8 +502,7 @@ class LiveGPSMapsViewer:
                 if self.read_gps_coordinates():
                     consecutive_failures = 0
                     # Update GUI in main thread
-                    self.root.after(0, self.update_gps_display)
-                    self.root.after(0, self.update_map)
+                    self.request_frame()
                 else:
                     consecutive_failures += 1
                 
@@ -216,44 +518,351 @@ class LiveGPSMapsViewer:
                 print(f"GPS monitoring error: {e}")
                 consecutive_failures += 1
             
+            if self.gps_source == 'tracklog':
+                # Track log records are read straight from the mapping, no syscalls
+                time.sleep(self.gps_check_interval)
+            else:
+                # Wakes up as soon as the file changes; a timeout counts as "no new data"
+                self.gps_watcher.wait(self.gps_file_version or 0, self.gps_check_interval)
+    
+    def stream_monitoring_loop(self):
+        """Follow the server's Server-Sent Events stream; wakes up as soon as a fix arrives"""
+        import requests
+        
+        retry_delay = 1
+        
+        while self.live_gps_enabled:
+            try:
+                params = {'device': self.stream_device} if self.stream_device else {}
+                headers = {'Accept': 'text/event-stream'}
+                if self.stream_last_seq is not None:
+                    # Resume where we left off after a reconnect
+                    headers['Last-Event-ID'] = str(self.stream_last_seq)
+                
+                self.stream_response = requests.get(f"{self.server_url}/stream", params=params,
+                                                    headers=headers, stream=True, timeout=(5, 60))
+                self.stream_response.raise_for_status()
+                retry_delay = 1
+                self.root.after(0, lambda: self.gps_status_label.config(
+                    text="🟡 Stream Connected", foreground='orange'))
+                
+                for event, event_id, data in self.iter_sse_events(self.stream_response):
+                    if not self.live_gps_enabled:
+                        break
+                    if event_id is not None:
+                        self.stream_last_seq = event_id
+                    if event == 'fix' and self.apply_fix(json.loads(data)):
+                        self.request_frame()
+                    elif event == 'alert':
+                        self.add_alerts([json.loads(data)])
+                        self.request_frame()
+                
+            except Exception as e:
+                if not self.live_gps_enabled:
+                    break
+                print(f"GPS stream error: {e}")
+                self.root.after(0, lambda: self.gps_status_label.config(
+                    text="🔴 Stream Disconnected", foreground='red'))
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 30)
+            finally:
+                if self.stream_response is not None:
+                    self.stream_response.close()
+                    self.stream_response = None
+    
+    def fleet_monitoring_loop(self):
+        """Poll the server's fleet endpoint: the latest fix of every device in one request"""
+        fix_counts = {}  # device_id -> fix_count of the snapshot applied last
+        
+        while self.live_gps_enabled:
+            try:
+                response = self.http.get(f"{self.server_url}/devices", timeout=5)
+                response.raise_for_status()
+                updated = False
+                for device_id, snapshot in response.json()['devices'].items():
+                    if fix_counts.get(device_id) == snapshot['fix_count']:
+                        continue  # no new fix from this device since the last poll
+                    fix_counts[device_id] = snapshot['fix_count']
+                    fix = dict(snapshot, server_received_at=snapshot['received_at'])
+                    updated = self.apply_fix(fix) or updated
+                if updated:
+                    self.request_frame()
+                
+            except Exception as e:
+                print(f"GPS fleet poll error: {e}")
+                self.root.after(0, lambda: self.gps_status_label.config(
+                    text="🔴 Server Unreachable", foreground='red'))
+            
             time.sleep(self.gps_check_interval)
     
+    def request_frame(self):
+        """Ask for a redraw (any thread); requests made while one is pending are merged"""
+        with self.frame_lock:
+            if self.frame_pending:
+                return
+            self.frame_pending = True
+        self.root.after(0, self.schedule_frame)
+    
+    def schedule_frame(self):
+        """Run the pending frame now, or as soon as the frame-rate cap allows"""
+        delay = self.last_frame_at + 1.0 / self.max_fps - time.perf_counter()
+        self.root.after(max(int(delay * 1000), 0), self.run_frame)
+    
+    def run_frame(self):
+        with self.frame_lock:
+            self.frame_pending = False
+        self.last_frame_at = time.perf_counter()
+        self.update_gps_display()
+        self.update_map()
+        self.schedule_prefetch()
+    
+    @staticmethod
+    def iter_sse_events(response):
+        """Parse a text/event-stream response into (event, id, data) tuples"""
+        event, event_id, data = 'message', None, []
+        for line in response.iter_lines(decode_unicode=True):
+            if line is None:
+                continue
+            if line == '':
+                if data:
+                    yield event, event_id, '\n'.join(data)
+                event, data = 'message', []
+            elif line.startswith(':'):
+                continue  # keep-alive comment
+            else:
+                field, _, value = line.partition(':')
+                value = value[1:] if value.startswith(' ') else value
+                if field == 'event':
+                    event = value
+                elif field == 'data':
+                    data.append(value)
+                elif field == 'id' and value.isdigit():
+                    event_id = int(value)
+    
     def read_gps_coordinates(self):
         """Read GPS coordinates from Flutter-generated file"""
+        if self.gps_source == 'tracklog':
+            return self.read_track_log()
+        
         try:
-            if not os.path.exists(self.gps_file):
+            version = self.gps_watcher.version
+            if version == self.gps_file_version:
+                return False  # unchanged since the last parse
+            self.gps_file_version = version
+            
+            if not self.gps_watcher.exists():
                 return False
             
             with open(self.gps_file, 'r') as f:
                 data = json.load(f)
             
-            new_lat = data.get('latitude')
-            new_lon = data.get('longitude')
-            timestamp = data.get('timestamp')
-            accuracy = data.get('accuracy')
-            
-            if new_lat is not None and new_lon is not None:
-                # Check if coordinates changed significantly
-                lat_diff = abs(self.latitude - new_lat) if self.latitude else 1
-                lon_diff = abs(self.longitude - new_lon) if self.longitude else 1
-                
-                if lat_diff > 0.00001 or lon_diff > 0.00001:  # ~1 meter accuracy
-                    self.latitude = float(new_lat)
-                    self.longitude = float(new_lon)
-                    self.accuracy = accuracy
-                    self.last_update = timestamp
-                    self.add_to_history(self.latitude, self.longitude)
-                    return True
+            return self.apply_fix(data)
             
+        except Exception as e:
+            print(f"Error reading GPS file: {e}")
             return False
+    
+    def read_track_log(self):
+        """Read all fixes appended to the track log since the last call"""
+        try:
+            if self.track_log_reader is None:
+                reader = TrackLogReader(self.track_log_dir)
+                if not reader.seek_latest():
+                    return False
+                self.track_log_reader = reader
+            
+            # Zero-copy view of the new records; converted before the next read
+            fixes = records_to_fixes(self.track_log_reader.read_new())
+            self.derived.update_many(fixes)  # vectorized when a catch-up brings many fixes
+            self.check_geofences(fixes)
+            updated = False
+            for fix in fixes:
+                updated = self.apply_fix(fix, derive=False) or updated
+            return updated
             
         except Exception as e:
-            print(f"Error reading GPS file: {e}")
+            print(f"Error reading track log: {e}")
             return False
     
+    def apply_fix(self, data, derive=True):
+        """Filter a fix dict into its device's track; True if that visibly changes the map"""
+        new_lat = data.get('latitude')
+        new_lon = data.get('longitude')
+        timestamp = data.get('timestamp')
+        accuracy = data.get('accuracy')
+        
+        if new_lat is not None and new_lon is not None:
+            # Every fix counts for the derived metrics (stop time too), moved or not
+            if derive:
+                self.derived.update(data)
+                self.check_geofences([data])
+            track = self.get_device_track(data.get('device_id') or DEFAULT_DEVICE_ID)
+            track.last_fix_at = time.time()
+            
+            filtered = track.fix_filter.update_fix(data)
+            if not filtered.accepted:
+                self.fix_outliers.inc()
+                return False
+            
+            # Every accepted fix goes into the track; only the redraw waits until the
+            # marker or accuracy circle has moved by a pixel or more since it was drawn
+            track.latitude = filtered.lat
+            track.longitude = filtered.lon
+            track.accuracy = accuracy
+            track.last_update = timestamp
+            track.history.append(filtered.lat, filtered.lon, time.time())
+            self.last_fix_at = track.last_fix_at
+            shown_lat, shown_lon, shown_accuracy = track.shown or (None, None, None)
+            redraw = should_redraw(shown_lat, shown_lon, shown_accuracy, filtered.lat, filtered.lon,
+                                   accuracy, self.zoom_level)
+            if redraw:
+                track.shown = (filtered.lat, filtered.lon, accuracy)
+            else:
+                self.fixes_suppressed.inc()
+            if self.current_device is None:
+                self.follow_device(track.device_id)
+                return True
+            with self.devices_lock:
+                followed = track.device_id == self.current_device
+                if followed:
+                    self.latitude = track.latitude
+                    self.longitude = track.longitude
+                    self.accuracy = track.accuracy
+                    self.last_update = track.last_update
+            if followed and redraw:
+                self.stamp_fix(data)
+            return redraw
+        
+        return False
+    
+    def device_tracks(self):
+        """Snapshot of every DeviceTrack, safe to iterate while the GPS thread adds devices"""
+        with self.devices_lock:
+            return list(self.devices.values())
+    
+    def get_device_track(self, device_id):
+        """A device's DeviceTrack, created (with the next palette colour) on its first fix"""
+        with self.devices_lock:
+            track = self.devices.get(device_id)
+            if track is None:
+                track = DeviceTrack(device_id, PALETTE[len(self.devices) % len(PALETTE)])
+                if not self.devices:
+                    track.layer = self.map_overlay  # the first device keeps the original overlay
+                self.devices[device_id] = track
+            return track
+    
+    def follow_device(self, device_id):
+        """Mirror a device into the displayed position/history; the map re-centres on it"""
+        with self.devices_lock:
+            track = self.devices.get(device_id)
+            if track is None or device_id == self.current_device:
+                return
+            self.current_device = device_id
+            self.location_history = track.history
+            if track.latitude is not None:
+                self.latitude = track.latitude
+                self.longitude = track.longitude
+                self.accuracy = track.accuracy
+                self.last_update = track.last_update
+        self.prefetch_center = None  # planned for the previous device's motion
+        self.request_frame()
+    
+    def on_device_select(self, event):
+        selection = self.device_tree.selection()
+        if selection:
+            self.follow_device(selection[0])
+    
+    def refresh_device_list(self):
+        """Update the device list: staleness, speed and fix count per device"""
+        now = time.time()
+        for track in self.device_tracks():
+            indicator, age = staleness(track.last_fix_at, now)
+            device_metrics = self.derived.get(track.device_id)
+            speed = (f"{device_metrics.speed * 3.6:.1f} km/h"
+                     if device_metrics is not None and device_metrics.speed is not None else "--")
+            values = (f"{indicator} {age}", speed, len(track.history))
+            if self.device_tree.exists(track.device_id):
+                self.device_tree.item(track.device_id, values=values)
+            else:
+                self.device_tree.tag_configure(track.device_id, foreground=track.color)
+                self.device_tree.insert('', tk.END, iid=track.device_id, text=f"● {track.device_id}",
+                                        values=values, tags=(track.device_id,))
+        if self.current_device is not None and self.device_tree.exists(self.current_device) and \
+                self.device_tree.selection() != (self.current_device,):
+            self.device_tree.selection_set(self.current_device)
+        
+        self.root.after(self.device_refresh_interval, self.refresh_device_list)
+    
+    def reset_devices(self):
+        """Forget every device's track and remove the extra layers (Tk thread)"""
+        with self.devices_lock:
+            tracks = list(self.devices.values())
+            self.devices = {}
+            self.current_device = None
+            self.location_history = TrackHistory()
+        for track in tracks:
+            if track.layer is self.map_overlay:
+                track.layer.hide()
+            elif track.layer is not None:
+                track.layer.delete()
+        self.device_tree.delete(*self.device_tree.get_children())
+    
+    def check_geofences(self, fixes):
+        """Local geofence check of fixes read from the file or track log"""
+        if self.geofences is not None and self.gps_source != 'stream':
+            self.add_alerts(self.geofences.process(fixes))
+    
+    def add_alerts(self, alerts):
+        """Record geofence alerts (local or pushed by the server); shown on the next frame"""
+        for alert in alerts:
+            self.alerts.append(alert)
+            key = (alert['device_id'], alert['fence_id'])
+            if alert['violation']:
+                self.fence_violations[key] = alert
+                print(f"🚨 Geofence: {alert['device_id']} {alert['transition']} {alert['fence']} ({alert['kind']})")
+            else:
+                self.fence_violations.pop(key, None)
+    
+    def stamp_fix(self, data):
+        """Record the read stage of an accepted fix; later stages are stamped on display"""
+        read_at = time.time()
+        stamps = {
+            'device': parse_timestamp(data.get('timestamp')),
+            'server': data.get('server_received_at'),
+            'read': read_at
+        }
+        if stamps['server']:
+            self.metrics.histogram('viewer_server_to_read_seconds',
+                                   "Server receive to viewer read").observe(max(read_at - stamps['server'], 0.0))
+        self.pending_stamps = stamps
+    
+    def mark_displayed(self, stamps):
+        """Runs after Tk has redrawn the canvas: closes the stage stamps of a fix"""
+        stamps['displayed'] = time.time()
+        self.metrics.histogram('viewer_read_to_ready_seconds',
+                               "Viewer read to overlay ready").observe(stamps['ready'] - stamps['read'])
+        self.metrics.histogram('viewer_ready_to_displayed_seconds',
+                               "Overlay ready to canvas displayed").observe(stamps['displayed'] - stamps['ready'])
+        if stamps['device'] == stamps['device']:  # NaN when the device sent no usable timestamp
+            self.metrics.histogram('viewer_device_to_displayed_seconds',
+                                   "Device timestamp to canvas displayed (end to end)").observe(
+                max(stamps['displayed'] - stamps['device'], 0.0))
+    
+    def gps_source_exists(self):
+        """Whether the configured GPS source (file or track log) is present"""
+        if self.gps_source == 'tracklog':
+            return os.path.isdir(self.track_log_dir) and bool(os.listdir(self.track_log_dir))
+        if self.gps_source in ('stream', 'fleet'):
+            return False  # nothing local to look at; use "Test Server" instead
+        return self.gps_watcher.exists()
+    
     def auto_check_gps(self):
         """Automatically check for GPS file periodically"""
-        if os.path.exists(self.gps_file) and not self.live_gps_enabled:
+        if not self.live_gps_enabled:
+            # Non-blocking; with inotify this only stats the file if an event came in
+            self.gps_watcher.check()
+        
+        if self.gps_source_exists() and not self.live_gps_enabled:
             self.gps_status_label.config(text="🟢 GPS File Found", foreground='green')
             self.status_var.set("GPS file detected - Enable Live Tracking to start monitoring")
         
@@ -262,8 +871,10 @@ class LiveGPSMapsViewer:
     
     def test_server_connection(self):
         """Test connection to Flask server"""
+        import requests
+        
         try:
-            response = requests.get("http://localhost:5000/health", timeout=5)
+            response = requests.get(f"{self.server_url}/health", timeout=5)
             if response.status_code == 200:
                 messagebox.showinfo("Server Test", "✅ Flask server is running and accessible!")
             else:
@@ -273,6 +884,58 @@ class LiveGPSMapsViewer:
         except Exception as e:
             messagebox.showerror("Server Test", f"❌ Error testing server: {e}")
     
+    def open_diagnostics(self):
+        """Show viewer and server latency histograms (p50/p95/p99) in a panel"""
+        if self.diagnostics_window is not None and self.diagnostics_window.winfo_exists():
+            self.diagnostics_window.lift()
+            return
+        
+        window = tk.Toplevel(self.root)
+        window.title("📈 Pipeline Diagnostics")
+        window.geometry("760x420")
+        columns = ('count', 'mean', 'p50', 'p95', 'p99')
+        tree = ttk.Treeview(window, columns=columns)
+        tree.heading('#0', text='Metric')
+        tree.column('#0', width=330)
+        for column in columns:
+            tree.heading(column, text=column)
+            tree.column(column, width=80, anchor=tk.E)
+        tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.diagnostics_window = window
+        self.diagnostics_tree = tree
+        self.refresh_diagnostics()
+    
+    def fetch_server_metrics(self):
+        """Pull the server's histogram summaries (background thread)"""
+        try:
+            response = self.http.get(f"{self.server_url}/metrics", params={'format': 'json'}, timeout=2)
+            self.server_metrics = response.json().get('metrics', {})
+        except Exception:
+            self.server_metrics = {}
+    
+    def refresh_diagnostics(self):
+        """Refresh the diagnostics panel every second while it is open"""
+        if self.diagnostics_window is None or not self.diagnostics_window.winfo_exists():
+            self.diagnostics_window = None
+            return
+        
+        def fmt(value, is_time):
+            if value is None:
+                return '-'
+            return f"{value * 1000:.1f} ms" if is_time else str(value)
+        
+        tree = self.diagnostics_tree
+        tree.delete(*tree.get_children())
+        for source, summary in (('viewer', self.metrics.summary()), ('server', self.server_metrics)):
+            for name, values in summary.items():
+                is_time = 'seconds' in name
+                tree.insert('', tk.END, text=f"[{source}] {name}",
+                            values=(values.get('count'),) + tuple(fmt(values.get(key), is_time)
+                                                                 for key in ('mean', 'p50', 'p95', 'p99')))
+        
+        threading.Thread(target=self.fetch_server_metrics, daemon=True).start()
+        self.root.after(1000, self.refresh_diagnostics)
+    
     def check_gps_file(self):
         """Check GPS file status"""
         if os.path.exists(self.gps_file):
@@ -320,149 +983,534 @@ class LiveGPSMapsViewer:
             except:
                 self.last_update_label.config(text=f"Last Update: {self.last_update}")
         
-        self.location_name = "Live Flutter GPS"
+        self.location_name = "Mission Playback" if self.playback_track is not None else "Live Flutter GPS"
         self.location_info_label.config(text=self.location_name)
+        
+        if self.playback_track is not None:
+            device_metrics = self.playback_metrics()
+        else:
+            device_metrics = self.derived.get(self.current_device) if self.current_device else None
+        if device_metrics is not None and device_metrics.speed is not None:
+            self.speed_label.config(text=f"Speed: {device_metrics.speed * 3.6:.1f} km/h "
+                                         f"(avg {device_metrics.speed_avg * 3.6:.1f})")
+            if device_metrics.moving:
+                motion = "moving"
+            else:
+                motion = f"stopped {self.format_duration(device_metrics.stationary_seconds)}"
+            heading = (f"{device_metrics.heading:.0f}° {self.compass_point(device_metrics.heading)}"
+                       if device_metrics.heading is not None else "--")
+            self.heading_label.config(text=f"Heading: {heading} ({motion})")
+            distance = device_metrics.distance
+            self.distance_label.config(text=f"Distance: {distance / 1000:.2f} km" if distance >= 1000
+                                       else f"Distance: {distance:.0f} m")
+        
+        violations = list(self.fence_violations.values())
+        if violations:
+            text = ", ".join(f"{alert['device_id']} {'inside' if alert['transition'] == 'enter' else 'outside'} "
+                             f"{alert['fence']}" for alert in violations[-3:])
+            more = f" (+{len(violations) - 3} more)" if len(violations) > 3 else ""
+            self.geofence_label.config(text=f"🚨 Geofence: {text}{more}", foreground='red')
+        elif self.alerts:
+            last = self.alerts[-1]
+            self.geofence_label.config(text=f"✅ Geofence: all clear (last: {last['device_id']} "
+                                            f"{last['transition']} {last['fence']})", foreground='green')
+    
+    @staticmethod
+    def compass_point(heading):
+        return ['N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW'][int((heading + 22.5) // 45) % 8]
     
-    def add_to_history(self, lat, lon):
-        """Add location to tracking history"""
-        self.location_history.append((lat, lon, time.time()))
-        if len(self.location_history) > self.max_history:
-            self.location_history.pop(0)
+    @staticmethod
+    def format_duration(seconds):
+        minutes, seconds = divmod(int(seconds), 60)
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours}h {minutes:02d}m" if hours else f"{minutes}m {seconds:02d}s" if minutes else f"{seconds}s"
+    
+    def open_playback(self):
+        """Load one device's track from an archive and switch from live tracking to playback"""
+        path = filedialog.askopenfilename(title="Open mission archive",
+                                          filetypes=[("Track archives", "*.arctrk"), ("All files", "*")])
+        if not path:
+            return
+        try:
+            archive = TrackArchive(path)
+            # The followed device if the archive has it, else the one with the most fixes
+            device_id = self.stream_device if self.stream_device in archive.devices else max(
+                archive.devices, key=archive.count)
+            track = archive.load(device_id)
+            archive.close()
+            if not len(track['time']):
+                raise ValueError("the archive holds no fixes")
+        except Exception as e:
+            messagebox.showerror("Playback", f"❌ Cannot open {path}: {e}")
+            return
+        
+        if self.live_gps_enabled:
+            self.live_gps_var.set(False)
+            self.stop_gps_monitoring()
+        self.close_playback()
+        
+        # Derived metrics of every fix in one vectorized pass; scrubbing just indexes them
+        # (metric_index: the last fix at or before each one that produced values)
+        series, _ = recompute(track['latitude'], track['longitude'], track['time'], initial_metrics(device_id))
+        track.update(series)
+        track['metric_index'] = np.maximum.accumulate(
+            np.where(np.isnan(series['speed']), -1, np.arange(len(track['time']))))
+        self.playback_track = track
+        self.reset_devices()
+        self.get_device_track(device_id)
+        self.follow_device(device_id)
+        self.playback_shown = 0
+        
+        start, end = track['time'][0], track['time'][-1]
+        self.playback_scale.configure(from_=0, to=max(end - start, 1e-3))
+        self.playback_frame.pack(fill=tk.X, pady=(0, 10), before=self.map_frame)
+        self.seek_playback(start)
+        self.status_var.set(f"Playback: {device_id}, {len(track['time'])} fixes over "
+                            f"{self.format_duration(end - start)} from {os.path.basename(path)}")
+    
+    def close_playback(self):
+        """Leave playback mode (the history is cleared for live tracking)"""
+        if self.playback_track is None:
+            return
+        self.pause_playback()
+        self.playback_frame.pack_forget()
+        self.playback_track = None
+        self.playback_time = None
+        self.reset_devices()
+        self.request_frame()
+    
+    def toggle_playback(self):
+        if self.playback_playing:
+            self.pause_playback()
+            return
+        if self.playback_track is None:
+            return
+        if self.playback_time >= self.playback_track['time'][-1]:
+            self.seek_playback(self.playback_track['time'][0])  # replay from the start
+        self.playback_playing = True
+        self.playback_clock = time.perf_counter()
+        self.playback_button.config(text="⏸ Pause")
+        self.playback_job = self.root.after(self.playback_tick, self.step_playback)
+    
+    def pause_playback(self):
+        self.playback_playing = False
+        if self.playback_job is not None:
+            self.root.after_cancel(self.playback_job)
+            self.playback_job = None
+        self.playback_button.config(text="▶ Play")
+    
+    def step_playback(self):
+        """Advance the playhead by the wall-clock time since the last step times the speed"""
+        self.playback_job = None
+        now = time.perf_counter()
+        speed = float(self.playback_speed_var.get().rstrip('x'))
+        target = self.playback_time + (now - self.playback_clock) * speed
+        self.playback_clock = now
+        end = self.playback_track['time'][-1]
+        self.seek_playback(min(target, end))
+        if target >= end:
+            self.pause_playback()
+        else:
+            self.playback_job = self.root.after(self.playback_tick, self.step_playback)
+    
+    def on_playback_scrub(self, value):
+        """Scale dragged: jump to that offset from the mission start"""
+        if self.playback_track is not None:
+            mission_time = self.playback_track['time'][0] + float(value)
+            if abs(mission_time - self.playback_time) > 1e-3:  # not our own playback_var update
+                self.seek_playback(mission_time)
+    
+    def seek_playback(self, mission_time):
+        """Show the track up to mission_time: extend or truncate the history, then redraw"""
+        track = self.playback_track
+        times = track['time']
+        shown = max(int(np.searchsorted(times, mission_time, side='right')), 1)
+        if shown > self.playback_shown:
+            self.location_history.extend(track['latitude'][self.playback_shown:shown],
+                                         track['longitude'][self.playback_shown:shown],
+                                         times[self.playback_shown:shown])
+        else:
+            self.location_history.truncate(shown)
+        self.playback_shown = shown
+        self.playback_time = mission_time
+        
+        last = shown - 1
+        accuracy = track['accuracy'][last]
+        self.latitude = float(track['latitude'][last])
+        self.longitude = float(track['longitude'][last])
+        self.accuracy = None if np.isnan(accuracy) else float(accuracy)
+        self.last_update = datetime.fromtimestamp(times[last], timezone.utc).isoformat()
+        
+        self.playback_var.set(mission_time - times[0])
+        clock = datetime.fromtimestamp(mission_time).strftime("%Y-%m-%d %H:%M:%S")
+        self.playback_time_label.config(text=f"{clock} (+{self.format_duration(mission_time - times[0])}) "
+                                             f"{shown}/{len(times)}")
+        self.request_frame()
+    
+    def playback_metrics(self):
+        """DeviceMetrics at the playhead, from the precomputed series"""
+        track = self.playback_track
+        last = self.playback_shown - 1
+        i = track['metric_index'][last]
+        if i < 0:
+            return None
+        heading = track['heading'][i]
+        return DeviceMetrics(self.current_device, float(track['latitude'][i]), float(track['longitude'][i]),
+                             float(track['time'][i]), float(track['speed'][i]), float(track['speed_avg'][i]),
+                             None if np.isnan(heading) else float(heading), float(track['distance'][i]),
+                             float(track['stationary_seconds'][i]), bool(track['moving'][i]), last + 1)
     
     def clear_history(self):
-        """Clear location history"""
+        """Clear location history (of every device)"""
+        for track in self.device_tracks():
+            track.history.clear()
         self.location_history.clear()
         self.update_map()
         self.status_var.set("Location history cleared")
     
-    def get_static_map_url(self):
-        """Generate Google Static Maps API URL"""
-        base_url = "https://maps.googleapis.com/maps/api/staticmap"
-        
-        params = {
-            'center': f"{self.latitude},{self.longitude}",
-            'zoom': self.zoom_var.get(),
-            'size': self.map_size,
-            'scale': self.scale,
-            'maptype': self.map_type_var.get(),
-            'key': self.api_key
-        }
+    def get_tile_provider(self, map_type):
+        """Tile provider (and its caches) for a map type, created on first use"""
+        from tile_engine import TileProvider, DEFAULT_CACHE_DIR
         
-        # Current location marker (red)
-        markers = f"color:red|label:📱|{self.latitude},{self.longitude}"
-        
-        # Add path from history
-        if len(self.location_history) > 1:
-            path_coords = [f"{lat},{lon}" for lat, lon, _ in self.location_history]
-            if path_coords:
-                params['path'] = "color:blue|weight:3|" + "|".join(path_coords)
+        with self.tile_provider_lock:
+            provider = self.tile_providers.get(map_type)
+            if provider is None:
+                provider = TileProvider(map_type, self.tile_cache_dir or DEFAULT_CACHE_DIR,
+                                        offline=self.tile_offline, session=self.http)
+                self.tile_providers[map_type] = provider
+            return provider
+    
+    def toggle_tile_offline(self):
+        """Switch tile providers between cache-only and cache+network"""
+        self.tile_offline = self.tile_offline_var.get()
+        for provider in self.tile_providers.values():
+            provider.offline = self.tile_offline
+        self.update_map(force=True)
+    
+    def get_basemap_source(self, key):
+        """Basemap source (see map_renderer) for a (source, map type, zoom) key"""
+        from map_renderer import TileBasemap, StaticMapsBasemap
         
-        params['markers'] = markers
+        source, map_type, _ = key
+        if source == 'tiles':
+            return TileBasemap(self.get_tile_provider(map_type))
+        return StaticMapsBasemap(self.api_key, self.http, map_type, self.map_size, self.scale)
+    
+    def get_viewport_size(self):
+        """Basemap size for the canvas (read on the Tk thread, never by the render worker)"""
+        return max(self.canvas.winfo_width(), 800), max(self.canvas.winfo_height(), 600)
+    
+    def get_render_quality(self):
+        """'fast' resampling while fixes are streaming in, 'high' when idle"""
+        if self.live_gps_enabled and time.time() - self.last_fix_at < self.live_quality_window:
+            return 'fast'
+        if self.playback_playing:
+            return 'fast'
+        return 'high'
+    
+    def on_canvas_configure(self, event):
+        """Re-render (and re-scale) the basemap only when the canvas size really changed"""
+        if self.viewport_size is not None and self.get_viewport_size() != self.viewport_size:
+            self.update_map(force=True)
+    
+    def schedule_quality_upgrade(self):
+        """Re-request the displayed basemap at high quality once tracking goes idle"""
+        if self.upgrade_job is not None:
+            self.root.after_cancel(self.upgrade_job)
+        self.upgrade_job = self.root.after(self.idle_upgrade_delay, self.upgrade_basemap_quality)
+    
+    def upgrade_basemap_quality(self):
+        self.upgrade_job = None
+        if self.basemap_request is None or self.basemap_key != self.get_basemap_key():
+            return
+        if self.get_render_quality() == 'fast':
+            self.schedule_quality_upgrade()  # still tracking: try again later
+            return
+        # Served from the decoded cache: no download, just a LANCZOS re-scale
+        self.render_scheduler.submit(self.basemap_request[:4] + ('high',))
+    
+    def schedule_prefetch(self):
+        """Queue basemap downloads along the rover's predicted path (Tk thread)"""
+        if not self.prefetch_enabled or self.basemap_view is None:
+            return
+        key = self.get_basemap_key()
+        # Fitting every device: the view follows the fleet's bounds, not one rover's heading
+        motion = None if self.auto_fit_var.get() else estimate_motion(self.location_history, now=time.time())
+        if motion is None or key != self.basemap_key:
+            self.prefetcher.update(key, None, [])  # stationary or settings changed: drop the plan
+            return
         
-        # Build URL
-        url = base_url + "?" + "&".join([f"{key}={value}" for key, value in params.items()])
-        return url
+        source, map_type, zoom = key
+        if source == 'tiles':
+            provider = self.get_tile_provider(map_type)
+            width, height = self.viewport_size
+            # No speculative downloads from servers whose policy forbids bulk fetching (OSM)
+            jobs = [(key[:2] + tile, partial(provider.get_tile, *tile))
+                    for tile in plan_tiles(motion, zoom, width, height)] if provider.allows_bulk else []
+        else:
+            # Visible part of the current basemap in world pixels, centred on the canvas
+            view = self.basemap_view
+            ratio = view.pixel_ratio
+            visible = (min(self.canvas.winfo_width(), view.width) / ratio,
+                       min(self.canvas.winfo_height(), view.height) / ratio)
+            center_lat, center_lon = world_to_latlon(view.origin_x + view.width / ratio / 2,
+                                                     view.origin_y + view.height / ratio / 2, zoom)
+            center = plan_extent(motion, float(center_lat), float(center_lon), zoom, *visible,
+                                 margin=self.basemap_margin)
+            jobs = []
+            if center is not None:
+                previous = self.prefetch_center
+                # Keep the earlier prediction while it is still close: every frame would
+                # otherwise nudge the centre and queue another download
+                if previous is None or previous[1] != key or not extent_covers(
+                        previous[0][0], previous[0][1], center[0], center[1], zoom, *visible, margin=0.4):
+                    self.prefetch_center = (center, key, visible)
+                from map_renderer import Viewport
+                
+                (lat, lon), _, _ = self.prefetch_center
+                viewport = Viewport(lat, lon, zoom, *self.viewport_size)
+                jobs.append((key[:2] + (zoom,) + self.image_pipeline.center_key(viewport),
+                             partial(self.image_pipeline.prefetch, self.get_basemap_source(key), key[:2], viewport)))
+        self.prefetcher.update(key, motion.heading, jobs)
     
-    def download_map_image(self):
-        """Download map from Google Static Maps API"""
-        try:
-            url = self.get_static_map_url()
-            self.status_var.set("Downloading map...")
-            
-            response = requests.get(url, timeout=15)
-            response.raise_for_status()
-            
-            if 'image' not in response.headers.get('content-type', ''):
-                error_text = response.text
-                if 'API key' in error_text:
-                    raise Exception("Invalid Google Maps API key!")
-                elif 'quota' in error_text.lower():
-                    raise Exception("API quota exceeded!")
-                else:
-                    raise Exception(f"API Error: {error_text}")
-            
-            # Process image
-            image = Image.open(BytesIO(response.content))
-            
-            # Scale for display
-            canvas_width = max(self.canvas.winfo_width(), 800)
-            canvas_height = max(self.canvas.winfo_height(), 600)
-            orig_width, orig_height = image.size
-            
-            scale_factor = min(canvas_width / orig_width, canvas_height / orig_height)
-            if scale_factor > 1:
-                new_width = int(orig_width * scale_factor)
-                new_height = int(orig_height * scale_factor)
-                image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            return ImageTk.PhotoImage(image), image.size
+    def fleet_positions(self):
+        """(lats, lons) of every device with a position"""
+        tracks = [track for track in self.device_tracks() if track.latitude is not None]
+        return [track.latitude for track in tracks], [track.longitude for track in tracks]
+    
+    def view_positions(self):
+        """(lats, lons) the map must keep in view: every device when fitting, else the followed one"""
+        if self.auto_fit_var.get():
+            lats, lons = self.fleet_positions()
+            if lats:
+                return lats, lons
+        return [self.latitude], [self.longitude]
+    
+    def fit_all_devices(self):
+        """Fit All Devices: zoom so every device is in view (hysteresis of one level)"""
+        lats, lons = self.fleet_positions()
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        if len(lats) < 2 or width <= 1 or height <= 1:
+            return
+        zoom = fit_zoom(lats, lons, width, height)
+        # Zoom out as soon as a device would leave the view; zoom back in only once the
+        # fleet fits two levels closer, so devices on the edge don't flip the zoom
+        current = self.zoom_var.get()
+        if current > zoom or current < zoom - 1:
+            self.zoom_var.set(zoom)
+    
+    def basemap_center(self, key):
+        """Centre for a new basemap: a prefetched one if it covers the position, else the rover"""
+        if self.auto_fit_var.get() and len(self.fleet_positions()[0]) > 1:
+            return bounds_center(*self.fleet_positions())
+        if self.prefetch_center is not None and key[0] == 'google':
+            from map_renderer import Viewport
             
-        except Exception as e:
-            raise Exception(f"Map download failed: {str(e)}")
+            (lat, lon), prefetch_key, visible = self.prefetch_center
+            if (prefetch_key == key
+                    and extent_covers(lat, lon, self.latitude, self.longitude, key[2], *visible,
+                                      margin=self.basemap_margin)
+                    and self.image_pipeline.is_decoded(key[:2], Viewport(lat, lon, key[2], 0, 0))):
+                return lat, lon
+        return self.latitude, self.longitude
+    
+    def get_basemap_key(self):
+        """Settings that require a new basemap when they change"""
+        return (self.map_source_var.get(), self.map_type_var.get(), self.zoom_var.get())
+    
+    def basemap_covers_position(self):
+        """Whether the cached basemap still shows the position(s) with a margin to the edges"""
+        if self.basemap_view is None or self.basemap_key != self.get_basemap_key():
+            return False
+        
+        offset_x, offset_y = self.basemap_offset
+        xs, ys = self.basemap_view.project(*(np.asarray(values, dtype=float) for values in self.view_positions()))
+        xs, ys = xs + offset_x, ys + offset_y
+        
+        # Visible part of the basemap on the canvas
+        left = max(offset_x, 0)
+        top = max(offset_y, 0)
+        right = min(offset_x + self.basemap_view.width, self.canvas.winfo_width())
+        bottom = min(offset_y + self.basemap_view.height, self.canvas.winfo_height())
+        margin_x = (right - left) * self.basemap_margin
+        margin_y = (bottom - top) * self.basemap_margin
+        
+        return bool(np.all((left + margin_x <= xs) & (xs <= right - margin_x) &
+                           (top + margin_y <= ys) & (ys <= bottom - margin_y)))
     
-    def update_map_thread(self):
-        """Update map in background thread"""
+    def render_basemap(self, request):
+        """Fetch a new basemap as a Pillow image (runs on the render scheduler's worker thread)"""
+        from map_renderer import Viewport
+        
+        lat, lon, key, (width, height), quality = request
+        started = time.perf_counter()
         try:
-            photo, size = self.download_map_image()
-            self.root.after(0, self.display_map, photo, size)
-        except Exception as e:
-            self.root.after(0, self.show_error, str(e))
+            with self.prefetcher.foreground():  # prefetch workers hold back meanwhile
+                return self.image_pipeline.basemap(self.get_basemap_source(key), key[:2],
+                                                   Viewport(lat, lon, key[2], width, height), quality)
+        finally:
+            self.metrics.histogram('viewer_basemap_fetch_seconds',
+                                   "Basemap download/compose time").observe(time.perf_counter() - started)
     
-    def display_map(self, photo, size):
-        """Display map on canvas"""
+    def on_basemap_rendered(self, generation, request, result, error):
+        """Hand a finished render over to the Tk thread"""
+        if error is not None:
+            self.root.after(0, self.show_error, str(error), generation)
+        else:
+            image, view, scaled_quality = result
+            self.root.after(0, self.display_map, image, view, request, scaled_quality, generation)
+    
+    def display_map(self, image, view, request, scaled_quality=None, generation=None):
+        """Display a new basemap on canvas, then the overlay on top"""
+        if generation is not None and not self.render_scheduler.is_current(generation):
+            return  # superseded by a newer request while it was rendering
+        
         try:
-            self.canvas.delete("all")
+            # Tk objects are only ever touched here, on the Tk thread; the PhotoImage
+            # is reused (pasted into) while the basemap size stays the same
+            if self.basemap_photo is None:
+                from PIL import ImageTk
+                from image_pipeline import PhotoBuffer
+                self.basemap_photo = PhotoBuffer(ImageTk.PhotoImage)
+            photo, reused = self.basemap_photo.update(image)
+            x, y = self.basemap_position(image.size)
             
-            canvas_width = self.canvas.winfo_width()
-            canvas_height = self.canvas.winfo_height()
+            self.canvas.coords(self.basemap_item, x, y)
+            if not reused:
+                self.canvas.itemconfigure(self.basemap_item, image=photo)
+            self.canvas.itemconfigure(self.basemap_item, state='normal')
+            self.canvas.itemconfigure(self.hud_item, state='hidden')
             
-            if canvas_width > 1 and canvas_height > 1:
-                x = (canvas_width - size[0]) // 2
-                y = (canvas_height - size[1]) // 2
-            else:
-                x, y = 0, 0
-            
-            self.canvas.create_image(max(0, x), max(0, y), anchor=tk.NW, image=photo)
-            self.canvas.image = photo
+            self.basemap_view = view
+            self.basemap_image = image
+            self.basemap_offset = (x, y)
+            self.basemap_key = request[2]
+            self.basemap_request = request
+            self.draw_overlay()
             
-            timestamp = time.strftime("%H:%M:%S")
-            accuracy_info = f" (±{self.accuracy}m)" if self.accuracy else ""
-            self.status_var.set(f"Map updated at {timestamp} - GPS: {self.latitude:.6f}, {self.longitude:.6f}{accuracy_info}")
+            if scaled_quality == 'fast':
+                self.schedule_quality_upgrade()
             
         except Exception as e:
             self.show_error(f"Display error: {str(e)}")
     
-    def show_error(self, error_msg):
+    def basemap_position(self, size):
+        """Canvas position that centres a basemap of `size` (it may be larger than the canvas)"""
+        canvas_width = self.canvas.winfo_width()
+        canvas_height = self.canvas.winfo_height()
+        if canvas_width > 1 and canvas_height > 1:
+            return (canvas_width - size[0]) // 2, (canvas_height - size[1]) // 2
+        return 0, 0
+    
+    def draw_overlay(self):
+        """Draw every device's marker, accuracy circle and path on top of the cached basemap"""
+        view, offset = self.basemap_view, self.basemap_offset
+        with self.devices_lock:
+            tracks = list(self.devices.values())
+            current_device, followed_history = self.current_device, self.location_history
+            known = current_device in self.devices
+        if not known:
+            # No fix yet: the marker sits at the default position
+            lats, lons = followed_history.simplified(view.zoom, self.max_path_vertices)
+            self.map_overlay.draw(view, offset, self.latitude, self.longitude, self.accuracy,
+                                  np.column_stack((lats, lons)))
+        for track in tracks:
+            followed = track.device_id == current_device
+            if track.latitude is None and not followed:
+                continue
+            if track.layer is None:
+                track.layer = MapOverlay(self.canvas, track.color, track.color)
+                self.canvas.tag_raise(self.hud_item)
+            # The followed device is drawn from the mirrored fields (playback moves those)
+            if followed:
+                lat, lon, accuracy, history = self.latitude, self.longitude, self.accuracy, followed_history
+            else:
+                lat, lon, accuracy, history = track.latitude, track.longitude, track.accuracy, track.history
+            lats, lons = history.simplified(view.zoom, self.max_path_vertices)
+            track.layer.draw(view, offset, lat, lon, accuracy, np.column_stack((lats, lons)))
+        
+        stamps, self.pending_stamps = self.pending_stamps, None
+        if stamps is not None:
+            stamps['ready'] = time.time()
+            # Idle callbacks run after Tk's pending redraw, i.e. once the pixels are on screen
+            self.root.after_idle(self.mark_displayed, stamps)
+        
+        timestamp = time.strftime("%H:%M:%S")
+        accuracy_info = f" (±{self.accuracy}m)" if self.accuracy else ""
+        devices_info = f" - {len(tracks)} devices" if len(tracks) > 1 else ""
+        self.status_var.set(f"Map updated at {timestamp} - GPS: {self.latitude:.6f}, {self.longitude:.6f}"
+                            f"{accuracy_info}{devices_info}")
+    
+    def show_error(self, error_msg, generation=None):
         """Show error on canvas"""
-        self.canvas.delete("all")
+        if generation is not None and not self.render_scheduler.is_current(generation):
+            return
+        
+        self.basemap_view = None
+        self.canvas.itemconfigure(self.basemap_item, state='hidden')
+        self.map_overlay.hide()
+        for track in self.device_tracks():
+            if track.layer is not None:
+                track.layer.hide()
         canvas_width = max(self.canvas.winfo_width(), 400)
         canvas_height = max(self.canvas.winfo_height(), 300)
         
-        self.canvas.create_text(canvas_width//2, canvas_height//2,
-                               text=f"❌ {error_msg}", 
-                               fill="red", font=('Arial', 12, 'bold'), 
-                               width=min(600, canvas_width-50), justify=tk.CENTER)
+        self.canvas.coords(self.hud_item, canvas_width//2, canvas_height//2)
+        self.canvas.itemconfigure(self.hud_item, text=f"❌ {error_msg}", width=min(600, canvas_width-50),
+                                  state='normal')
         self.status_var.set(f"Error: {error_msg}")
     
-    def update_map(self):
-        """Update map display"""
-        if not self.api_key or self.api_key == "YOUR_GOOGLE_MAPS_API_KEY_HERE":
-            self.show_error("Please set your Google Maps API key in the code")
+    def update_map(self, force=False):
+        """Update map display: overlay only, unless a new basemap is needed (or forced)"""
+        if self.auto_fit_var.get():
+            self.fit_all_devices()
+        self.zoom_level = self.zoom_var.get()  # read by the fix filter's redraw test
+        if not force and self.basemap_covers_position():
+            self.draw_overlay()
             return
         
-        threading.Thread(target=self.update_map_thread, daemon=True).start()
+        if self.map_source_var.get() == 'google' and (
+                not self.api_key or self.api_key in ("YOUR_GOOGLE_MAPS_API_KEY_HERE",
+                                                     "INSERT_YOUR_GOOGLE_MAPS_API_KEY_HERE")):
+            self.show_error("Please set your Google Maps API key in the code\n"
+                            "(or switch Source to 'tiles' for the offline-capable tile map)")
+            return
+        
+        key = self.get_basemap_key()
+        self.viewport_size = self.get_viewport_size()
+        self.status_var.set("Rendering tiles..." if key[0] == 'tiles' else "Downloading map...")
+        lat, lon = self.basemap_center(key)
+        self.render_scheduler.submit((lat, lon, key, self.viewport_size, self.get_render_quality()))
     
     def on_closing(self):
         """Handle window closing"""
         self.live_gps_enabled = False
+        self.save_viewer_state()
+        self.close_playback()
         if self.gps_thread and self.gps_thread.is_alive():
             self.gps_thread.join(timeout=2)
+        if self.track_log_reader:
+            self.track_log_reader.close()
+        self.gps_watcher.close()
+        self.render_scheduler.close()
+        self.prefetcher.close()
+        for provider in self.tile_providers.values():
+            provider.close()
+        if self._http is not None:
+            self._http.close()
         self.root.destroy()
     
     def run(self):
         """Start the application"""
         print("🛰️ Live GPS Maps Viewer - Flutter Compatible")
-        print(f"📂 GPS data file: {self.gps_file}")
+        if self.gps_source == 'tracklog':
+            print(f"📼 GPS track log: {self.track_log_dir}")
+        elif self.gps_source == 'stream':
+            print(f"📡 GPS stream: {self.server_url}/stream")
+        elif self.gps_source == 'fleet':
+            print(f"🚙 GPS fleet: {self.server_url}/devices")
+        else:
+            print(f"📂 GPS data file: {self.gps_file}")
         print("📱 Compatible with Flutter GPS apps")
         print("🔗 Make sure Flask server is running on port 5000")
         print("=" * 60)
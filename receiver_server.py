@@ -2,40 +2,380 @@
 # FILE 1: receiver_server.py (Flask Server - Compatible with Flutter)
 # ============================================================================
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, g
+import argparse
 import json
+import logging
+import signal
+import sys
 import threading
+import time
 from datetime import datetime
 import os
+import numpy as np
+from track_log import TrackLogWriter, parse_timestamp
+from device_registry import DeviceRegistry, DEFAULT_DEVICE_ID, MAX_DEVICE_ID_BYTES
+from shared_state import SharedDeviceRegistry
+from track_store import TrackStore, MAX_PAGE_SIZE, DEFAULT_PAGE_SIZE, parse_time_arg, parse_bbox_arg
+from fix_stream import FixStream
+from latency_metrics import MetricsRegistry
+from write_behind import WriteBehindQueue
+from udp_receiver import UDPReceiver
+from derived_metrics import DerivedMetrics
+from geofence import GeofenceEngine, load_fences
+from server_logging import configure_logging, log_event
 
 app = Flask(__name__)
 
-# Global variables to store latest coordinates
-latest_coordinates = {
-    'latitude': None,
-    'longitude': None,
-    'timestamp': None,
-    'accuracy': None
-}
+# Console logging by default; production mode switches to rate-limited JSON lines
+log = logging.getLogger('gps.receiver')
+configure_logging()
+
+# Latest coordinates per device (immutable snapshots, lock-free reads).
+# GPS_STATE_BACKEND=shared keeps them in a shared-memory table instead, so every
+# worker process of a multi-process server answers from the same state
+STATE_BACKEND = os.environ.get('GPS_STATE_BACKEND', 'memory')
+if STATE_BACKEND == 'shared':
+    registry = SharedDeviceRegistry(os.environ.get('GPS_STATE_PATH'))
+else:
+    registry = DeviceRegistry()
+
+# Speed, heading, odometer and stop time per device, updated on ingest. The state is
+# per process: with the shared backend each worker would only see some of the fixes
+# (speeds over non-consecutive fixes, different answers per worker), so it is off there
+derived = DerivedMetrics() if STATE_BACKEND != 'shared' else None
+
+# Geofences (see geofence.py): enter/exit alerts per device, checked on ingest and
+# published on the fix stream as 'alert' events; off unless a fence file is given
+GEOFENCE_FILE = os.environ.get('GPS_GEOFENCE_FILE')
+geofences = GeofenceEngine(load_fences(GEOFENCE_FILE)) if GEOFENCE_FILE else None
+
+# Push stream of accepted fixes for SSE and long-poll subscribers. Its sequence is per
+# process, so with the shared backend (several workers) both endpoints answer 501
+fix_stream = FixStream()
+LONG_POLL_TIMEOUT = 25     # seconds, max wait of GET /get-coordinates?after=<seq>
+SSE_KEEPALIVE_INTERVAL = 15  # seconds between keep-alive comments on idle streams
+
+# Pipeline metrics, exposed at /metrics (Prometheus text, or ?format=json)
+metrics = MetricsRegistry()
+fixes_received = metrics.counter('gps_fixes_received_total', "Accepted GPS fixes")
+fixes_rejected = metrics.counter('gps_fixes_rejected_total', "Rejected GPS fixes")
+persist_latency = metrics.histogram('gps_persist_latency_seconds', "Time to persist a request's fixes")
+device_lag = metrics.histogram('gps_device_to_server_lag_seconds',
+                               "Server receive time minus device timestamp")
+fixes_dropped = metrics.counter('gps_fixes_dropped_total', "Fixes dropped because the write-behind queue was full")
+commit_batch_size = metrics.histogram('gps_commit_batch_fixes', "Fixes per write-behind group commit",
+                                      buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000))
+commit_delay = metrics.histogram('gps_commit_delay_seconds',
+                                 "Server receive to group commit of the oldest fix in a batch")
+geofence_alerts = metrics.counter('gps_geofence_alerts_total', "Geofence enter/exit alerts")
+TIMED_ENDPOINTS = {'receive_coordinates', 'receive_coordinates_batch', 'get_latest_coordinates',
+                   'get_fleet', 'get_device', 'server_status'}
 
 # File to store coordinates for the GUI app to read
 COORDINATES_FILE = 'live_gps_coordinates.json'
 
-def save_coordinates_to_file(lat, lon, timestamp=None, accuracy=None):
+# Storage mode: 'json' (latest fix only) or 'tracklog' (append-only segment log, full history)
+STORAGE_MODE = os.environ.get('GPS_STORAGE_MODE', 'json')
+TRACK_LOG_DIR = os.environ.get('GPS_TRACK_LOG_DIR', 'track_log')
+if STORAGE_MODE == 'tracklog' and STATE_BACKEND == 'shared':
+    # Every worker would open its own writer on the same segment and overwrite the others' records
+    raise RuntimeError("GPS_STORAGE_MODE=tracklog cannot be used with GPS_STATE_BACKEND=shared "
+                       "(several worker processes); use the json storage mode")
+track_log = TrackLogWriter(TRACK_LOG_DIR) if STORAGE_MODE == 'tracklog' else None
+
+# Queryable history (GET /track), kept in addition to the storage mode above
+TRACK_STORE_PATH = os.environ.get('GPS_TRACK_STORE')
+track_store = TrackStore(TRACK_STORE_PATH) if TRACK_STORE_PATH else None
+
+# Production mode persists through a write-behind queue (see start_write_behind);
+# None means every request writes synchronously (development default)
+write_behind = None
+
+# Binary fix packets over UDP (see udp_receiver.py); off unless a port is given
+UDP_PORT = os.environ.get('GPS_UDP_PORT')
+udp_receiver = None
+
+def save_coordinates_to_file(lat, lon, timestamp=None, accuracy=None, device_id=None, received_at=None):
     """Save coordinates to a JSON file for the GUI app to read"""
     data = {
         'latitude': float(lat),  # Ensure it's a float
         'longitude': float(lon),  # Ensure it's a float
         'timestamp': timestamp or datetime.now().isoformat(),
-        'accuracy': accuracy
+        'accuracy': accuracy,
+        'device_id': device_id or DEFAULT_DEVICE_ID,
+        'server_received_at': received_at
     }
     
     try:
-        with open(COORDINATES_FILE, 'w') as f:
+        # Write to a temp file and rename so readers never see a half-written file
+        # (per process and thread, so concurrent writers never share a temp file)
+        tmp_file = f"{COORDINATES_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_file, 'w') as f:
             json.dump(data, f, indent=2)
-        print(f"✅ Coordinates saved: Lat={lat:.6f}, Lon={lon:.6f}")
+        os.replace(tmp_file, COORDINATES_FILE)
+        log_event(log, logging.DEBUG, 'coordinates_saved', f"✅ Coordinates saved: Lat={lat:.6f}, Lon={lon:.6f}",
+                  latitude=lat, longitude=lon)
     except Exception as e:
-        print(f"❌ Error saving coordinates: {e}")
+        log_event(log, logging.ERROR, 'save_failed', f"❌ Error saving coordinates: {e}", error=str(e))
+
+def persist_fixes(fixes, received_at=None):
+    """Persist accepted fixes with one write, according to STORAGE_MODE (and the track store)"""
+    if track_store is not None:
+        try:
+            track_store.insert_many(fixes, received_at)
+        except Exception as e:
+            log_event(log, logging.ERROR, 'track_store_failed', f"❌ Error inserting into track store: {e}",
+                      error=str(e))
+    
+    if track_log is not None:
+        try:
+            seqs = track_log.append(fixes, received_at)
+            log_event(log, logging.DEBUG, 'track_log_append',
+                      f"✅ {len(fixes)} fix(es) appended to track log (seq {seqs[0]}-{seqs[-1]})",
+                      count=len(fixes), first_seq=seqs[0], last_seq=seqs[-1])
+        except Exception as e:
+            log_event(log, logging.ERROR, 'track_log_failed', f"❌ Error appending to track log: {e}",
+                      error=str(e))
+        return
+    
+    # JSON mode only keeps the latest fix
+    last_fix = fixes[-1]
+    save_coordinates_to_file(last_fix['latitude'], last_fix['longitude'],
+                             last_fix['timestamp'], last_fix['accuracy'], last_fix['device_id'],
+                             received_at if received_at is not None else last_fix.get('server_received_at'))
+
+def record_group_commit(fixes, seconds):
+    """Write-behind commit callback: commit time, batch size and queueing delay"""
+    persist_latency.observe(seconds)
+    commit_batch_size.observe(len(fixes))
+    commit_delay.observe(max(time.time() - fixes[0]['server_received_at'], 0.0))
+
+def report_commit_error(fixes, error):
+    log_event(log, logging.ERROR, 'group_commit_failed', f"❌ Group commit of {len(fixes)} fix(es) failed: {error}",
+              count=len(fixes), error=str(error))
+
+def start_write_behind(flush_interval=0.05, max_batch=5000):
+    """Persist through a background group-committing writer from now on"""
+    global write_behind
+    write_behind = WriteBehindQueue(persist_fixes, flush_interval, max_batch,
+                                    on_commit=record_group_commit, on_error=report_commit_error)
+    return write_behind
+
+def ingest_udp_fixes(items, received_at):
+    """UDP receiver callback: in-order packet payloads -> same validation and ingest as HTTP"""
+    accepted, _ = validate_fixes(items)
+    rejected = len(items) - len(accepted)
+    if rejected:
+        fixes_rejected.inc(rejected)
+        log_event(log, logging.WARNING, 'udp_fixes_rejected', f"⚠️ UDP: {rejected} fix(es) rejected",
+                  rejected=rejected)
+    if accepted:
+        seq = ingest_fixes(accepted, received_at)
+        log_event(log, logging.INFO, 'udp_fixes_received', f"📡 UDP: {len(accepted)} fix(es) accepted",
+                  accepted=len(accepted), seq=seq)
+
+def start_udp_receiver(port, host='0.0.0.0'):
+    """Accept binary fix packets on a UDP port from now on"""
+    global udp_receiver
+    udp_receiver = UDPReceiver(ingest_udp_fixes, host, port).start()
+    log_event(log, logging.INFO, 'udp_listening', f"📡 UDP fix packets on {host}:{port}", host=host, port=port)
+    return udp_receiver
+
+def shutdown_persistence():
+    """Stop UDP intake, drain the write-behind queue and close the track log (clean shutdown)"""
+    if udp_receiver is not None:
+        udp_receiver.close()
+    if write_behind is not None:
+        pending = len(write_behind)
+        write_behind.close()
+        log_event(log, logging.INFO, 'write_behind_drained', f"💾 Flushed {pending} queued fix(es)",
+                  **write_behind.stats())
+    if track_log is not None:
+        track_log.close()
+    if track_store is not None:
+        track_store.close()
+
+def request_received_at():
+    """Wall-clock time the current request arrived (now, outside of a request)"""
+    return g.get('received_at', time.time())
+
+def ingest_fixes(fixes, received_at=None):
+    """Common path for accepted fixes: stamps, latest state, persistence, push stream"""
+    received_at = received_at if received_at is not None else time.time()
+    for fix in fixes:
+        if fix.get('timestamp'):
+            lag = received_at - parse_timestamp(fix['timestamp'])
+            if lag == lag:  # skip unparseable timestamps (NaN)
+                device_lag.observe(max(lag, 0.0))
+        else:
+            fix['timestamp'] = datetime.fromtimestamp(received_at).isoformat()
+        fix['server_received_at'] = received_at
+    fixes_received.inc(len(fixes))
+    
+    registry.update_many(fixes)
+    if derived is not None:
+        derived.update_many(fixes)
+    alerts = check_geofences(fixes)
+    
+    if write_behind is not None:
+        # Never wait on disk: the writer thread group-commits the queue
+        queued = write_behind.submit(fixes)
+        if queued < len(fixes):
+            fixes_dropped.inc(len(fixes) - queued)
+            log_event(log, logging.WARNING, 'write_behind_full',
+                      f"⚠️ Write-behind queue full, {len(fixes) - queued} fix(es) not persisted",
+                      dropped=len(fixes) - queued)
+        return publish(fixes, alerts)
+    
+    persist_started = time.perf_counter()
+    persist_fixes(fixes, received_at)
+    persist_latency.observe(time.perf_counter() - persist_started)
+    persisted_at = time.time()
+    for fix in fixes:
+        fix['server_persisted_at'] = persisted_at
+    
+    return publish(fixes, alerts)
+
+def check_geofences(fixes):
+    """Enter/exit alerts caused by accepted fixes (none without a fence file)"""
+    if geofences is None:
+        return []
+    alerts = geofences.process(fixes)
+    if alerts:
+        geofence_alerts.inc(len(alerts))
+    for alert in alerts:
+        if alert['violation']:
+            log_event(log, logging.WARNING, 'geofence_violation',
+                      f"🚨 {alert['device_id']}: {alert['transition']} {alert['fence']} ({alert['kind']})",
+                      **alert)
+    return alerts
+
+def publish(fixes, alerts):
+    """Push fixes (then the alerts they caused) to subscribers; returns the last fix's seq"""
+    seq = fix_stream.publish(fixes)
+    if alerts:
+        fix_stream.publish(alerts, event='alert')
+    return seq
+
+def extract_column(items, key):
+    """Pull one numeric field out of a list of fixes as a float array (NaN = missing/invalid)"""
+    values = [item.get(key) if isinstance(item, dict) else None for item in items]
+    # JSON true/false would pass as 1.0/0.0 (bool is an int subclass): treat them as invalid
+    values = [None if isinstance(value, bool) else value for value in values]
+    try:
+        # Fast path: the whole column converts in one go (unless items hold lists,
+        # which would make it 2-D; those go through the per-item path and get rejected)
+        column = np.array(values, dtype=np.float64)
+        if column.ndim == 1:
+            return column
+    except (ValueError, TypeError):
+        pass
+    
+    column = np.full(len(values), np.nan)
+    for i, value in enumerate(values):
+        try:
+            column[i] = float(value)
+        except (ValueError, TypeError):
+            pass
+    return column
+
+def is_valid_device_id(device_id):
+    """device_id is optional; if given it must be a short non-empty string"""
+    if device_id is None:
+        return True
+    return isinstance(device_id, str) and 0 < len(device_id.encode('utf-8')) <= MAX_DEVICE_ID_BYTES
+
+def validate_fixes(items):
+    """
+    Validate a batch of fixes in one vectorized pass.
+    Returns (accepted_fixes, results) where results has one entry per input item.
+    """
+    latitudes = extract_column(items, 'latitude')
+    longitudes = extract_column(items, 'longitude')
+    accuracies = extract_column(items, 'accuracy')
+    
+    is_dict = np.array([isinstance(item, dict) for item in items], dtype=bool)
+    missing = np.array([isinstance(item, dict) and (item.get('latitude') is None or item.get('longitude') is None)
+                        for item in items], dtype=bool)
+    not_numeric = ~missing & ~(np.isfinite(latitudes) & np.isfinite(longitudes))
+    out_of_range = (np.abs(latitudes) > 90) | (np.abs(longitudes) > 180)
+    # accuracy is optional, but if given it must be a finite number >= 0
+    has_accuracy = np.array([isinstance(item, dict) and item.get('accuracy') is not None for item in items],
+                            dtype=bool)
+    bad_accuracy = has_accuracy & ~(np.isfinite(accuracies) & (accuracies >= 0))
+    bad_device = np.array([isinstance(item, dict) and not is_valid_device_id(item.get('device_id'))
+                           for item in items], dtype=bool)
+    
+    # Order matters: the first matching reason wins
+    reasons = np.select(
+        [~is_dict, missing, not_numeric, out_of_range, bad_accuracy, bad_device],
+        ["Fix must be a JSON object",
+         "Missing 'latitude' or 'longitude'",
+         "Invalid latitude or longitude format",
+         "Latitude or longitude out of range",
+         "'accuracy' must be a non-negative number",
+         f"'device_id' must be a string of at most {MAX_DEVICE_ID_BYTES} bytes"],
+        default="")
+    
+    accepted = []
+    results = []
+    for i, reason in enumerate(reasons):
+        if reason:
+            results.append({"index": i, "status": "rejected", "reason": str(reason)})
+            continue
+        item = items[i]
+        accepted.append({
+            'latitude': float(latitudes[i]),
+            'longitude': float(longitudes[i]),
+            'timestamp': item.get('timestamp'),  # defaulted to the receive time on ingest
+            'accuracy': float(accuracies[i]) if has_accuracy[i] else None,
+            'device_id': item.get('device_id') or DEFAULT_DEVICE_ID
+        })
+        results.append({"index": i, "status": "accepted"})
+    
+    return accepted, results
+
+def parse_batch_body():
+    """
+    Parse a batch request body into a list of raw items.
+    Accepts a JSON array, {"fixes": [...]}, or NDJSON (one fix per line).
+    Lines that are not valid JSON are kept as None so they get rejected per item.
+    """
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict) and isinstance(data.get('fixes'), list):
+            return data['fixes']
+        if isinstance(data, list):
+            return data
+        return None
+    
+    items = []
+    for line in request.get_data(as_text=True).splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            items.append(json.loads(line))
+        except ValueError:
+            items.append(None)
+    return items
+
+@app.before_request
+def start_request_timer():
+    """Stamp the server receive time of every request"""
+    g.received_at = time.time()
+    g.started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Handler latency per endpoint (streams and long-polls are excluded: they wait on purpose)"""
+    if request.endpoint in TIMED_ENDPOINTS and 'after' not in request.args:
+        metrics.histogram('gps_handler_latency_seconds', "Request handling time",
+                          {'endpoint': request.endpoint}).observe(time.perf_counter() - g.started)
+    if request.endpoint == 'receive_coordinates' and response.status_code == 400:
+        fixes_rejected.inc()
+    return response
 
 @app.route('/send-coordinates', methods=['POST'])
 def receive_coordinates():
@@ -45,70 +385,139 @@ def receive_coordinates():
     {
         "latitude": 23.7465,
         "longitude": 90.3763,
-        "timestamp": "2025-06-25T10:30:00.000Z"
+        "timestamp": "2025-06-25T10:30:00.000Z",
+        "device_id": "rover-1"          (optional, defaults to "default")
     }
     """
     try:
         if not request.is_json:
             return jsonify({"status": "error", "message": "Request must be JSON"}), 400
         
-        data = request.get_json()
-        latitude = data.get('latitude')
-        longitude = data.get('longitude')
-        timestamp = data.get('timestamp')
-        accuracy = data.get('accuracy')  # Optional
+        # Same validation as the batch endpoint, for a batch of one
+        accepted, results = validate_fixes([request.get_json(silent=True)])
+        if not accepted:
+            return jsonify({"status": "error", "message": results[0]['reason']}), 400
         
-        # Validate required fields
-        if latitude is None or longitude is None:
-            return jsonify({
-                "status": "error", 
-                "message": "Missing 'latitude' or 'longitude' in JSON"
-            }), 400
-        
-        # Convert to float if needed
-        try:
-            latitude = float(latitude)
-            longitude = float(longitude)
-        except (ValueError, TypeError):
-            return jsonify({
-                "status": "error", 
-                "message": "Invalid latitude or longitude format"
-            }), 400
-        
-        # Update global coordinates
-        latest_coordinates['latitude'] = latitude
-        latest_coordinates['longitude'] = longitude
-        latest_coordinates['timestamp'] = timestamp or datetime.now().isoformat()
-        latest_coordinates['accuracy'] = accuracy
+        fix = accepted[0]
+        latitude, longitude, accuracy = fix['latitude'], fix['longitude'], fix['accuracy']
         
-        # Save to file for GUI app
-        save_coordinates_to_file(latitude, longitude, timestamp, accuracy)
+        # Swap in the device's new snapshot, save to file (or track log) and notify subscribers
+        seq = ingest_fixes([fix], request_received_at())
         
-        # Print to console with timestamp
-        time_str = datetime.now().strftime("%H:%M:%S")
         accuracy_str = f", Accuracy: {accuracy}m" if accuracy else ""
-        print(f"[{time_str}] 📍 GPS: Lat={latitude:.6f}, Lon={longitude:.6f}{accuracy_str}")
+        log_event(log, logging.INFO, 'fix_received',
+                  f"📍 GPS [{fix['device_id']}]: Lat={latitude:.6f}, Lon={longitude:.6f}{accuracy_str}",
+                  device_id=fix['device_id'], latitude=latitude, longitude=longitude, accuracy=accuracy, seq=seq)
         
         return jsonify({
             "status": "success", 
             "message": "Coordinates received and saved!",
+            "seq": seq,
             "received_at": datetime.now().isoformat()
         }), 200
         
     except Exception as e:
-        print(f"❌ Error processing coordinates: {e}")
+        log_event(log, logging.ERROR, 'fix_failed', f"❌ Error processing coordinates: {e}", error=str(e))
         return jsonify({
             "status": "error", 
             "message": f"Server error: {str(e)}"
         }), 500
 
+@app.route('/send-coordinates/batch', methods=['POST'])
+def receive_coordinates_batch():
+    """
+    Receive many GPS fixes in one request (e.g. a replay after a link dropout).
+    Body is a JSON array of fixes, {"fixes": [...]}, or NDJSON with one fix per line.
+    Latest state is updated once per device and the batch is persisted in one write.
+    """
+    try:
+        items = parse_batch_body()
+        if items is None:
+            return jsonify({
+                "status": "error",
+                "message": "Body must be a JSON array, {\"fixes\": [...]} or NDJSON"
+            }), 400
+        
+        accepted, results = validate_fixes(items)
+        
+        if accepted:
+            ingest_fixes(accepted, request_received_at())
+        
+        rejected = len(items) - len(accepted)
+        fixes_rejected.inc(rejected)
+        log_event(log, logging.INFO, 'batch_received', f"📦 Batch: {len(accepted)} accepted, {rejected} rejected",
+                  accepted=len(accepted), rejected=rejected)
+        
+        return jsonify({
+            "status": "success" if accepted or not items else "error",
+            "accepted": len(accepted),
+            "rejected": rejected,
+            "results": results,
+            "received_at": datetime.now().isoformat()
+        }), 200
+        
+    except Exception as e:
+        log_event(log, logging.ERROR, 'batch_failed', f"❌ Error processing batch: {e}", error=str(e))
+        return jsonify({
+            "status": "error",
+            "message": f"Server error: {str(e)}"
+        }), 500
+
+def filter_events(events, device_id):
+    """Keep only fix events of one device (all events if device_id is None)"""
+    if device_id is None:
+        return events
+    return [event for event in events if event[2].get('device_id') == device_id]
+
+def stream_not_shared():
+    """501 reply of the long-poll and /stream: with the shared backend each worker has its own sequence"""
+    return jsonify({
+        "status": "error",
+        "message": "Long-poll and /stream are not available with GPS_STATE_BACKEND=shared "
+                   "(the fix sequence is per worker process)"
+    }), 501
+
+def long_poll_coordinates(after, device_id):
+    """Wait up to LONG_POLL_TIMEOUT for fixes newer than `after`"""
+    try:
+        timeout = min(float(request.args.get('timeout', LONG_POLL_TIMEOUT)), LONG_POLL_TIMEOUT)
+    except ValueError:
+        timeout = LONG_POLL_TIMEOUT
+    
+    events, missed = fix_stream.wait(after, timeout)
+    # The cursor advances past other devices' fixes too, so the client doesn't re-fetch them;
+    # a cursor from before a server restart is moved back into the new sequence
+    cursor = events[-1][0] if events else min(max(after, 0), fix_stream.last_seq)
+    events = filter_events(events, device_id)
+    return jsonify({
+        "status": "success",
+        "seq": cursor,
+        "last_seq": fix_stream.last_seq,
+        "missed": missed,
+        "fixes": [fix for _, event, fix in events if event == 'fix'],
+        "alerts": [alert for _, event, alert in events if event == 'alert']
+    }), 200
+
 @app.route('/get-coordinates', methods=['GET'])
 def get_latest_coordinates():
-    """Get the latest received coordinates"""
-    if latest_coordinates['latitude'] is not None:
+    """
+    Get the latest received coordinates (of ?device=<id>, or of the most recent device).
+    With ?after=<seq> this becomes a long-poll: it returns every fix newer than
+    <seq> as soon as one arrives (or an empty list after ?timeout= seconds).
+    """
+    after = request.args.get('after', type=int)
+    if after is not None:
+        if STATE_BACKEND == 'shared':
+            return stream_not_shared()
+        return long_poll_coordinates(after, request.args.get('device'))
+    
+    snapshot = registry.get(request.args.get('device'))
+    if snapshot is not None:
+        device_metrics = derived.get(snapshot.device_id) if derived is not None else None
         return jsonify({
             "status": "success",
-            "data": latest_coordinates
+            "data": snapshot.to_dict(),
+            "metrics": device_metrics.to_dict() if device_metrics else None
         }), 200
     else:
         return jsonify({
@@ -116,20 +525,158 @@ def get_latest_coordinates():
             "message": "No coordinates received yet"
         }), 404
 
+@app.route('/stream', methods=['GET'])
+def stream_coordinates():
+    """
+    Server-Sent Events stream of fixes (optionally ?device=<id>).
+    Resumes after ?after=<seq> or the Last-Event-ID header sent by reconnecting clients.
+    """
+    if STATE_BACKEND == 'shared':
+        return stream_not_shared()
+    device_id = request.args.get('device')
+    after = request.headers.get('Last-Event-ID', type=int)
+    if after is None:
+        after = request.args.get('after', default=fix_stream.last_seq, type=int)
+    
+    def generate(cursor):
+        yield "retry: 2000\n\n"
+        while True:
+            events, _ = fix_stream.wait(cursor, SSE_KEEPALIVE_INTERVAL)
+            if not events:
+                cursor = min(cursor, fix_stream.last_seq)  # Last-Event-ID from before a restart
+                yield ": keep-alive\n\n"
+                continue
+            cursor = events[-1][0]
+            for seq, event, fix in filter_events(events, device_id):
+                yield f"id: {seq}\nevent: {event}\ndata: {json.dumps(fix)}\n\n"
+    
+    return Response(generate(after), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/alerts', methods=['GET'])
+def get_alerts():
+    """
+    Recent geofence alerts (?device=<id>&limit=<n>, oldest first) and which
+    fences every device is inside / violating right now. Live alerts are
+    pushed on /stream as 'alert' events.
+    """
+    if geofences is None:
+        return jsonify({
+            "status": "error",
+            "message": "Geofencing is disabled (set GPS_GEOFENCE_FILE=<fences.geojson>)"
+        }), 503
+    
+    device_id = request.args.get('device')
+    limit = min(max(request.args.get('limit', 100, type=int), 0), geofences.recent.maxlen)
+    return jsonify({
+        "status": "success",
+        "alerts": geofences.alerts(device_id, limit),
+        "devices": geofences.state(device_id),
+        "fences": [fence.to_dict() for fence in geofences.fences]
+    }), 200
+
+@app.route('/track', methods=['GET'])
+def get_track():
+    """
+    Fix history from the track store, oldest first, streamed:
+    ?device=<id>&since=<t>&until=<t>&bbox=south,west,north,east&limit=<n>&cursor=<c>
+    Times are epoch seconds or ISO 8601. Pass next_cursor back as ?cursor= for the
+    next page. ?format=ndjson streams one fix per line (each fix carries its cursor).
+    """
+    if track_store is None:
+        return jsonify({
+            "status": "error",
+            "message": "Track store is disabled (set GPS_TRACK_STORE=<path to .sqlite3>)"
+        }), 503
+    
+    try:
+        since = parse_time_arg(request.args.get('since'))
+        until = parse_time_arg(request.args.get('until'))
+        bbox = parse_bbox_arg(request.args.get('bbox'))
+        limit = min(max(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+        rows = track_store.query(request.args.get('device'), since, until, bbox,
+                                 request.args.get('cursor'), limit)
+        first = next(rows, None)  # runs the query now, so a bad cursor is still a 400
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    def all_rows():
+        if first is not None:
+            yield first
+            yield from rows
+    
+    if request.args.get('format') == 'ndjson':
+        return Response((json.dumps(fix) + "\n" for fix in all_rows()), mimetype='application/x-ndjson')
+    
+    def generate():
+        yield '{"status": "success", "fixes": ['
+        count = 0
+        last = None
+        for fix in all_rows():
+            yield (',' if count else '') + json.dumps(fix)
+            count += 1
+            last = fix
+        # A full page means there may be more: continue from the last row
+        next_cursor = last['cursor'] if count == limit else None
+        yield f'], "count": {count}, "next_cursor": {json.dumps(next_cursor)}}}'
+    
+    return Response(generate(), mimetype='application/json')
+
+@app.route('/devices', methods=['GET'])
+def get_fleet():
+    """Latest coordinates of every device in one response"""
+    snapshots = registry.all()
+    return jsonify({
+        "status": "success",
+        "count": len(snapshots),
+        "devices": {device_id: snapshot.to_dict() for device_id, snapshot in snapshots.items()},
+        "server_time": datetime.now().isoformat()
+    }), 200
+
+@app.route('/devices/<device_id>', methods=['GET'])
+def get_device(device_id):
+    """Latest coordinates of one device"""
+    snapshot = registry.get(device_id)
+    if snapshot is None:
+        return jsonify({
+            "status": "error",
+            "message": f"No coordinates received from device '{device_id}'"
+        }), 404
+    return jsonify({"status": "success", "data": snapshot.to_dict()}), 200
+
 @app.route('/status', methods=['GET'])
 def server_status():
     """Server status and statistics"""
     file_exists = os.path.exists(COORDINATES_FILE)
-    last_update = latest_coordinates.get('timestamp', 'Never')
+    latest = registry.get()
     
     return jsonify({
         "status": "running",
+        "storage_mode": STORAGE_MODE,
+        "state_backend": STATE_BACKEND,
+        "worker_pid": os.getpid(),
         "coordinates_file_exists": file_exists,
-        "last_coordinate_update": last_update,
-        "latest_coordinates": latest_coordinates,
+        "track_log_last_seq": track_log.next_seq - 1 if track_log else None,
+        "device_count": len(registry),
+        "stream_last_seq": fix_stream.last_seq,
+        "track_store": TRACK_STORE_PATH,
+        "write_behind": write_behind.stats() if write_behind is not None else None,
+        "udp": udp_receiver.stats() if udp_receiver is not None else None,
+        "geofences": geofences.stats() if geofences is not None else None,
+        "last_coordinate_update": latest.timestamp if latest else 'Never',
+        "latest_coordinates": latest.to_dict() if latest else None,
+        "derived_metrics": {device_id: device_metrics.to_dict()
+                            for device_id, device_metrics in derived.all().items()} if derived is not None else None,
         "server_time": datetime.now().isoformat()
     }), 200
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Pipeline metrics in Prometheus text format (or ?format=json with quantile summaries)"""
+    if request.args.get('format') == 'json':
+        return jsonify({"status": "success", "metrics": metrics.summary()}), 200
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Simple health check for Flutter app"""
@@ -141,19 +688,84 @@ def root():
     status = "🟢 GPS Receiver Server is running!"
     instructions = [
         "📱 Send GPS coordinates: POST /send-coordinates",
-        "📍 Get latest coordinates: GET /get-coordinates", 
+        "📦 Send a batch of coordinates: POST /send-coordinates/batch",
+        "📡 Binary fix packets: UDP (start with --udp-port, see udp_receiver.py)",
+        "📍 Get latest coordinates: GET /get-coordinates?device=<id>",
+        "⏳ Wait for new coordinates: GET /get-coordinates?after=<seq>",
+        "📡 Live stream (Server-Sent Events): GET /stream",
+        "🚨 Geofence alerts: GET /alerts?device=<id> (GPS_GEOFENCE_FILE)",
+        "🕓 Fix history: GET /track?device=<id>&since=<t>&until=<t>&bbox=<s,w,n,e>",
+        "🚙 Get the whole fleet: GET /devices (one device: GET /devices/<id>)",
         "📊 Check server status: GET /status",
+        "📈 Pipeline metrics (Prometheus): GET /metrics",
         "💚 Health check: GET /health"
     ]
     
     return f"{status}<br><br>" + "<br>".join(instructions), 200
 
+def serve_production(host, port, threads):
+    """Multi-threaded WSGI server without debugger or reloader (waitress if installed)"""
+    try:
+        from waitress import serve
+    except ImportError:
+        log_event(log, logging.WARNING, 'waitress_missing',
+                  "⚠️ waitress not installed, using Werkzeug's threaded server", host=host, port=port)
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)  # no per-request access lines
+        app.run(host=host, port=port, debug=False, use_reloader=False, threaded=True)
+        return
+    # Each open /stream or long-poll holds a thread, so size `threads` for the subscribers too
+    serve(app, host=host, port=port, threads=threads, ident='gps-receiver')
+
+def handle_sigterm(signum, frame):
+    """Turn SIGTERM into a normal exit so the write-behind queue gets flushed"""
+    sys.exit(0)
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="GPS receiver server")
+    parser.add_argument('--production', action='store_true',
+                        help="threaded WSGI server, write-behind persistence, JSON logs")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=32, help="worker threads (production)")
+    parser.add_argument('--flush-interval', type=float, default=0.05,
+                        help="max seconds a fix waits before its group commit (production)")
+    parser.add_argument('--batch-size', type=int, default=5000, help="max fixes per group commit (production)")
+    parser.add_argument('--udp-port', type=int, default=int(UDP_PORT) if UDP_PORT else None,
+                        help="also accept binary fix packets on this UDP port (GPS_UDP_PORT)")
+    parser.add_argument('--log-rate', type=float, default=5.0,
+                        help="max log records per second per event type (production)")
+    args = parser.parse_args()
+    
     print("🚀 Starting GPS Receiver Server...")
-    print(f"📂 Coordinates file: {COORDINATES_FILE}")
-    print("🌐 Server available at: http://0.0.0.0:5000")
-    print("📱 Flutter app should POST to: http://YOUR_COMPUTER_IP:5000/send-coordinates")
+    if track_log is not None:
+        print(f"📼 Track log: {TRACK_LOG_DIR} (next seq {track_log.next_seq})")
+    else:
+        print(f"📂 Coordinates file: {COORDINATES_FILE}")
+    print(f"🌐 Server available at: http://{args.host}:{args.port}")
+    print(f"📱 Flutter app should POST to: http://YOUR_COMPUTER_IP:{args.port}/send-coordinates")
+    if args.udp_port:
+        print(f"📡 Binary fix packets: udp://{args.host}:{args.udp_port}")
+    if geofences is not None:
+        print(f"🚧 Geofences: {len(geofences.fences)} from {GEOFENCE_FILE}")
     print("=" * 70)
     
-    # Run Flask server
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    if args.production:
+        configure_logging(structured=True, rate=args.log_rate)
+        start_write_behind(args.flush_interval, args.batch_size)
+        if args.udp_port:
+            start_udp_receiver(args.udp_port, args.host)
+        signal.signal(signal.SIGTERM, handle_sigterm)
+        log_event(log, logging.INFO, 'server_started', threads=args.threads, storage_mode=STORAGE_MODE,
+                  flush_interval=args.flush_interval, batch_size=args.batch_size)
+        try:
+            serve_production(args.host, args.port, args.threads)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            shutdown_persistence()
+    else:
+        # Development: Werkzeug dev server with debugger and reloader
+        # (only the reloaded child process serves, so only it binds the UDP port)
+        if args.udp_port and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_udp_receiver(args.udp_port, args.host)
+        app.run(host=args.host, port=args.port, debug=True)
\ No newline at end of file
@@ -0,0 +1,106 @@
+# ============================================================================
+# FILE 10: render_scheduler.py (Coalescing single-worker map render queue)
+# ============================================================================
+#
+# Map fetches used to get a thread each, so bursts of fixes ran several
+# downloads at once and an older map could land after a newer one. The
+# scheduler keeps exactly one pending request (latest wins), debounces
+# bursts, runs renders on a single worker thread, and tags every request
+# with a generation number so results that were superseded while rendering
+# can be dropped on delivery.
+
+import threading
+import time
+
+
+def create_session(pool_size=4, user_agent=None):
+    """requests.Session with a keep-alive connection pool, shared by all map downloads"""
+    # Imported here: requests is slow to import and the viewer only needs it on the first download
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if user_agent:
+        session.headers['User-Agent'] = user_agent
+    return session
+
+
+class RenderScheduler:
+    """
+    render(request) runs on the worker thread; its result (or exception) is
+    passed to deliver(generation, request, result, error), also on the worker
+    thread. Use is_current(generation) when the result is applied to drop
+    anything that was superseded in the meantime.
+    """
+
+    def __init__(self, render, deliver, debounce=0.1, max_delay=0.5):
+        self.render = render
+        self.deliver = deliver
+        self.debounce = debounce    # wait this long for the burst to settle...
+        self.max_delay = max_delay  # ...but never delay a request longer than this
+        self.generation = 0
+        self.pending = None
+        self.first_pending_at = None
+        self.last_submit_at = None
+        self.running = True
+        self.cond = threading.Condition()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def submit(self, request):
+        """Queue a render, replacing any request not started yet; returns its generation"""
+        with self.cond:
+            self.generation += 1
+            now = time.monotonic()
+            if self.pending is None:
+                self.first_pending_at = now
+            self.pending = (self.generation, request)
+            self.last_submit_at = now
+            self.cond.notify()
+            return self.generation
+
+    def is_current(self, generation):
+        """True if no newer request was submitted after this generation"""
+        return generation == self.generation
+
+    def cancel(self):
+        """Drop the pending request and mark any in-flight render as stale"""
+        with self.cond:
+            self.generation += 1
+            self.pending = None
+
+    def _next_request(self):
+        """Block until a request has settled (debounced), then take it"""
+        with self.cond:
+            while self.running:
+                if self.pending is None:
+                    self.cond.wait()
+                    continue
+                now = time.monotonic()
+                settle_at = min(self.last_submit_at + self.debounce, self.first_pending_at + self.max_delay)
+                if now >= settle_at:
+                    request, self.pending = self.pending, None
+                    return request
+                self.cond.wait(settle_at - now)
+            return None
+
+    def _run(self):
+        while True:
+            item = self._next_request()
+            if item is None:
+                return
+            generation, request = item
+            try:
+                result, error = self.render(request), None
+            except Exception as e:
+                result, error = None, e
+            self.deliver(generation, request, result, error)
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.pending = None
+            self.cond.notify()
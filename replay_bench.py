@@ -0,0 +1,369 @@
+# ============================================================================
+# Benchmark: replay / load generator for the ingest-to-display pipeline
+# ============================================================================
+#
+# Replays a rover trace against the server and measures every stage:
+#   - client: throughput and p50/p95/p99 request latency
+#   - server: gps_handler_latency_seconds / gps_persist_latency_seconds from /metrics
+#   - viewer: file-to-viewer lag (server receive -> fix read back from the
+#     JSON file or track log) and read-to-render time (headless MapRenderer)
+#
+# Traces are synthetic (random-walk rovers) or recorded GPX / CSV / NDJSON /
+# track log directories (see trace_io.py).
+# By default the server runs in-process behind Flask's test client in a temp
+# directory, so the whole run works offline (no sockets, no display, no tiles).
+#
+#   python replay_bench.py                                   # 5000 synthetic fixes, as fast as possible
+#   python replay_bench.py --fixes 20000 --devices 8 --concurrency 8 --storage tracklog
+#   python replay_bench.py --trace drive.gpx --rate 50       # 50 fixes/s, like a real rover
+#   python replay_bench.py --batch 100 --production          # batch endpoint, write-behind
+#   python replay_bench.py --url http://127.0.0.1:5000 --watch live_gps_coordinates.json
+#   python replay_bench.py --json results.json               # machine-readable summary
+
+import argparse
+import itertools
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from file_watcher import FileWatcher
+from map_renderer import MapRenderer, Viewport
+from track_history import TrackHistory
+from track_log import TrackLogReader, records_to_fixes
+from trace_io import load_trace
+
+EARTH_RADIUS = 6371000.0
+
+
+def synthetic_trace(count, devices=1, start=(23.7465, 90.3763), speed=2.0, interval=1.0, seed=1):
+    """Random-walk rovers: `count` fixes round-robin over `devices`, `speed` m/s"""
+    rng = np.random.default_rng(seed)
+    lat = np.full(devices, start[0]) + rng.normal(0, 0.001, devices)
+    lon = np.full(devices, start[1]) + rng.normal(0, 0.001, devices)
+    heading = rng.uniform(0, 2 * np.pi, devices)
+    fixes = []
+    for i in range(count):
+        d = i % devices
+        heading[d] += rng.normal(0, 0.2)
+        step = speed * interval
+        lat[d] += math.degrees(step * math.cos(heading[d]) / EARTH_RADIUS)
+        lon[d] += math.degrees(step * math.sin(heading[d]) / (EARTH_RADIUS * math.cos(math.radians(lat[d]))))
+        fixes.append({'latitude': float(lat[d]), 'longitude': float(lon[d]),
+                      'accuracy': float(abs(rng.normal(4, 2)) + 1), 'device_id': f"rover-{d + 1}"})
+    return fixes
+
+
+def percentiles(values):
+    """count, mean and p50/p95/p99/max of a list of seconds, in milliseconds"""
+    if not len(values):
+        return {'count': 0}
+    values = np.asarray(values) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'count': len(values), 'mean_ms': float(values.mean()), 'p50_ms': float(p50),
+            'p95_ms': float(p95), 'p99_ms': float(p99), 'max_ms': float(values.max())}
+
+
+class TestClientTarget:
+    """In-process server behind Flask's test client (offline, no sockets)"""
+
+    def __init__(self, storage, production, workdir):
+        os.chdir(workdir)
+        os.environ['GPS_STORAGE_MODE'] = storage
+        os.environ['GPS_TRACK_LOG_DIR'] = os.path.join(workdir, 'track_log')
+        import receiver_server
+        from server_logging import configure_logging
+
+        configure_logging(level=logging.WARNING)  # per-fix console lines would dominate
+        self.server = receiver_server
+        if production:
+            receiver_server.start_write_behind()
+        self.local = threading.local()
+        self.watch_path = (os.environ['GPS_TRACK_LOG_DIR'] if storage == 'tracklog'
+                           else os.path.join(workdir, receiver_server.COORDINATES_FILE))
+
+    def _client(self):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.server.app.test_client()
+        return client
+
+    def post(self, path, body):
+        return self._client().post(path, json=body).status_code
+
+    def metrics(self):
+        return self._client().get('/metrics?format=json').get_json()['metrics']
+
+    def close(self):
+        self.server.shutdown_persistence()
+
+
+class HttpTarget:
+    """A running server over HTTP (one pooled session per worker thread)"""
+
+    def __init__(self, url, watch_path=None):
+        import requests
+        self.requests = requests
+        self.url = url.rstrip('/')
+        self.local = threading.local()
+        self.watch_path = watch_path
+
+    def _session(self):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = self.requests.Session()
+        return session
+
+    def post(self, path, body):
+        try:
+            return self._session().post(self.url + path, json=body, timeout=10).status_code
+        except self.requests.RequestException:
+            return 0
+
+    def metrics(self):
+        try:
+            return self._session().get(self.url + '/metrics', params={'format': 'json'},
+                                       timeout=10).json()['metrics']
+        except (self.requests.RequestException, ValueError, KeyError):
+            return {}
+
+    def close(self):
+        pass
+
+
+class HeadlessViewer(threading.Thread):
+    """
+    Follows the server's output the way the viewer does (inotify-watched JSON
+    file or zero-copy track log reader) and renders every new fix with the
+    headless MapRenderer: file-to-viewer lag and read-to-render time, without Tk.
+    """
+
+    def __init__(self, path, zoom=17, size=(800, 600)):
+        super().__init__(daemon=True)
+        self.path = path
+        self.is_track_log = os.path.isdir(path)
+        self.history = TrackHistory()
+        self.renderer = MapRenderer()
+        self.basemap = None
+        self.zoom = zoom
+        self.size = size
+        self.view = None
+        self.device = None
+        self.lags = []
+        self.render_times = []
+        self.fixes_seen = 0
+        self.stop_event = threading.Event()
+
+    def render(self, fixes):
+        # Like the viewer, draw one rover: the first device seen
+        if self.device is None:
+            self.device = fixes[0].get('device_id')
+        fixes = [fix for fix in fixes if fix.get('device_id') == self.device]
+        if not fixes:
+            return
+        started = time.perf_counter()
+        self.history.extend([fix['latitude'] for fix in fixes], [fix['longitude'] for fix in fixes],
+                            np.full(len(fixes), time.time()))
+        last = fixes[-1]
+        if self.basemap is None:
+            # Like the viewer: one basemap, the overlay is redrawn per fix
+            self.basemap, self.view = self.renderer.render_basemap(
+                Viewport(last['latitude'], last['longitude'], self.zoom, *self.size))
+        lats, lons = self.history.simplified(self.zoom)
+        self.renderer.draw_overlay(self.basemap.copy(), self.view, last['latitude'], last['longitude'],
+                                   last.get('accuracy'), np.column_stack([lats, lons]))
+        self.render_times.append(time.perf_counter() - started)
+
+    def observe(self, fixes):
+        read_at = time.time()
+        for fix in fixes:
+            if fix.get('server_received_at'):
+                self.lags.append(max(read_at - fix['server_received_at'], 0.0))
+        self.fixes_seen += len(fixes)
+        self.render(fixes)
+
+    def run(self):
+        if self.is_track_log:
+            self.follow_track_log()
+        else:
+            self.follow_json()
+
+    def follow_json(self):
+        watcher = FileWatcher(self.path)
+        handled = watcher.version
+        while not self.stop_event.is_set():
+            if watcher.wait(handled, 0.1) == handled:
+                continue
+            handled = watcher.version
+            try:
+                with open(self.path) as f:
+                    self.observe([json.load(f)])
+            except (OSError, ValueError):
+                pass
+        watcher.close()
+
+    def follow_track_log(self):
+        reader = TrackLogReader(self.path)
+        while not self.stop_event.is_set():
+            if reader.segment is None and not reader.seek_start():
+                time.sleep(0.01)
+                continue
+            fixes = records_to_fixes(reader.read_new())
+            if fixes:
+                self.observe(fixes)
+            else:
+                time.sleep(0.002)  # the viewer's tracklog poll is coarser; keep the lag visible
+        reader.close()
+
+    def stop(self, linger=1.0):
+        time.sleep(linger)  # let the last commits reach the file
+        self.stop_event.set()
+        self.join(5)
+
+
+def drive(target, trace, rate, concurrency, batch_size, keep_timestamps):
+    """Send the trace; returns (per-request latencies, failures, elapsed seconds)"""
+    requests_to_send = [trace[i:i + batch_size] for i in range(0, len(trace), batch_size)]
+    path = '/send-coordinates' if batch_size == 1 else '/send-coordinates/batch'
+    request_interval = batch_size / rate if rate else 0.0
+    next_index = itertools.count()
+    latencies = []
+    failures = [0]
+    lock = threading.Lock()
+
+    def worker():
+        local_latencies = []
+        local_failures = 0
+        while True:
+            i = next(next_index)
+            if i >= len(requests_to_send):
+                break
+            if request_interval:
+                delay = start + i * request_interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            fixes = requests_to_send[i]
+            if not keep_timestamps:
+                now = datetime.now().isoformat()
+                fixes = [dict(fix, timestamp=now) for fix in fixes]
+            sent = time.perf_counter()
+            status = target.post(path, fixes[0] if batch_size == 1 else fixes)
+            local_latencies.append(time.perf_counter() - sent)
+            if status != 200:
+                local_failures += 1
+        with lock:
+            latencies.extend(local_latencies)
+            failures[0] += local_failures
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, failures[0], time.perf_counter() - start
+
+
+def print_row(label, stats):
+    if not stats.get('count'):
+        print(f"  {label:<34} (no samples)")
+        return
+    print(f"  {label:<34} n={stats['count']:<7} p50={stats['p50_ms']:8.2f}ms  p95={stats['p95_ms']:8.2f}ms  "
+          f"p99={stats['p99_ms']:8.2f}ms  max={stats['max_ms']:8.2f}ms")
+
+
+def server_quantiles(metrics, prefix):
+    """p50/p95/p99 (ms) of the server histograms whose name starts with `prefix`"""
+    rows = {}
+    for name, summary in metrics.items():
+        if name.startswith(prefix) and summary.get('count'):
+            rows[name] = {'count': summary['count'],
+                          **{f"{q}_ms": summary[q] * 1000 for q in ('p50', 'p95', 'p99')}}
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay GPS traces and measure the ingest-to-display pipeline")
+    parser.add_argument('--trace', help="GPX, CSV or NDJSON file (default: synthetic)")
+    parser.add_argument('--fixes', type=int, default=5000, help="synthetic trace length")
+    parser.add_argument('--devices', type=int, default=1, help="synthetic rovers")
+    parser.add_argument('--rate', type=float, default=0, help="fixes per second (0 = as fast as possible)")
+    parser.add_argument('--concurrency', type=int, default=4, help="client threads")
+    parser.add_argument('--batch', type=int, default=1, help="fixes per request (>1 uses the batch endpoint)")
+    parser.add_argument('--storage', choices=['json', 'tracklog'], default='json', help="in-process server mode")
+    parser.add_argument('--production', action='store_true', help="in-process server with write-behind")
+    parser.add_argument('--url', help="benchmark a running server over HTTP instead")
+    parser.add_argument('--watch', help="with --url: the server's JSON file or track log dir to follow")
+    parser.add_argument('--keep-timestamps', action='store_true', help="send the trace's own timestamps")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    trace = load_trace(args.trace) if args.trace else synthetic_trace(args.fixes, args.devices)
+    if not trace:
+        sys.exit("❌ Trace is empty")
+    results_path = os.path.abspath(args.json) if args.json else None
+
+    if args.url:
+        target = HttpTarget(args.url, args.watch)
+    else:
+        target = TestClientTarget(args.storage, args.production, tempfile.mkdtemp(prefix='arc25_replay_'))
+
+    viewer = None
+    if target.watch_path:
+        viewer = HeadlessViewer(target.watch_path)
+        viewer.start()
+        time.sleep(0.2)
+
+    mode = f"HTTP {args.url}" if args.url else f"test client, {args.storage}{', production' if args.production else ''}"
+    print(f"🏁 Replaying {len(trace)} fixes ({mode}), concurrency {args.concurrency}, batch {args.batch}, "
+          f"rate {args.rate or 'max'}")
+    latencies, failures, elapsed = drive(target, trace, args.rate, args.concurrency, args.batch,
+                                         args.keep_timestamps)
+    if viewer:
+        viewer.stop()
+    metrics = target.metrics()
+    target.close()
+
+    results = {
+        'fixes': len(trace),
+        'requests': len(latencies),
+        'failures': failures,
+        'elapsed_s': elapsed,
+        'throughput_fixes_per_s': len(trace) / elapsed,
+        'client_latency': percentiles(latencies),
+        'server_handler': server_quantiles(metrics, 'gps_handler_latency_seconds'),
+        'server_persist': server_quantiles(metrics, 'gps_persist_latency_seconds'),
+    }
+    if viewer:
+        results['viewer_fixes_seen'] = viewer.fixes_seen
+        results['file_to_viewer_lag'] = percentiles(viewer.lags)
+        results['read_to_render'] = percentiles(viewer.render_times)
+
+    print(f"📈 {results['throughput_fixes_per_s']:,.0f} fixes/s over {elapsed:.2f}s, "
+          f"{len(latencies)} requests, {failures} failed")
+    print_row("client request latency", results['client_latency'])
+    for name, stats in {**results['server_handler'], **results['server_persist']}.items():
+        print(f"  {name:<34} n={stats['count']:<7} p50={stats['p50_ms']:8.2f}ms  "
+              f"p95={stats['p95_ms']:8.2f}ms  p99={stats['p99_ms']:8.2f}ms  (bucket estimates)")
+    if viewer:
+        print(f"  viewer saw {viewer.fixes_seen} fixes")
+        print_row("file-to-viewer lag", results['file_to_viewer_lag'])
+        print_row("read-to-render (headless render)", results['read_to_render'])
+
+    if results_path:
+        with open(results_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Results written to {results_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# ============================================================================
+# FILE 14: server_logging.py (Structured, rate-limited server logging)
+# ============================================================================
+#
+# Log calls carry an event name plus key/value fields:
+#   log_event(log, logging.INFO, 'fix_received', device_id='rover-1', lat=...)
+# In development they print as readable console lines; in production each
+# record is one JSON object per line. A per-event token bucket keeps a flood
+# of identical events (thousands of fixes per second) from turning logging
+# into the bottleneck; the next record that gets through reports how many
+# were suppressed.
+
+import json
+import logging
+import sys
+import threading
+import time
+from datetime import datetime
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per (logger, event): `rate` records per second, bursts of `burst`"""
+
+    def __init__(self, rate=5.0, burst=20):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}  # key -> [tokens, last refill time, suppressed count]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        # Warnings and errors are never dropped
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, getattr(record, 'event', record.msg))
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.setdefault(key, [float(self.burst), now, 0])
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            record.suppressed, bucket[2] = bucket[2], 0
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, event and the event's fields"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': getattr(record, 'event', record.getMessage()),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """[HH:MM:SS] message (key=value ... for events without a message) for development"""
+
+    def format(self, record):
+        line = f"[{datetime.fromtimestamp(record.created).strftime('%H:%M:%S')}] {record.getMessage()}"
+        fields = getattr(record, 'fields', {})
+        # Events logged with their own message text already say what matters
+        if fields and record.getMessage() == getattr(record, 'event', None):
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        if getattr(record, 'suppressed', 0):
+            line += f" (+{record.suppressed} similar suppressed)"
+        return line
+
+
+def log_event(logger, level, event, message=None, **fields):
+    """Log `event` with structured fields; `message` is the human-readable console text"""
+    logger.log(level, message or event, extra={'event': event, 'fields': fields})
+
+
+def configure_logging(structured=False, rate=None, burst=20, level=logging.INFO, stream=None):
+    """
+    Route the 'gps' loggers to stderr (or `stream`): JSON lines if `structured`,
+    console lines otherwise. `rate` (records/second per event) enables rate limiting.
+    """
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter() if structured else ConsoleFormatter())
+    if rate:
+        handler.addFilter(RateLimitFilter(rate, burst))
+
+    root = logging.getLogger('gps')
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    root.propagate = False
+    return root
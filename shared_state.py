@@ -0,0 +1,250 @@
+# ============================================================================
+# FILE 15: shared_state.py (Cross-process latest-state table in shared memory)
+# ============================================================================
+#
+# When the server runs as several worker processes, each process would have
+# its own DeviceRegistry and /get-coordinates, /devices and /status would
+# answer differently depending on which worker took the request. This table
+# lives in one memory-mapped file (in /dev/shm by default, so it never touches
+# disk) that every worker maps, with the same interface as DeviceRegistry.
+#
+# Layout: a 64-byte header followed by `capacity` fixed 128-byte slots, see
+# SLOT_DTYPE. A device's slot is found by crc32(device_id) with linear probing;
+# slots are claimed once and never freed.
+#
+# Concurrency:
+#   - writers lock only their device's slot: an fcntl byte-range lock across
+#     processes plus a striped threading lock within a process (fcntl locks
+#     don't exclude threads of the same process)
+#   - each slot is a seqlock: the writer makes `seq` odd, writes the payload,
+#     then makes it even again; readers take no lock, copy the slot and retry
+#     if `seq` was odd or changed while they copied
+#   - claiming an empty slot for a new device takes a lock on the header
+
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from device_registry import DeviceSnapshot, DEFAULT_DEVICE_ID, MAX_DEVICE_ID_BYTES
+
+MAGIC = b'ARCSTAT1'
+HEADER_FORMAT = '<8sII'
+HEADER_SIZE = 64
+SLOT_SIZE = 128
+DEFAULT_CAPACITY = 4096
+MAX_TIMESTAMP_BYTES = 40
+READ_RETRIES = 1000
+
+SLOT_DTYPE = np.dtype([
+    ('seq', '<u8'),             # seqlock counter, odd while a write is in progress
+    ('device_id', f'S{MAX_DEVICE_ID_BYTES}'),  # empty = free slot
+    ('latitude', '<f8'),
+    ('longitude', '<f8'),
+    ('accuracy', '<f8'),        # NaN = not provided
+    ('received_at', '<f8'),     # epoch seconds
+    ('updated_ns', '<u8'),      # time.time_ns() of the last update, picks the latest device
+    ('fix_count', '<u8'),
+    ('timestamp', f'S{MAX_TIMESTAMP_BYTES}'),  # device timestamp as sent (ISO string)
+])
+assert SLOT_DTYPE.itemsize <= SLOT_SIZE
+SLOT_DTYPE = np.dtype({'names': SLOT_DTYPE.names,
+                       'formats': [SLOT_DTYPE.fields[name][0] for name in SLOT_DTYPE.names],
+                       'offsets': [SLOT_DTYPE.fields[name][1] for name in SLOT_DTYPE.names],
+                       'itemsize': SLOT_SIZE})
+
+
+def default_state_path():
+    """Shared-memory file path: /dev/shm if available, else the temp dir"""
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, 'arc25_gps_state')
+
+
+class SharedDeviceRegistry:
+    """device_id -> DeviceSnapshot table shared by every process that maps `path`"""
+
+    def __init__(self, path=None, capacity=DEFAULT_CAPACITY, lock_stripes=64):
+        self.path = path or default_state_path()
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = HEADER_SIZE + capacity * SLOT_SIZE
+
+        # The first process to get here formats the file; the others wait on the lock
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, HEADER_SIZE, 0)
+        try:
+            if os.fstat(self.fd).st_size == 0:
+                os.ftruncate(self.fd, size)
+                os.pwrite(self.fd, struct.pack(HEADER_FORMAT, MAGIC, SLOT_SIZE, capacity), 0)
+            magic, slot_size, capacity = struct.unpack(HEADER_FORMAT,
+                                                       os.pread(self.fd, struct.calcsize(HEADER_FORMAT), 0))
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, HEADER_SIZE, 0)
+        if magic != MAGIC or slot_size != SLOT_SIZE:
+            os.close(self.fd)
+            raise ValueError(f"{self.path} is not a shared state file")
+
+        self.capacity = capacity
+        self.mm = mmap.mmap(self.fd, HEADER_SIZE + capacity * SLOT_SIZE)
+        self.slots = np.ndarray((capacity,), dtype=SLOT_DTYPE, buffer=self.mm, offset=HEADER_SIZE)
+        self._seq = self.slots['seq']
+        self._device_ids = self.slots['device_id']
+        self._locks = [threading.Lock() for _ in range(lock_stripes)]
+        self._alloc_lock = threading.Lock()
+        self._index = {}  # device_id -> slot, per-process cache (slots never move)
+
+    def _find_slot(self, key, create):
+        """Slot index of a device (bytes key), claiming a free one if `create`"""
+        slot = self._index.get(key)
+        if slot is not None and self._device_ids[slot] == key:
+            return slot
+        start = zlib.crc32(key) % self.capacity
+        for probe in range(self.capacity):
+            slot = (start + probe) % self.capacity
+            current = self._device_ids[slot]
+            if current == key:
+                self._index[key] = slot
+                return slot
+            if not current:
+                if not create:
+                    return None
+                if self._claim(slot, key):
+                    self._index[key] = slot
+                    return slot
+                if self._device_ids[slot] == key:  # another process claimed it for this device
+                    self._index[key] = slot
+                    return slot
+        if create:
+            raise RuntimeError(f"shared state table is full ({self.capacity} devices)")
+        return None
+
+    def _claim(self, slot, key):
+        """Write `key` into a free slot under the header lock; False if it was taken meanwhile"""
+        with self._alloc_lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, HEADER_SIZE, 0)
+            try:
+                if self._device_ids[slot]:
+                    return False
+                self._device_ids[slot] = key
+                return True
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, HEADER_SIZE, 0)
+
+    def _write_slot(self, slot, fix, count, now):
+        offset = HEADER_SIZE + slot * SLOT_SIZE
+        with self._locks[slot % len(self._locks)]:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, SLOT_SIZE, offset)
+            try:
+                record = self.slots[slot:slot + 1]
+                seq = int(self._seq[slot])
+                self._seq[slot] = seq + 1  # odd: write in progress
+                record['latitude'] = fix['latitude']
+                record['longitude'] = fix['longitude']
+                record['accuracy'] = _accuracy_value(fix.get('accuracy'))
+                record['timestamp'] = str(fix.get('timestamp') or '').encode('utf-8')[:MAX_TIMESTAMP_BYTES]
+                record['received_at'] = now
+                record['updated_ns'] = time.time_ns()
+                record['fix_count'] = int(record['fix_count'][0]) + count
+                self._seq[slot] = seq + 2  # even: committed
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, SLOT_SIZE, offset)
+
+    def _read_slot(self, slot):
+        """Consistent copy of one slot (lock-free, retries while a write is in flight)"""
+        for attempt in range(READ_RETRIES):
+            before = int(self._seq[slot])
+            if not before & 1:
+                record = self.slots[slot:slot + 1].copy()[0]
+                if int(self._seq[slot]) == before:
+                    return record
+            if attempt > 10:
+                time.sleep(0)
+        raise RuntimeError(f"shared state slot {slot} is stuck mid-write")
+
+    @staticmethod
+    def _snapshot(record):
+        accuracy = float(record['accuracy'])
+        return DeviceSnapshot(
+            device_id=record['device_id'].decode('utf-8', 'replace'),
+            latitude=float(record['latitude']),
+            longitude=float(record['longitude']),
+            timestamp=record['timestamp'].decode('utf-8', 'replace') or None,
+            accuracy=None if np.isnan(accuracy) else accuracy,
+            received_at=float(record['received_at']),
+            fix_count=int(record['fix_count'])
+        )
+
+    def update(self, fix):
+        """Write the fix's device slot; returns the new snapshot"""
+        return self.update_many([fix])[0]
+
+    def update_many(self, fixes):
+        """Apply a batch: one slot write per device, from its last fix"""
+        last_per_device = {}
+        counts = {}
+        for fix in fixes:
+            device_id = fix.get('device_id') or DEFAULT_DEVICE_ID
+            last_per_device[device_id] = fix
+            counts[device_id] = counts.get(device_id, 0) + 1
+
+        snapshots = []
+        now = time.time()
+        for device_id, fix in last_per_device.items():
+            slot = self._find_slot(device_id.encode('utf-8')[:MAX_DEVICE_ID_BYTES], create=True)
+            self._write_slot(slot, fix, counts[device_id], now)
+            snapshots.append(self._snapshot(self._read_slot(slot)))
+        return snapshots
+
+    def get(self, device_id=None):
+        """Snapshot for one device, or the most recently updated device if None"""
+        if device_id is None:
+            used = np.flatnonzero(self._device_ids != b'')
+            if len(used) == 0:
+                return None
+            slot = used[np.argmax(self.slots['updated_ns'][used])]
+        else:
+            slot = self._find_slot(device_id.encode('utf-8')[:MAX_DEVICE_ID_BYTES], create=False)
+            if slot is None:
+                return None
+        record = self._read_slot(slot)
+        if record['updated_ns'] == 0:
+            return None  # claimed, first write not committed yet
+        return self._snapshot(record)
+
+    def all(self):
+        """Snapshot of every device that has reported"""
+        snapshots = {}
+        for slot in np.flatnonzero(self._device_ids != b''):
+            record = self._read_slot(slot)
+            if record['updated_ns']:
+                snapshot = self._snapshot(record)
+                snapshots[snapshot.device_id] = snapshot
+        return snapshots
+
+    def __len__(self):
+        return int(np.count_nonzero(self.slots['updated_ns'] != 0))
+
+    def clear(self):
+        """Forget every device; meant for resets while no other process is writing"""
+        fcntl.lockf(self.fd, fcntl.LOCK_EX)
+        try:
+            self.slots[:] = np.zeros(1, dtype=SLOT_DTYPE)
+            self._index.clear()
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN)
+
+    def close(self):
+        self.slots = self._seq = self._device_ids = None
+        self.mm.close()
+        os.close(self.fd)
+
+
+def _accuracy_value(accuracy):
+    try:
+        return float(accuracy)
+    except (TypeError, ValueError):
+        return np.nan
@@ -0,0 +1,310 @@
+# ============================================================================
+# FILE 8: tile_engine.py (Slippy-map tiles with MBTiles disk cache + LRU)
+# ============================================================================
+#
+# Tiles are looked up in three levels:
+#   1. an in-memory LRU of decoded PIL images (reused across pans/updates)
+#   2. an MBTiles (SQLite) file per map type on disk (works offline)
+#   3. the tile server, unless offline mode is on; downloads go into 1 and 2
+#
+# Tile servers are configurable per map type (GPS_TILE_URL_ROADMAP, ...). The
+# volunteer-run OpenStreetMap and OpenTopoMap servers forbid bulk downloads,
+# so seeding and predictive prefetching are refused against them; point the
+# map type at a server that allows it (your own, or a commercial provider).
+#
+# Pre-seed the disk cache for a mission area before going into the field:
+#   GPS_TILE_URL_ROADMAP=https://tiles.example.com/{z}/{x}/{y}.png \
+#       python tile_engine.py seed --bbox 23.70,90.35,23.78,90.42 --zooms 14-18
+
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+import requests
+from PIL import Image
+
+from server_logging import log_event
+from web_mercator import TILE_SIZE, latlon_to_world, latlon_to_tile
+
+log = logging.getLogger('gps.tiles')
+
+# Default tile URL templates per viewer map type (z/x/y slippy-map scheme);
+# GPS_TILE_URL_<MAP TYPE> overrides one
+TILE_URLS = {
+    'roadmap': 'https://tile.openstreetmap.org/{z}/{x}/{y}.png',
+    'terrain': 'https://tile.opentopomap.org/{z}/{x}/{y}.png',
+    'satellite': 'https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}',
+    'hybrid': 'https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}',
+}
+# Transparent label layers drawn over the base tiles (GPS_TILE_LABELS_URL_<MAP TYPE> overrides)
+LABEL_URLS = {
+    'hybrid': 'https://server.arcgisonline.com/ArcGIS/rest/services/Reference/'
+              'World_Boundaries_and_Places/MapServer/tile/{z}/{y}/{x}',
+}
+# Servers whose usage policy forbids bulk downloading (seeding, prefetching)
+NO_BULK_HOSTS = ('tile.openstreetmap.org', 'tile.opentopomap.org')
+MAX_ZOOM = 19
+DEFAULT_CACHE_DIR = 'tile_cache'
+USER_AGENT = 'ARC25-MapLiveView/1.0 (rover GPS tracker)'
+MISSING_TILE_COLOR = (221, 221, 221)
+RETRY_FAILED_AFTER = 60  # seconds before a failed tile is requested again
+
+
+def tile_url(map_type):
+    """Base tile URL template of a map type (environment override, else the default)"""
+    return os.environ.get(f"GPS_TILE_URL_{map_type.upper()}") or TILE_URLS[map_type]
+
+
+def label_url(map_type):
+    """Label layer URL template of a map type, or None"""
+    return os.environ.get(f"GPS_TILE_LABELS_URL_{map_type.upper()}") or LABEL_URLS.get(map_type)
+
+
+def allows_bulk(url_template):
+    """Whether a tile server may be bulk-downloaded from (seeded / prefetched)"""
+    return not any(f"//{host}/" in url_template for host in NO_BULK_HOSTS)
+
+
+def overlay_tile(base, labels):
+    """PNG bytes of a base tile with a transparent label tile drawn on top"""
+    image = Image.open(BytesIO(base)).convert('RGBA')
+    image.alpha_composite(Image.open(BytesIO(labels)).convert('RGBA').resize(image.size))
+    out = BytesIO()
+    image.convert('RGB').save(out, format='PNG')
+    return out.getvalue()
+
+
+class MBTilesCache:
+    """Tile blobs in an MBTiles (SQLite) file; rows use the TMS (flipped y) scheme"""
+
+    def __init__(self, path, name='tiles'):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, "
+                              "tile_row INTEGER, tile_data BLOB, "
+                              "PRIMARY KEY (zoom_level, tile_column, tile_row))")
+            self.conn.executemany("INSERT OR IGNORE INTO metadata VALUES (?, ?)",
+                                  [('name', name), ('format', 'png'), ('type', 'baselayer')])
+
+    @staticmethod
+    def _row(z, y):
+        return (2 ** z - 1) - y
+
+    def get(self, z, x, y):
+        """Tile bytes or None"""
+        with self.lock:
+            row = self.conn.execute("SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? "
+                                    "AND tile_row=?", (z, x, self._row(z, y))).fetchone()
+        return row[0] if row else None
+
+    def has(self, z, x, y):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM tiles WHERE zoom_level=? AND tile_column=? "
+                                     "AND tile_row=?", (z, x, self._row(z, y))).fetchone() is not None
+
+    def put(self, z, x, y, data):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+                              (z, x, self._row(z, y), sqlite3.Binary(data)))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class TileLRU:
+    """Bounded in-memory cache of decoded tiles"""
+
+    def __init__(self, max_tiles=256):
+        self.max_tiles = max_tiles
+        self.tiles = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is not None:
+                self.tiles.move_to_end(key)
+            return tile
+
+    def put(self, key, tile):
+        with self.lock:
+            self.tiles[key] = tile
+            self.tiles.move_to_end(key)
+            while len(self.tiles) > self.max_tiles:
+                self.tiles.popitem(last=False)
+
+
+class TileProvider:
+    """Fetches and composites z/x/y tiles for one map type"""
+
+    def __init__(self, map_type='roadmap', cache_dir=DEFAULT_CACHE_DIR, offline=False, memory_tiles=256,
+                 session=None):
+        if map_type not in TILE_URLS:
+            raise ValueError(f"Unknown map type: {map_type}")
+        self.map_type = map_type
+        self.url_template = tile_url(map_type)
+        self.labels_template = label_url(map_type)
+        # Seeding and prefetching only against servers that allow bulk downloads
+        self.allows_bulk = all(allows_bulk(url) for url in (self.url_template, self.labels_template) if url)
+        self.offline = offline
+        self.disk = MBTilesCache(os.path.join(cache_dir, f"{map_type}.mbtiles"), name=map_type)
+        self.memory = TileLRU(memory_tiles)
+        # A shared, pooled session can be passed in; otherwise the provider owns one
+        self.owns_session = session is None
+        self.session = session or requests.Session()
+        # Every requests.Session starts with requests' generic User-Agent, which tile servers'
+        # usage policies block: replace it, but keep one a caller set on its own session
+        user_agent = self.session.headers.get('User-Agent', '')
+        if self.owns_session or not user_agent or user_agent.startswith('python-requests/'):
+            self.session.headers['User-Agent'] = USER_AGENT
+        self.failed = {}  # (z, x, y) -> time of the last failed download
+        self.failure_logged_at = None  # one warning per RETRY_FAILED_AFTER, the rest at debug level
+
+    def fetch_tile_bytes(self, z, x, y):
+        """Tile bytes from disk, else from the network (stored on disk); None if unavailable"""
+        data = self.disk.get(z, x, y)
+        if data is not None or self.offline:
+            return data
+        # Don't stall every frame on tiles that just failed (e.g. no connectivity)
+        if time.monotonic() - self.failed.get((z, x, y), -RETRY_FAILED_AFTER) < RETRY_FAILED_AFTER:
+            return None
+        data = self._download(self.url_template, z, x, y)
+        if data is not None and self.labels_template:
+            labels = self._download(self.labels_template, z, x, y)
+            data = overlay_tile(data, labels) if labels is not None else None
+        if data is None:
+            self.failed[(z, x, y)] = time.monotonic()
+            return None
+        self.failed.pop((z, x, y), None)
+        self.disk.put(z, x, y, data)
+        return data
+
+    def _download(self, url_template, z, x, y):
+        """Bytes of one tile from a server, None (logged) on failure"""
+        try:
+            response = self.session.get(url_template.format(z=z, x=x, y=y), timeout=10)
+            response.raise_for_status()
+            if 'image' not in response.headers.get('content-type', ''):
+                raise requests.RequestException(f"unexpected content type {response.headers.get('content-type')}")
+        except requests.RequestException as e:
+            # Offline, every tile of every frame fails: warn once in a while, not per tile
+            now = time.monotonic()
+            quiet = self.failure_logged_at is not None and now - self.failure_logged_at < RETRY_FAILED_AFTER
+            if not quiet:
+                self.failure_logged_at = now
+            log_event(log, logging.DEBUG if quiet else logging.WARNING, 'tile_download_failed',
+                      f"⚠️ Tile {z}/{x}/{y} download failed: {e}", map_type=self.map_type, z=z, x=x, y=y,
+                      error=str(e))
+            return None
+        return response.content
+
+    def get_tile(self, z, x, y):
+        """Decoded RGB tile image, or None if not cached and offline/unreachable"""
+        key = (z, x, y)
+        tile = self.memory.get(key)
+        if tile is not None:
+            return tile
+        data = self.fetch_tile_bytes(z, x, y)
+        if data is None:
+            return None
+        tile = Image.open(BytesIO(data)).convert('RGB')
+        self.memory.put(key, tile)
+        return tile
+
+    def compose(self, center_lat, center_lon, zoom, width, height):
+        """
+        Composite the tiles covering a width x height viewport centred on a point.
+        Returns (image, origin) where origin is the world-pixel position of the
+        image's top-left corner at this zoom.
+        """
+        center_x, center_y = latlon_to_world(center_lat, center_lon, zoom)
+        origin_x = int(center_x - width / 2)
+        origin_y = int(center_y - height / 2)
+        tiles_per_side = 2 ** zoom
+
+        image = Image.new('RGB', (width, height), MISSING_TILE_COLOR)
+        first_tx, first_ty = origin_x // TILE_SIZE, origin_y // TILE_SIZE
+        last_tx, last_ty = (origin_x + width - 1) // TILE_SIZE, (origin_y + height - 1) // TILE_SIZE
+
+        for ty in range(first_ty, last_ty + 1):
+            if ty < 0 or ty >= tiles_per_side:
+                continue
+            for tx in range(first_tx, last_tx + 1):
+                tile = self.get_tile(zoom, tx % tiles_per_side, ty)  # wrap around the antimeridian
+                if tile is not None:
+                    image.paste(tile, (tx * TILE_SIZE - origin_x, ty * TILE_SIZE - origin_y))
+
+        return image, (origin_x, origin_y)
+
+    def close(self):
+        if self.owns_session:
+            self.session.close()
+        self.disk.close()
+
+
+def tiles_in_bbox(south, west, north, east, zoom):
+    """All (x, y) tiles covering a bounding box at one zoom level"""
+    min_x, min_y = latlon_to_tile(north, west, zoom)
+    max_x, max_y = latlon_to_tile(south, east, zoom)
+    return [(x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+
+
+def seed(provider, bbox, zooms, progress=None):
+    """Download every tile of a bounding box into the disk cache; returns (fetched, total)"""
+    if not provider.allows_bulk:
+        raise ValueError(f"the {provider.map_type} tile server does not allow bulk downloads; set "
+                         f"GPS_TILE_URL_{provider.map_type.upper()} to one that does")
+    south, west, north, east = bbox
+    jobs = [(z, x, y) for z in zooms for x, y in tiles_in_bbox(south, west, north, east, z)]
+    fetched = 0
+    for i, (z, x, y) in enumerate(jobs):
+        if not provider.disk.has(z, x, y) and provider.fetch_tile_bytes(z, x, y) is not None:
+            fetched += 1
+        if progress:
+            progress(i + 1, len(jobs))
+    return fetched, len(jobs)
+
+
+def parse_zooms(text):
+    """'14-18' or '15' -> list of zoom levels"""
+    low, _, high = text.partition('-')
+    return list(range(int(low), int(high or low) + 1))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Slippy-map tile cache tools")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    seed_parser = subparsers.add_parser('seed', help="Pre-download tiles for a mission bounding box")
+    seed_parser.add_argument('--bbox', required=True, help="south,west,north,east in degrees")
+    seed_parser.add_argument('--zooms', default='14-18', help="zoom range, e.g. 14-18")
+    seed_parser.add_argument('--map-type', default='roadmap', choices=sorted(TILE_URLS))
+    seed_parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    args = parser.parse_args()
+
+    bbox = [float(v) for v in args.bbox.split(',')]
+    zooms = [z for z in parse_zooms(args.zooms) if 0 <= z <= MAX_ZOOM]
+    provider = TileProvider(args.map_type, args.cache_dir)
+
+    def report(done, total):
+        if done % 50 == 0 or done == total:
+            print(f"🧩 {done}/{total} tiles checked")
+
+    print(f"🗺️ Seeding {args.map_type} tiles for {bbox} at zooms {zooms[0]}-{zooms[-1]}")
+    try:
+        fetched, total = seed(provider, bbox, zooms, report)
+    except ValueError as e:
+        provider.close()
+        sys.exit(f"❌ Not seeding: {e}")
+    print(f"✅ Done: {fetched} downloaded, {total - fetched} already cached or unavailable")
+    provider.close()
@@ -0,0 +1,290 @@
+# ============================================================================
+# FILE 20: tile_prefetch.py (Predictive basemap prefetching along the heading)
+# ============================================================================
+#
+# The viewer only fetches a new basemap once the rover is already near the
+# edge of the current one, so every edge crossing used to stall on a
+# download. The prefetcher looks ahead instead:
+#   - estimate_motion fits velocity (and so speed/heading) to the last few
+#     history points, which carry their receive times
+#   - plan_tiles lists the tiles the viewport will need over the next
+#     `horizon` seconds; plan_extent predicts where the next Static Maps
+#     basemap will be centred when the rover leaves the current one
+#   - Prefetcher runs those fetches on a few low-priority workers (paused
+#     while a foreground render runs) and drops queued jobs as soon as the
+#     heading or the map settings change, since they would be wasted
+# Fetched tiles land in the tile caches and Static Maps images in the image
+# pipeline's decoded cache, where the regular render path finds them.
+
+import logging
+import math
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import numpy as np
+
+from server_logging import log_event
+from web_mercator import TILE_SIZE, EARTH_CIRCUMFERENCE, latlon_to_world, world_to_latlon
+
+log = logging.getLogger('gps.prefetch')
+
+EARTH_RADIUS = EARTH_CIRCUMFERENCE / (2 * math.pi)
+MIN_SPEED = 0.5  # m/s; slower than this counts as stationary (GPS jitter)
+
+
+class Motion:
+    """Position, east/north velocity (m/s) and fix time of the latest history point"""
+
+    def __init__(self, lat, lon, east, north, timestamp):
+        self.lat = lat
+        self.lon = lon
+        self.east = east
+        self.north = north
+        self.timestamp = timestamp
+
+    @property
+    def speed(self):
+        return math.hypot(self.east, self.north)
+
+    @property
+    def heading(self):
+        """Degrees clockwise from north"""
+        return math.degrees(math.atan2(self.east, self.north)) % 360
+
+    def predict(self, seconds):
+        """(lat, lon) after moving on for `seconds` at constant velocity"""
+        lat = self.lat + math.degrees(self.north * seconds / EARTH_RADIUS)
+        lon = self.lon + math.degrees(self.east * seconds / (EARTH_RADIUS * math.cos(math.radians(self.lat))))
+        return lat, lon
+
+    def world_velocity(self, zoom):
+        """Velocity in world pixels per second at a zoom (y grows southwards)"""
+        x0, y0 = latlon_to_world(self.lat, self.lon, zoom)
+        x1, y1 = latlon_to_world(*self.predict(1.0), zoom)
+        return float(x1 - x0), float(y1 - y0)
+
+
+def estimate_motion(history, window=8, max_age=15.0, now=None):
+    """
+    Least-squares velocity over the last `window` history points (those within
+    `max_age` seconds of the newest); None if there is too little data, the
+    track is stale or the rover is stationary.
+    """
+    lats, lons, times = history.recent(window)
+    if len(times) < 2:
+        return None
+    if now is not None and now - times[-1] > max_age:
+        return None
+    keep = times >= times[-1] - max_age
+    lats, lons, times = lats[keep], lons[keep], times[keep]
+    span = times[-1] - times[0]
+    if len(times) < 2 or span <= 0:
+        return None
+
+    # Local east/north metres around the newest point
+    lat0, lon0 = float(lats[-1]), float(lons[-1])
+    east = np.radians(lons - lon0) * EARTH_RADIUS * math.cos(math.radians(lat0))
+    north = np.radians(lats - lat0) * EARTH_RADIUS
+    t = times - times[-1]
+    t_mean = t.mean()
+    denominator = float(((t - t_mean) ** 2).sum())
+    ve = float(((t - t_mean) * (east - east.mean())).sum()) / denominator
+    vn = float(((t - t_mean) * (north - north.mean())).sum()) / denominator
+    if math.hypot(ve, vn) < MIN_SPEED:
+        return None
+    return Motion(lat0, lon0, ve, vn, float(times[-1]))
+
+
+def viewport_tiles(lat, lon, zoom, width, height):
+    """(x, y) tiles composed for a viewport centred on lat/lon (as TileProvider.compose)"""
+    center_x, center_y = latlon_to_world(lat, lon, zoom)
+    origin_x, origin_y = int(center_x - width / 2), int(center_y - height / 2)
+    tiles_per_side = 2 ** zoom
+    return [(tx % tiles_per_side, ty)
+            for ty in range(origin_y // TILE_SIZE, (origin_y + height - 1) // TILE_SIZE + 1)
+            if 0 <= ty < tiles_per_side
+            for tx in range(origin_x // TILE_SIZE, (origin_x + width - 1) // TILE_SIZE + 1)]
+
+
+def plan_tiles(motion, zoom, width, height, horizon=30.0, max_tiles=48):
+    """
+    Tiles the viewport will need along the predicted path within `horizon`
+    seconds that it does not show yet, soonest first (at most max_tiles).
+    """
+    speed_px = math.hypot(*motion.world_velocity(zoom))
+    step = min(width, height) / 4 / speed_px  # seconds per quarter viewport travelled
+    visible = set(viewport_tiles(motion.lat, motion.lon, zoom, width, height))
+    planned = OrderedDict()
+    t = step
+    while t <= horizon and len(planned) < max_tiles:
+        lat, lon = motion.predict(t)
+        center_x, center_y = latlon_to_world(lat, lon, zoom)
+        # Nearest tiles of each predicted viewport first
+        tiles = sorted(viewport_tiles(lat, lon, zoom, width, height),
+                       key=lambda tile: (tile[0] * TILE_SIZE + TILE_SIZE / 2 - center_x) ** 2
+                       + (tile[1] * TILE_SIZE + TILE_SIZE / 2 - center_y) ** 2)
+        for tile in tiles:
+            if tile not in visible:
+                planned[(zoom,) + tile] = None
+        t += step
+    return list(planned)[:max_tiles]
+
+
+def plan_extent(motion, view_lat, view_lon, zoom, width, height, margin=0.2, lead=0.25, horizon=60.0):
+    """
+    Centre (lat, lon) of the basemap the viewer will need next: the rover
+    leaves the inner part (`margin` of the size from each edge) of the
+    width x height basemap centred on view_lat/view_lon; the new one is
+    centred `lead` of the viewport ahead of that exit point. None if the exit
+    is further away than `horizon` seconds.
+    """
+    vx, vy = motion.world_velocity(zoom)
+    x, y = latlon_to_world(motion.lat, motion.lon, zoom)
+    dx, dy = extent_offset(view_lat, view_lon, motion.lat, motion.lon, zoom)
+    half_x, half_y = width * (0.5 - margin), height * (0.5 - margin)
+
+    exit_times = []
+    if vx:
+        exit_times.append(((half_x if vx > 0 else -half_x) - dx) / vx)
+    if vy:
+        exit_times.append(((half_y if vy > 0 else -half_y) - dy) / vy)
+    exit_time = max(min(exit_times), 0.0)
+    if exit_time > horizon:
+        return None
+
+    speed_px = math.hypot(vx, vy)
+    ahead = lead * min(width, height) / speed_px
+    lat, lon = world_to_latlon(float(x) + vx * (exit_time + ahead), float(y) + vy * (exit_time + ahead), zoom)
+    return float(lat), float(lon)
+
+
+def extent_offset(center_lat, center_lon, lat, lon, zoom):
+    """World-pixel offset (dx, dy) of lat/lon from a basemap centre"""
+    center_x, center_y = latlon_to_world(center_lat, center_lon, zoom)
+    x, y = latlon_to_world(lat, lon, zoom)
+    return float(x - center_x), float(y - center_y)
+
+
+def extent_covers(center_lat, center_lon, lat, lon, zoom, width, height, margin=0.2):
+    """Whether a basemap centred on center_lat/lon shows lat/lon away from its edge margin"""
+    dx, dy = extent_offset(center_lat, center_lon, lat, lon, zoom)
+    return abs(dx) < width * (0.5 - margin) and abs(dy) < height * (0.5 - margin)
+
+
+def heading_difference(a, b):
+    """Smallest angle between two headings in degrees"""
+    return abs((a - b + 180) % 360 - 180)
+
+
+class Prefetcher:
+    """
+    Bounded low-priority job queue. update() replaces the plan; queued jobs
+    are cancelled when the plan key (map settings) or the heading changes.
+    Workers don't start a job while a foreground render is running.
+    """
+
+    def __init__(self, workers=2, max_pending=64, heading_tolerance=30.0, max_done=4096):
+        self.max_pending = max_pending
+        self.heading_tolerance = heading_tolerance
+        self.max_done = max_done
+        self.pending = deque()          # (key, fn), soonest needed first
+        self.queued = set()
+        self.done = OrderedDict()       # keys fetched recently (bounded), never requeued
+        self.plan_key = None
+        self.plan_heading = None
+        self.foreground_count = 0
+        self.running = True
+        self.counts = {'fetched': 0, 'unavailable': 0, 'cancelled': 0, 'failed': 0}
+        self.cond = threading.Condition()
+        self.workers = [threading.Thread(target=self._run, daemon=True) for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def update(self, plan_key, heading, jobs):
+        """
+        New plan: `jobs` is a list of (key, fn), soonest needed first; fn()
+        returns None if the data is unavailable (e.g. offline). A heading of
+        None (not moving) just cancels whatever is queued.
+        """
+        with self.cond:
+            replan = (plan_key != self.plan_key or heading is None or self.plan_heading is None
+                      or heading_difference(heading, self.plan_heading) > self.heading_tolerance)
+            if replan:
+                self._cancel_locked()
+                self.plan_key = plan_key
+                self.plan_heading = heading
+            if heading is None:
+                return
+            for key, fn in jobs:
+                if len(self.pending) >= self.max_pending:
+                    break
+                if key in self.queued or key in self.done:
+                    continue
+                self.pending.append((key, fn))
+                self.queued.add(key)
+            self.cond.notify_all()
+
+    def cancel(self):
+        with self.cond:
+            self._cancel_locked()
+            self.plan_heading = None
+
+    def _cancel_locked(self):
+        self.counts['cancelled'] += len(self.pending)
+        self.pending.clear()
+        self.queued.clear()
+
+    @contextmanager
+    def foreground(self):
+        """Wrap foreground renders: prefetch jobs wait until they are done"""
+        with self.cond:
+            self.foreground_count += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.foreground_count -= 1
+                self.cond.notify_all()
+
+    def _next_job(self):
+        with self.cond:
+            while self.running:
+                if self.pending and not self.foreground_count:
+                    key, fn = self.pending.popleft()
+                    self.queued.discard(key)
+                    self.done[key] = None
+                    while len(self.done) > self.max_done:
+                        self.done.popitem(last=False)
+                    return key, fn
+                self.cond.wait()
+            return None
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            key, fn = job
+            try:
+                outcome = 'unavailable' if fn() is None else 'fetched'
+            except Exception as e:
+                # Speculative: a failure (e.g. offline) only shows in stats() and the debug log
+                log_event(log, logging.DEBUG, 'prefetch_failed', f"Prefetch {key} failed: {e}",
+                          key=str(key), error=str(e))
+                outcome = 'failed'
+            with self.cond:
+                self.counts[outcome] += 1
+                if outcome != 'fetched':
+                    self.done.pop(key, None)  # offline or failed: may be retried by a later plan
+
+    def stats(self):
+        with self.cond:
+            return dict(self.counts, pending=len(self.pending), heading=self.plan_heading)
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.pending.clear()
+            self.queued.clear()
+            self.cond.notify_all()
@@ -0,0 +1,72 @@
+# ============================================================================
+# FILE 17: trace_io.py (Load recorded rover tracks: GPX, CSV, NDJSON, track log)
+# ============================================================================
+#
+# Every loader returns a list of fix dicts in the server's format
+# ({'latitude', 'longitude', optional 'timestamp', 'accuracy', 'device_id'}),
+# so recorded tracks can be replayed into the server or rendered offline.
+
+import csv
+import json
+import os
+import xml.etree.ElementTree as ElementTree
+
+from track_log import iter_records, records_to_fixes
+
+
+def load_gpx(path):
+    """Track points of a GPX file"""
+    fixes = []
+    for _, element in ElementTree.iterparse(path):
+        if element.tag.rsplit('}', 1)[-1] != 'trkpt':
+            continue
+        fix = {'latitude': float(element.get('lat')), 'longitude': float(element.get('lon'))}
+        for child in element:
+            if child.tag.rsplit('}', 1)[-1] == 'time':
+                fix['timestamp'] = child.text
+        fixes.append(fix)
+        element.clear()
+    return fixes
+
+
+def load_csv(path):
+    """CSV with latitude/longitude (or lat/lon) columns, optional timestamp, accuracy, device_id"""
+    fixes = []
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            row = {key.strip().lower(): value for key, value in row.items() if key}
+            fix = {'latitude': float(row.get('latitude') or row['lat']),
+                   'longitude': float(row.get('longitude') or row.get('lon') or row['lng'])}
+            for key in ('timestamp', 'device_id'):
+                if row.get(key):
+                    fix[key] = row[key]
+            if row.get('accuracy'):
+                fix['accuracy'] = float(row['accuracy'])
+            fixes.append(fix)
+    return fixes
+
+
+def load_ndjson(path):
+    """One fix object per line (e.g. `python track_log.py track_log/` output)"""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_track_log(directory):
+    """Every committed fix of a track log directory, oldest first"""
+    fixes = []
+    for chunk in iter_records(directory):
+        fixes.extend(records_to_fixes(chunk))
+    return fixes
+
+
+def load_trace(path):
+    """Pick the loader from the path: track log directory, .gpx, .csv, else NDJSON"""
+    if os.path.isdir(path):
+        return load_track_log(path)
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.gpx':
+        return load_gpx(path)
+    if extension == '.csv':
+        return load_csv(path)
+    return load_ndjson(path)
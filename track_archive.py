@@ -0,0 +1,293 @@
+# ============================================================================
+# FILE 23: track_archive.py (Columnar, delta-encoded mission archives)
+# ============================================================================
+#
+# A mission of millions of fixes is archived per device as columns, cut into
+# chunks of CHUNK_SIZE fixes (sorted by time):
+#   time       int64 milliseconds since the epoch
+#   latitude   int32 degrees * 1e7
+#   longitude  int32 degrees * 1e7
+#   accuracy   int32 decimetres (-1 = not provided)
+# Each column of a chunk is stored as deltas from the previous value (the
+# first one from 0), zigzag-mapped to unsigned and LEB128 varint-encoded, so
+# a 1 Hz track costs a few bytes per fix. The file ends with a chunk index
+# (device, count, first/last time, byte offset, column lengths) and the
+# device list, which is enough to decode only the chunks overlapping a time
+# range. Decoding is vectorized NumPy straight from a memory map.
+#
+# File layout (little-endian):
+#   header   8s magic 'ARCTRKA1', uint32 version, uint32 chunk size
+#   chunks   column blobs, back to back
+#   index    chunk_count x INDEX_DTYPE, then the device list as JSON
+#   trailer  uint64 index offset, uint32 chunk count, uint32 JSON length, 8s magic
+#
+#   python track_archive.py export --trace track_log/ --out mission.arctrk
+#   python track_archive.py info mission.arctrk
+
+import argparse
+import json
+import os
+import struct
+
+import numpy as np
+
+from derived_metrics import fix_time
+from device_registry import DEFAULT_DEVICE_ID
+
+MAGIC = b'ARCTRKA1'
+VERSION = 1
+HEADER = struct.Struct('<8sII')
+TRAILER = struct.Struct('<QII8s')
+CHUNK_SIZE = 4096
+TIME_SCALE = 1000          # milliseconds
+COORDINATE_SCALE = 1e7
+ACCURACY_SCALE = 10        # decimetres
+MISSING_ACCURACY = -1
+COLUMNS = ('time', 'latitude', 'longitude', 'accuracy')
+
+INDEX_DTYPE = np.dtype([
+    ('device', '<u4'),         # position in the device list
+    ('count', '<u4'),
+    ('first_time', '<i8'),     # milliseconds
+    ('last_time', '<i8'),
+    ('offset', '<u8'),         # file offset of the chunk's first column
+    ('lengths', '<u4', (len(COLUMNS),)),
+])
+
+
+def zigzag_encode(values):
+    """int64 -> uint64 with small magnitudes (of either sign) staying small"""
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def zigzag_decode(values):
+    values = values.astype(np.uint64)
+    return ((values >> np.uint64(1)).astype(np.int64)) ^ -((values & np.uint64(1)).astype(np.int64))
+
+
+def varint_encode(values):
+    """uint64 array -> LEB128 bytes (7 bits per byte, high bit = more bytes follow)"""
+    values = values.astype(np.uint64)
+    if not len(values):
+        return b''
+    sizes = np.ones(len(values), dtype=np.int64)
+    for shift in range(7, 64, 7):
+        sizes += values >= np.uint64(1 << shift)
+    width = int(sizes.max())
+    groups = np.stack([(values >> np.uint64(7 * i)) & np.uint64(0x7F) for i in range(width)], axis=1)
+    position = np.arange(width)
+    groups |= np.where(position < (sizes - 1)[:, None], np.uint64(0x80), np.uint64(0))
+    return groups.astype(np.uint8)[position < sizes[:, None]].tobytes()
+
+
+def varint_decode(data, count):
+    """LEB128 bytes (uint8 array) -> uint64 array of `count` values"""
+    if isinstance(data, bytes):
+        data = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(data < 0x80)
+    if len(ends) != count:
+        raise ValueError(f"corrupt column: {len(ends)} values, expected {count}")
+    if not count:
+        return np.empty(0, dtype=np.uint64)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    value_of_byte = np.repeat(np.arange(count), ends - starts + 1)
+    shifts = (np.arange(len(data)) - starts[value_of_byte]) * 7
+    parts = (data & 0x7F).astype(np.uint64) << shifts.astype(np.uint64)
+    return np.bitwise_or.reduceat(parts, starts)
+
+
+def encode_column(values):
+    values = np.asarray(values, dtype=np.int64)
+    return varint_encode(zigzag_encode(np.diff(values, prepend=0)))
+
+
+def decode_column(data, count):
+    return np.cumsum(zigzag_decode(varint_decode(data, count)))
+
+
+def scale_track(times, lats, lons, accuracies=None):
+    """Float columns -> integer columns, sorted by time; fixes without a time are dropped"""
+    times, lats, lons = (np.asarray(a, dtype=float) for a in (times, lats, lons))
+    accuracies = np.full(len(times), np.nan) if accuracies is None else np.asarray(accuracies, dtype=float)
+    keep = np.isfinite(times) & np.isfinite(lats) & np.isfinite(lons)
+    order = np.argsort(times[keep], kind='stable')
+    accuracy = accuracies[keep][order]
+    return (np.round(times[keep][order] * TIME_SCALE).astype(np.int64),
+            np.round(lats[keep][order] * COORDINATE_SCALE).astype(np.int64),
+            np.round(lons[keep][order] * COORDINATE_SCALE).astype(np.int64),
+            np.where(np.isnan(accuracy), MISSING_ACCURACY,
+                     np.round(np.nan_to_num(accuracy) * ACCURACY_SCALE)).astype(np.int64))
+
+
+def write_archive(path, tracks, chunk_size=CHUNK_SIZE):
+    """
+    Write {device_id: {'time', 'latitude', 'longitude'[, 'accuracy']}} (arrays,
+    time in epoch seconds) to `path`; returns the number of fixes written.
+    """
+    devices = sorted(device_id for device_id, track in tracks.items() if len(track['time']))  # no empty tracks
+    index = []
+    total = 0
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, chunk_size))
+        for device_number, device_id in enumerate(devices):
+            track = tracks[device_id]
+            columns = scale_track(track['time'], track['latitude'], track['longitude'], track.get('accuracy'))
+            for start in range(0, len(columns[0]), chunk_size):
+                chunk = [column[start:start + chunk_size] for column in columns]
+                blobs = [encode_column(column) for column in chunk]
+                index.append((device_number, len(chunk[0]), chunk[0][0], chunk[0][-1], f.tell(),
+                              [len(blob) for blob in blobs]))
+                for blob in blobs:
+                    f.write(blob)
+                total += len(chunk[0])
+        index_offset = f.tell()
+        f.write(np.array(index, dtype=INDEX_DTYPE).tobytes())
+        device_json = json.dumps(devices).encode('utf-8')
+        f.write(device_json)
+        f.write(TRAILER.pack(index_offset, len(index), len(device_json), MAGIC))
+    os.replace(temporary, path)
+    return total
+
+
+def tracks_from_records(record_chunks):
+    """Track log record arrays (see track_log.iter_records) -> tracks for write_archive"""
+    records = [chunk for chunk in record_chunks if len(chunk)]
+    if not records:
+        return {}
+    records = np.concatenate(records)
+    times = np.where(np.isnan(records['device_time']), records['received_time'], records['device_time'])
+    device_ids, device_of_record = np.unique(records['device_id'], return_inverse=True)
+    tracks = {}
+    for number, raw_id in enumerate(device_ids):
+        mask = device_of_record == number
+        tracks[raw_id.decode('utf-8', 'replace') or DEFAULT_DEVICE_ID] = {
+            'time': times[mask], 'latitude': records['latitude'][mask],
+            'longitude': records['longitude'][mask], 'accuracy': records['accuracy'][mask]}
+    return tracks
+
+
+def tracks_from_fixes(fixes):
+    """Fix dicts (see trace_io) -> tracks for write_archive"""
+    columns = {}
+    for fix in fixes:
+        column = columns.setdefault(fix.get('device_id') or DEFAULT_DEVICE_ID, ([], [], [], []))
+        accuracy = fix.get('accuracy')
+        column[0].append(fix_time(fix))
+        column[1].append(float(fix['latitude']))
+        column[2].append(float(fix['longitude']))
+        column[3].append(float('nan') if accuracy is None else float(accuracy))
+    return {device_id: dict(zip(COLUMNS, (np.array(values, dtype=float) for values in column)))
+            for device_id, column in columns.items()}
+
+
+class TrackArchive:
+    """Read-only view of an archive file, decoded from a memory map on demand"""
+
+    def __init__(self, path):
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        if len(self.data) < HEADER.size + TRAILER.size:
+            raise ValueError(f"{path} is not a track archive")
+        magic, version, self.chunk_size = HEADER.unpack(bytes(self.data[:HEADER.size]))
+        index_offset, chunk_count, json_length, end_magic = TRAILER.unpack(bytes(self.data[-TRAILER.size:]))
+        if magic != MAGIC or end_magic != MAGIC:
+            raise ValueError(f"{path} is not a track archive (or was not completely written)")
+        if version != VERSION:
+            raise ValueError(f"unsupported track archive version {version}")
+        self.index = np.frombuffer(self.data, dtype=INDEX_DTYPE, count=chunk_count, offset=index_offset)
+        device_start = index_offset + chunk_count * INDEX_DTYPE.itemsize
+        self.devices = json.loads(bytes(self.data[device_start:device_start + json_length]).decode('utf-8'))
+
+    def _device_rows(self, device_id):
+        """Index rows of one device's chunks; KeyError if the archive doesn't have it"""
+        if device_id not in self.devices:
+            raise KeyError(device_id)
+        return self.index[self.index['device'] == self.devices.index(device_id)]
+
+    def time_range(self, device_id=None):
+        """(first, last) epoch seconds of one device, or of the whole archive (None if empty)"""
+        rows = self.index if device_id is None else self._device_rows(device_id)
+        if not len(rows):
+            return None
+        return int(rows['first_time'].min()) / TIME_SCALE, int(rows['last_time'].max()) / TIME_SCALE
+
+    def count(self, device_id=None):
+        if device_id is None:
+            return int(self.index['count'].sum())
+        return int(self._device_rows(device_id)['count'].sum())
+
+    def _decode_chunk(self, row):
+        columns = []
+        offset = int(row['offset'])
+        for length in row['lengths']:
+            columns.append(decode_column(self.data[offset:offset + length], int(row['count'])))
+            offset += int(length)
+        return columns
+
+    def load(self, device_id, since=None, until=None):
+        """
+        Columns of one device's fixes between since/until (epoch seconds,
+        inclusive) as float arrays: time, latitude, longitude, accuracy (NaN
+        if not provided). Only chunks that overlap the range are decoded.
+        """
+        rows = self._device_rows(device_id)
+        low = -np.inf if since is None else round(since * TIME_SCALE)
+        high = np.inf if until is None else round(until * TIME_SCALE)
+        rows = rows[(rows['last_time'] >= low) & (rows['first_time'] <= high)]
+        decoded = [self._decode_chunk(row) for row in rows]
+        if decoded:
+            times, lats, lons, accuracy = (np.concatenate(parts) for parts in zip(*decoded))
+        else:
+            times = lats = lons = accuracy = np.empty(0, dtype=np.int64)
+        first = np.searchsorted(times, low, side='left')
+        last = np.searchsorted(times, high, side='right')
+        accuracy = accuracy[first:last]
+        return {
+            'time': times[first:last] / TIME_SCALE,
+            'latitude': lats[first:last] / COORDINATE_SCALE,
+            'longitude': lons[first:last] / COORDINATE_SCALE,
+            'accuracy': np.where(accuracy < 0, np.nan, accuracy / ACCURACY_SCALE),
+        }
+
+    def close(self):
+        self.index = None
+        self.data = None
+
+
+if __name__ == '__main__':
+    from datetime import datetime
+    import time
+
+    parser = argparse.ArgumentParser(description="Columnar mission archive tools")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help="Archive a track log directory or trace file")
+    export_parser.add_argument('--trace', required=True, help="track log directory, GPX, CSV or NDJSON file")
+    export_parser.add_argument('--out', required=True)
+    info_parser = subparsers.add_parser('info', help="Devices, fix counts and time ranges of an archive")
+    info_parser.add_argument('archive')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        started = time.perf_counter()
+        if os.path.isdir(args.trace):
+            from track_log import iter_records
+            tracks = tracks_from_records(iter_records(args.trace))
+        else:
+            from trace_io import load_trace
+            tracks = tracks_from_fixes(load_trace(args.trace))
+        total = write_archive(args.out, tracks)
+        size = os.path.getsize(args.out)
+        devices = sum(1 for track in tracks.values() if len(track['time']))
+        print(f"📦 {total} fixes of {devices} device(s) -> {args.out} "
+              f"({size / max(total, 1):.1f} bytes/fix, {time.perf_counter() - started:.2f}s)")
+    else:
+        archive = TrackArchive(args.archive)
+        for device_id in archive.devices:
+            if not archive.count(device_id):
+                print(f"🛰️ {device_id}: 0 fixes")  # archives written before empty tracks were skipped
+                continue
+            first, last = archive.time_range(device_id)
+            print(f"🛰️ {device_id}: {archive.count(device_id)} fixes, "
+                  f"{datetime.fromtimestamp(first).isoformat()} -> {datetime.fromtimestamp(last).isoformat()}")
@@ -0,0 +1,212 @@
+# ============================================================================
+# FILE 11: track_history.py (Unbounded track history + level-of-detail paths)
+# ============================================================================
+#
+# The full track is kept in NumPy columns that grow by doubling, so appends
+# are amortised O(1) and nothing is ever dropped. For drawing, the track is
+# simplified with a vectorized Douglas-Peucker in world pixels at the current
+# zoom (tolerance ~1 px), so the polyline keeps its on-screen shape with far
+# fewer vertices. Simplification runs per fixed-size chunk and finished
+# chunks are cached, so each new fix only re-simplifies the open tail.
+# The viewer appends on its GPS thread and draws on the Tk thread, so every
+# public method runs under one lock (appends are O(1), drawing only
+# re-simplifies the tail, so neither side waits long).
+
+import threading
+
+import numpy as np
+
+from web_mercator import latlon_to_world
+
+CHUNK_SIZE = 256
+MAX_CHUNK_TOLERANCE = 256  # world pixels
+
+
+def douglas_peucker(xs, ys, tolerance):
+    """Indices of the points kept by Douglas-Peucker (first and last always kept)"""
+    n = len(xs)
+    if n < 3:
+        return np.arange(n)
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        # Perpendicular distance of every inner point to the start-end chord, in one go
+        x0, y0, x1, y1 = xs[start], ys[start], xs[end], ys[end]
+        inner_x, inner_y = xs[start + 1:end], ys[start + 1:end]
+        dx, dy = x1 - x0, y1 - y0
+        length = np.hypot(dx, dy)
+        if length == 0:
+            distances = np.hypot(inner_x - x0, inner_y - y0)
+        else:
+            distances = np.abs(dy * (inner_x - x0) - dx * (inner_y - y0)) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return np.flatnonzero(keep)
+
+
+class TrackHistory:
+    """Growable lat/lon/time columns with cached zoom-dependent simplification"""
+
+    def __init__(self, initial_capacity=1024):
+        self.lats = np.empty(initial_capacity)
+        self.lons = np.empty(initial_capacity)
+        self.times = np.empty(initial_capacity)
+        self.count = 0
+        self.chunk_cache = {}   # (zoom, tolerance, level, chunk index) -> kept indices
+        self.prefix_cache = {}  # (zoom, tolerance, level) -> (closed chunks, kept indices)
+        self.world_cache = {}  # zoom -> (xs, ys, projected count)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self, needed):
+        capacity = len(self.lats)
+        while capacity < needed:
+            capacity *= 2
+        if capacity != len(self.lats):
+            for name in ('lats', 'lons', 'times'):
+                column = np.empty(capacity)
+                column[:self.count] = getattr(self, name)[:self.count]
+                setattr(self, name, column)
+
+    def append(self, lat, lon, timestamp):
+        with self.lock:
+            self._grow(self.count + 1)
+            self.lats[self.count] = lat
+            self.lons[self.count] = lon
+            self.times[self.count] = timestamp
+            self.count += 1
+
+    def extend(self, lats, lons, timestamps):
+        n = len(lats)
+        with self.lock:
+            self._grow(self.count + n)
+            self.lats[self.count:self.count + n] = lats
+            self.lons[self.count:self.count + n] = lons
+            self.times[self.count:self.count + n] = timestamps
+            self.count += n
+
+    def truncate(self, count):
+        """Keep the first `count` points; simplification of chunks before the cut stays cached"""
+        with self.lock:
+            if count >= self.count:
+                return
+            self.count = count
+            closed = max(count - 1, 0) // CHUNK_SIZE  # chunks that are still complete
+            for key in [key for key in self.chunk_cache if key[3] >= closed]:
+                del self.chunk_cache[key]
+            for key, (done, prefix) in list(self.prefix_cache.items()):
+                if done > closed:
+                    kept = prefix[prefix <= closed * CHUNK_SIZE] if closed else prefix[:0]
+                    self.prefix_cache[key] = (closed, kept)
+            for zoom, (xs, ys, done) in list(self.world_cache.items()):
+                self.world_cache[zoom] = (xs, ys, min(done, count))
+
+    def clear(self):
+        with self.lock:
+            self.count = 0
+            self.chunk_cache.clear()
+            self.prefix_cache.clear()
+            self.world_cache.clear()
+
+    def points(self):
+        """(lats, lons, times) views of the stored track"""
+        with self.lock:
+            return self.lats[:self.count], self.lons[:self.count], self.times[:self.count]
+
+    def recent(self, k):
+        """(lats, lons, times) of the last k points"""
+        with self.lock:
+            start = max(self.count - k, 0)
+            return self.lats[start:self.count], self.lons[start:self.count], self.times[start:self.count]
+
+    def _world(self, zoom):
+        """World-pixel coordinates of the track at a zoom, projecting only new points"""
+        xs, ys, done = self.world_cache.get(zoom, (None, None, 0))
+        if xs is None or len(xs) < self.count:
+            grown_x, grown_y = np.empty(len(self.lats)), np.empty(len(self.lats))
+            if xs is not None:
+                grown_x[:done], grown_y[:done] = xs[:done], ys[:done]
+            xs, ys = grown_x, grown_y
+        if done < self.count:
+            xs[done:self.count], ys[done:self.count] = latlon_to_world(
+                self.lats[done:self.count], self.lons[done:self.count], zoom)
+            self.world_cache[zoom] = (xs, ys, self.count)
+        return xs[:self.count], ys[:self.count]
+
+    def _chunk_indices(self, xs, ys, zoom, tolerance, level, chunk):
+        """
+        Kept indices of one chunk at a tolerance level. A chunk shares its last
+        point with the next chunk. Coarser levels start from the next finer
+        level's result, so they only look at already simplified points.
+        """
+        start = chunk * CHUNK_SIZE
+        end = min(start + CHUNK_SIZE + 1, self.count)
+        closed = end == start + CHUNK_SIZE + 1
+        key = (zoom, tolerance, level, chunk)
+        if closed and key in self.chunk_cache:
+            return self.chunk_cache[key]
+        if level == tolerance:
+            source = np.arange(start, end)
+        else:
+            source = self._chunk_indices(xs, ys, zoom, tolerance, level / 2, chunk)
+        indices = source[douglas_peucker(xs[source], ys[source], level)]
+        if closed:
+            self.chunk_cache[key] = indices
+        return indices
+
+    def _level_indices(self, xs, ys, zoom, tolerance, level):
+        """Kept indices of the whole track at a level; the closed-chunk prefix is cached"""
+        chunks = (self.count - 2) // CHUNK_SIZE + 1
+        closed_chunks = (self.count - 1) // CHUNK_SIZE
+        done, prefix = self.prefix_cache.get((zoom, tolerance, level), (0, np.empty(0, dtype=np.intp)))
+        if done < closed_chunks:
+            # Drop each chunk's first point: it is the previous chunk's last point
+            parts = [prefix] + [self._chunk_indices(xs, ys, zoom, tolerance, level, chunk)[1 if chunk else 0:]
+                                for chunk in range(done, closed_chunks)]
+            prefix = np.concatenate(parts)
+            done = closed_chunks
+            self.prefix_cache[(zoom, tolerance, level)] = (done, prefix)
+        if chunks == closed_chunks:
+            return prefix
+        tail = self._chunk_indices(xs, ys, zoom, tolerance, level, chunks - 1)
+        return np.concatenate([prefix, tail[1 if len(prefix) else 0:]])
+
+    def simplified(self, zoom, max_vertices=500, tolerance=1.0):
+        """
+        (lats, lons) of a polyline that looks like the full track at `zoom`
+        (error <= tolerance world pixels) with at most max_vertices points.
+        """
+        with self.lock:
+            return self._simplified(zoom, max_vertices, tolerance)
+
+    def _simplified(self, zoom, max_vertices, tolerance):
+        if self.count < 3:
+            return self.lats[:self.count].copy(), self.lons[:self.count].copy()
+
+        xs, ys = self._world(zoom)
+
+        # Double the tolerance until the line is small enough; finished chunks are
+        # cached at every level, so in steady state only the open tail is re-simplified
+        level = tolerance
+        indices = self._level_indices(xs, ys, zoom, tolerance, level)
+        while len(indices) > max_vertices and level < MAX_CHUNK_TOLERANCE:
+            level *= 2
+            indices = self._level_indices(xs, ys, zoom, tolerance, level)
+
+        # Very long tracks: every chunk keeps at least two points, so finish globally
+        while len(indices) > max_vertices:
+            level *= 2
+            indices = indices[douglas_peucker(xs[indices], ys[indices], level)]
+
+        return self.lats[indices], self.lons[indices]
@@ -0,0 +1,320 @@
+# ============================================================================
+# FILE 3: track_log.py (Append-only memory-mapped segment log for GPS fixes)
+# ============================================================================
+#
+# Every fix is stored as one fixed-size 64-byte record in a preallocated,
+# memory-mapped segment file. Segments rotate when full, so the whole mission
+# can be replayed afterwards.
+#
+# Segment layout:
+#   header (64 bytes): magic, record size, capacity, base sequence number
+#   records (capacity x 64 bytes), see RECORD_DTYPE
+#
+# A record is committed when its `seq` field is non-zero and its CRC matches.
+# The writer fills the payload (including the CRC) first and the `seq` field
+# last, so a reader never picks up a half-written record.
+
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+import json
+from datetime import datetime
+import numpy as np
+
+MAGIC = b'ARCTRKL1'
+HEADER_FORMAT = '<8sIIQ'
+HEADER_SIZE = 64
+RECORD_SIZE = 64
+DEFAULT_RECORDS_PER_SEGMENT = 65536  # 4 MB per segment
+
+RECORD_DTYPE = np.dtype([
+    ('seq', '<u8'),            # 1-based sequence number, 0 = empty slot
+    ('device_time', '<f8'),    # device timestamp, epoch seconds (NaN if unknown)
+    ('received_time', '<f8'),  # server receive time, epoch seconds
+    ('latitude', '<f8'),
+    ('longitude', '<f8'),
+    ('accuracy', '<f4'),       # metres (NaN if not provided)
+    ('device_id', 'S16'),
+    ('crc', '<u4'),            # CRC32 of bytes [0:60]
+])
+assert RECORD_DTYPE.itemsize == RECORD_SIZE
+
+PAYLOAD_FIELDS = [name for name in RECORD_DTYPE.names if name != 'seq']
+
+
+def segment_path(directory, index):
+    """Path of the segment file with the given index"""
+    return os.path.join(directory, f"segment-{index:06d}.trk")
+
+
+def list_segments(directory):
+    """Sorted list of (index, path) for all segments in a directory"""
+    segments = []
+    if not os.path.isdir(directory):
+        return segments
+    for name in os.listdir(directory):
+        if name.startswith('segment-') and name.endswith('.trk'):
+            try:
+                segments.append((int(name[8:-4]), os.path.join(directory, name)))
+            except ValueError:
+                continue
+    return sorted(segments)
+
+
+def record_crcs(records):
+    """CRC32 of the first 60 bytes of each record"""
+    raw = records.view(np.uint8).reshape(len(records), RECORD_SIZE)
+    return np.array([zlib.crc32(row[:RECORD_SIZE - 4].tobytes()) for row in raw], dtype=np.uint32)
+
+
+def committed_count(view, start=0):
+    """Number of committed records in a segment view, scanning from `start`"""
+    empty = np.flatnonzero(view['seq'][start:] == 0)
+    end = start + (empty[0] if len(empty) else len(view) - start)
+    # Only the tail can be torn (single writer, seq written last)
+    while end > start:
+        tail = np.array(view[end - 1:end])
+        if record_crcs(tail)[0] == tail['crc'][0]:
+            break
+        end -= 1
+    return end
+
+
+def parse_timestamp(timestamp):
+    """Convert an ISO timestamp (Flutter style, with or without 'Z') to epoch seconds"""
+    if not timestamp:
+        return float('nan')
+    try:
+        return datetime.fromisoformat(str(timestamp).replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return float('nan')
+
+
+def accuracy_value(accuracy):
+    """Accuracy as stored in a record: NaN when missing or not a number"""
+    try:
+        return np.nan if accuracy is None else float(accuracy)
+    except (TypeError, ValueError):
+        return np.nan  # one bad fix must not fail a whole (group-committed) append
+
+
+def records_to_fixes(records):
+    """Convert log records into the fix dicts used by the server and viewer"""
+    fixes = []
+    for rec in records:
+        device_time = float(rec['device_time'])
+        accuracy = float(rec['accuracy'])
+        timestamp = device_time if not np.isnan(device_time) else float(rec['received_time'])
+        fixes.append({
+            'seq': int(rec['seq']),
+            'device_id': rec['device_id'].decode('utf-8', 'replace') or None,
+            'latitude': float(rec['latitude']),
+            'longitude': float(rec['longitude']),
+            'timestamp': datetime.fromtimestamp(timestamp).isoformat(),
+            'accuracy': None if np.isnan(accuracy) else accuracy,
+            'server_received_at': float(rec['received_time'])
+        })
+    return fixes
+
+
+class _Segment:
+    """One memory-mapped segment file"""
+
+    def __init__(self, path, writable):
+        self.path = path
+        self.file = open(path, 'r+b' if writable else 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0,
+                            access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        magic, record_size, capacity, base_seq = struct.unpack_from(HEADER_FORMAT, self.mm, 0)
+        if magic != MAGIC or record_size != RECORD_SIZE:
+            self.close()
+            raise ValueError(f"Not a track log segment: {path}")
+        self.capacity = capacity
+        self.base_seq = base_seq
+        self.records = np.frombuffer(self.mm, dtype=RECORD_DTYPE, count=capacity, offset=HEADER_SIZE)
+
+    @classmethod
+    def create(cls, path, capacity, base_seq):
+        """Preallocate a new segment and write its header"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.truncate(HEADER_SIZE + capacity * RECORD_SIZE)
+            f.write(struct.pack(HEADER_FORMAT, MAGIC, RECORD_SIZE, capacity, base_seq))
+        # Readers only ever see fully initialised segments
+        os.replace(tmp_path, path)
+        return cls(path, writable=True)
+
+    def close(self):
+        self.records = None
+        try:
+            self.mm.close()
+        except BufferError:
+            # A caller still holds a zero-copy view; the mapping is released with it
+            pass
+        self.file.close()
+
+
+class TrackLogWriter:
+    """Append-only writer; appends are O(1) and a whole batch goes in with one copy"""
+
+    def __init__(self, directory, records_per_segment=DEFAULT_RECORDS_PER_SEGMENT, sync=False):
+        self.directory = directory
+        self.records_per_segment = records_per_segment
+        self.sync = sync  # msync after every append (survives power loss, costs latency)
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        segments = list_segments(directory)
+        if segments:
+            self.segment_index, path = segments[-1]
+            self.segment = _Segment(path, writable=True)
+            self.position = self._recover(self.segment)
+            if self.position:
+                self.next_seq = int(self.segment.records['seq'][self.position - 1]) + 1
+            else:
+                self.next_seq = self.segment.base_seq
+        else:
+            self.segment_index = 0
+            self.next_seq = 1
+            self.segment = _Segment.create(segment_path(directory, 0), records_per_segment, 1)
+            self.position = 0
+
+    def _recover(self, segment):
+        """Find the append position after a restart and wipe any torn tail record"""
+        position = committed_count(segment.records)
+        leftovers = np.flatnonzero(segment.records['seq'][position:] != 0)
+        if len(leftovers):
+            segment.records[position:position + leftovers[-1] + 1] = np.zeros(1, dtype=RECORD_DTYPE)
+        return position
+
+    def _rotate(self):
+        """Close the full segment and start the next one"""
+        self.segment.mm.flush()
+        self.segment.close()
+        self.segment_index += 1
+        self.segment = _Segment.create(segment_path(self.directory, self.segment_index),
+                                       self.records_per_segment, self.next_seq)
+        self.position = 0
+
+    def append(self, fixes, received_time=None):
+        """Append a list of fix dicts; returns the sequence numbers assigned"""
+        if not fixes:
+            return []
+        received_time = received_time if received_time is not None else datetime.now().timestamp()
+
+        records = np.zeros(len(fixes), dtype=RECORD_DTYPE)
+        records['latitude'] = [fix['latitude'] for fix in fixes]
+        records['longitude'] = [fix['longitude'] for fix in fixes]
+        records['accuracy'] = [accuracy_value(fix.get('accuracy')) for fix in fixes]
+        records['device_time'] = [parse_timestamp(fix.get('timestamp')) for fix in fixes]
+        # Group commits mix fixes from many requests: keep each fix's own receive time
+        records['received_time'] = [fix.get('server_received_at') or received_time for fix in fixes]
+        records['device_id'] = [str(fix.get('device_id') or '').encode('utf-8')[:16] for fix in fixes]
+
+        with self.lock:
+            first_seq = self.next_seq
+            records['seq'] = np.arange(first_seq, first_seq + len(fixes), dtype=np.uint64)
+            records['crc'] = record_crcs(records)
+
+            written = 0
+            while written < len(records):
+                if self.position == self.segment.capacity:
+                    self._rotate()
+                count = min(len(records) - written, self.segment.capacity - self.position)
+                chunk = records[written:written + count]
+                target = self.segment.records[self.position:self.position + count]
+                # Payload first, seq last: that is the commit
+                for name in PAYLOAD_FIELDS:
+                    target[name] = chunk[name]
+                target['seq'] = chunk['seq']
+                self.position += count
+                written += count
+
+            self.next_seq += len(records)
+            if self.sync:
+                self.segment.mm.flush()
+
+        return list(range(first_seq, first_seq + len(fixes)))
+
+    def close(self):
+        """Flush and close the active segment"""
+        with self.lock:
+            self.segment.mm.flush()
+            self.segment.close()
+
+
+class TrackLogReader:
+    """Zero-copy reader that follows a track log from its last known offset"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.segment = None
+        self.segment_index = None
+        self.position = 0
+
+    def _open(self, index):
+        """Map a segment for reading; returns False if it does not exist yet"""
+        path = segment_path(self.directory, index)
+        if not os.path.exists(path):
+            return False
+        if self.segment:
+            self.segment.close()
+        self.segment = _Segment(path, writable=False)
+        self.segment_index = index
+        self.position = 0
+        return True
+
+    def seek_start(self):
+        """Position the cursor at the first record of the log"""
+        segments = list_segments(self.directory)
+        return bool(segments) and self._open(segments[0][0])
+
+    def seek_latest(self):
+        """Position the cursor on the most recent committed record"""
+        segments = list_segments(self.directory)
+        if not segments or not self._open(segments[-1][0]):
+            return False
+        self.position = max(committed_count(self.segment.records) - 1, 0)
+        return True
+
+    def read_new(self):
+        """
+        Return the records committed since the last call as a read-only NumPy
+        view into the mapped segment (no copy, no parsing). Only records from
+        the current segment are returned; call again to continue after rotation.
+        """
+        if self.segment is None and not self.seek_start():
+            return np.empty(0, dtype=RECORD_DTYPE)
+
+        if self.position == self.segment.capacity and not self._open(self.segment_index + 1):
+            return np.empty(0, dtype=RECORD_DTYPE)
+
+        start = self.position
+        self.position = committed_count(self.segment.records, start)
+        return self.segment.records[start:self.position]
+
+    def close(self):
+        if self.segment:
+            self.segment.close()
+            self.segment = None
+
+
+def iter_records(directory):
+    """Replay a whole mission: yields one record array per segment, oldest first"""
+    for _, path in list_segments(directory):
+        segment = _Segment(path, writable=False)
+        try:
+            yield np.array(segment.records[:committed_count(segment.records)])
+        finally:
+            segment.close()
+
+
+if __name__ == '__main__':
+    # Export a track log as NDJSON: python track_log.py <directory>
+    log_dir = sys.argv[1] if len(sys.argv) > 1 else 'track_log'
+    for chunk in iter_records(log_dir):
+        for fix in records_to_fixes(chunk):
+            print(json.dumps(fix))
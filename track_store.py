@@ -0,0 +1,223 @@
+# ============================================================================
+# FILE 16: track_store.py (Queryable fix history in SQLite, WAL mode)
+# ============================================================================
+#
+# Every accepted fix is inserted into one SQLite table so the history can be
+# queried: "where was rover-3 between 14:00 and 14:20", "every fix inside this
+# bounding box". Indexes:
+#   - (device_id, t, id) for per-device time ranges, (t, id) across devices
+#   - an R-tree on (latitude, longitude) for bounding boxes (falls back to a
+#     latitude index if this SQLite build has no R-tree module)
+# WAL mode lets the writer commit batches while readers stream results.
+# Results are ordered by (t, id) and paged with a keyset cursor, so a page
+# never needs OFFSET scans and rows are streamed straight from the cursor.
+#
+# Backfill from an existing track log:
+#   python track_store.py import track_log/ --db track_store.sqlite3
+
+import argparse
+import math
+import sqlite3
+import threading
+from datetime import datetime
+
+from track_log import parse_timestamp
+
+DEFAULT_DB_PATH = 'track_store.sqlite3'
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 50000
+FETCH_SIZE = 500  # rows pulled from SQLite at a time while streaming
+
+
+def encode_cursor(t, row_id):
+    return f"{t!r}:{row_id}"
+
+
+def decode_cursor(cursor):
+    """'<t>:<id>' -> (t, id); ValueError if malformed"""
+    t, _, row_id = cursor.rpartition(':')
+    return float(t), int(row_id)
+
+
+class TrackStore:
+    """Append-mostly fix history with time and spatial indexes"""
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.local = threading.local()  # one read connection per thread
+        self.conn = self._connect()
+        with self.lock, self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS fixes ("
+                              "id INTEGER PRIMARY KEY, device_id TEXT NOT NULL, "
+                              "t REAL NOT NULL, received_at REAL, "
+                              "latitude REAL NOT NULL, longitude REAL NOT NULL, accuracy REAL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS fixes_device_time ON fixes (device_id, t, id)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS fixes_time ON fixes (t, id)")
+            try:
+                self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS fixes_rtree "
+                                  "USING rtree(id, min_lat, max_lat, min_lon, max_lon)")
+                self.spatial = 'rtree'
+            except sqlite3.OperationalError:
+                self.conn.execute("CREATE INDEX IF NOT EXISTS fixes_latitude ON fixes (latitude, longitude)")
+                self.spatial = 'btree'
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # durable at checkpoints, no fsync per commit
+        return conn
+
+    def _reader(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = self._connect()
+        return conn
+
+    def insert_many(self, fixes, received_at=None):
+        """Insert a batch of fix dicts in one transaction; returns the number inserted"""
+        rows = []
+        for fix in fixes:
+            received = fix.get('server_received_at') or received_at
+            t = parse_timestamp(fix.get('timestamp'))
+            if t != t:  # no usable device time: fall back to the receive time
+                t = received
+            accuracy = fix.get('accuracy')
+            try:
+                accuracy = None if accuracy is None else float(accuracy)
+            except (TypeError, ValueError):
+                accuracy = None
+            rows.append((fix.get('device_id') or 'default', t, received,
+                         float(fix['latitude']), float(fix['longitude']), accuracy))
+        if not rows:
+            return 0
+
+        with self.lock, self.conn:
+            # Take the write lock before reading the next id: other server processes
+            # insert into the same file, and a deferred transaction would let two of
+            # them hand out the same ids
+            self.conn.execute("BEGIN IMMEDIATE")
+            first_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM fixes").fetchone()[0]
+            self.conn.executemany("INSERT INTO fixes (id, device_id, t, received_at, latitude, longitude, accuracy) "
+                                  "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                  [(first_id + i,) + row for i, row in enumerate(rows)])
+            if self.spatial == 'rtree':
+                self.conn.executemany("INSERT INTO fixes_rtree VALUES (?, ?, ?, ?, ?)",
+                                      [(first_id + i, row[3], row[3], row[4], row[4])
+                                       for i, row in enumerate(rows)])
+        return len(rows)
+
+    def query(self, device_id=None, since=None, until=None, bbox=None, cursor=None,
+              limit=DEFAULT_PAGE_SIZE):
+        """
+        Yield fix dicts ordered by (time, id), at most `limit` of them.
+        bbox is (south, west, north, east); since/until are epoch seconds;
+        cursor is the value of the last row's 'cursor' from the previous page.
+        """
+        where, params = [], []
+        if device_id is not None:
+            where.append("device_id = ?")
+            params.append(device_id)
+        if since is not None:
+            where.append("t >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("t <= ?")
+            params.append(until)
+        if cursor is not None:
+            t, row_id = decode_cursor(cursor)
+            where.append("(t > ? OR (t = ? AND id > ?))")
+            params.extend([t, t, row_id])
+        if bbox is not None:
+            south, west, north, east = bbox
+            if self.spatial == 'rtree':
+                # The R-tree keeps float32 bounds (rounded outwards), so it only narrows
+                # the candidates with an overlap test; the exact test below decides
+                where.append("id IN (SELECT id FROM fixes_rtree WHERE max_lat >= ? AND min_lat <= ? "
+                             "AND max_lon >= ? AND min_lon <= ?)")
+                params.extend([south, north, west, east])
+            where.append("latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?")
+            params.extend([south, north, west, east])
+
+        sql = ("SELECT id, device_id, t, received_at, latitude, longitude, accuracy FROM fixes"
+               + (" WHERE " + " AND ".join(where) if where else "")
+               + " ORDER BY t, id LIMIT ?")
+        params.append(limit)
+
+        rows = self._reader().execute(sql, params)
+        try:
+            while True:
+                batch = rows.fetchmany(FETCH_SIZE)
+                if not batch:
+                    return
+                for row_id, device, t, received, lat, lon, accuracy in batch:
+                    yield {
+                        'id': row_id,
+                        'device_id': device,
+                        'latitude': lat,
+                        'longitude': lon,
+                        'timestamp': datetime.fromtimestamp(t).isoformat(),
+                        'time': t,
+                        'accuracy': accuracy,
+                        'server_received_at': received,
+                        'cursor': encode_cursor(t, row_id),
+                    }
+        finally:
+            rows.close()
+
+    def count(self):
+        return self._reader().execute("SELECT COUNT(*) FROM fixes").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+        reader = getattr(self.local, 'conn', None)
+        if reader is not None:
+            reader.close()
+            self.local.conn = None
+
+
+def parse_time_arg(value):
+    """Query-string time (epoch seconds or ISO 8601) -> epoch seconds; None if absent"""
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    t = parse_timestamp(value)
+    if math.isnan(t):
+        raise ValueError(f"invalid time: {value!r}")
+    return t
+
+
+def parse_bbox_arg(value):
+    """'south,west,north,east' -> tuple of floats; None if absent"""
+    if not value:
+        return None
+    parts = [float(v) for v in value.split(',')]
+    if len(parts) != 4:
+        raise ValueError("bbox must be south,west,north,east")
+    south, west, north, east = parts
+    if south > north or west > east:
+        raise ValueError("bbox must be south,west,north,east with south <= north and west <= east")
+    return south, west, north, east
+
+
+if __name__ == '__main__':
+    from track_log import iter_records, records_to_fixes
+
+    parser = argparse.ArgumentParser(description="Track store tools")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    import_parser = subparsers.add_parser('import', help="Load a track log directory into the store")
+    import_parser.add_argument('directory')
+    import_parser.add_argument('--db', default=DEFAULT_DB_PATH)
+    args = parser.parse_args()
+
+    store = TrackStore(args.db)
+    total = 0
+    for chunk in iter_records(args.directory):
+        total += store.insert_many(records_to_fixes(chunk))
+        print(f"📥 {total} fixes imported")
+    print(f"✅ {args.db} now holds {store.count()} fixes")
+    store.close()
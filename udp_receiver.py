@@ -0,0 +1,305 @@
+# ============================================================================
+# FILE 21: udp_receiver.py (Compact binary fix ingestion over UDP)
+# ============================================================================
+#
+# On the radio link a JSON POST costs a TCP handshake, HTTP headers and a
+# verbose body for ~20 bytes of real data. This listener takes fixed-layout
+# 46-byte packets over UDP instead (several may be sent back to back in one
+# datagram). All fields are big-endian (network order):
+#
+#   offset size  field
+#        0    2  magic b'AF'
+#        2    1  version (1)
+#        3    1  flags: bit 0 = timestamp present, bit 1 = accuracy present
+#        4   16  device_id, UTF-8, NUL-padded (same 16-byte limit as HTTP)
+#       20    4  sequence number, uint32, per device, wraps around
+#       24    4  latitude, int32, degrees * 1e7
+#       28    4  longitude, int32, degrees * 1e7
+#       32    8  timestamp, int64, milliseconds since the Unix epoch (UTC)
+#       40    2  accuracy, uint16, decimetres
+#       42    4  CRC-32 (zlib) of bytes 0-41
+#
+# UDP may duplicate, drop and reorder packets: each device's packets are
+# released in sequence order, duplicates are dropped, and a gap is given up
+# on after `hold` seconds (or once `window` later packets are waiting).
+# Released fixes are handed to deliver(items, received_at) as dicts shaped
+# like the HTTP body, so they go through the same validation and ingest path.
+#
+# Send a test fix:
+#   python udp_receiver.py send --port 5001 --device rover-1 --seq 1 --lat 23.7465 --lon 90.3763
+
+import argparse
+import logging
+import socket
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+from server_logging import log_event
+
+MAGIC = b'AF'
+VERSION = 1
+FLAG_TIMESTAMP = 0x01
+FLAG_ACCURACY = 0x02
+PACKET = struct.Struct('!2sBB16sIiiqH')
+CRC = struct.Struct('!I')
+PACKET_SIZE = PACKET.size + CRC.size  # 46 bytes
+COORDINATE_SCALE = 1e7
+SEQ_MODULO = 2 ** 32
+RESET_DISTANCE = 4096  # a sequence this far behind means the device restarted its counter
+RESTART_IDLE = 2.0     # seconds of silence after which a lower sequence number is a restart
+MAX_DATAGRAM = 65535
+
+log = logging.getLogger('gps.udp')
+
+
+class PacketError(ValueError):
+    """A packet that cannot be decoded (bad size, magic, version or checksum)"""
+
+
+def encode_fix(device_id, seq, latitude, longitude, timestamp=None, accuracy=None):
+    """One packet; timestamp is epoch seconds, accuracy metres (both optional)"""
+    device = device_id.encode('utf-8')
+    if len(device) > 16:
+        raise ValueError("device_id must be at most 16 bytes")
+    flags = 0
+    if timestamp is not None:
+        flags |= FLAG_TIMESTAMP
+    if accuracy is not None:
+        flags |= FLAG_ACCURACY
+    body = PACKET.pack(MAGIC, VERSION, flags, device, seq % SEQ_MODULO,
+                       int(round(latitude * COORDINATE_SCALE)), int(round(longitude * COORDINATE_SCALE)),
+                       int(round(timestamp * 1000)) if timestamp is not None else 0,
+                       min(int(round(accuracy * 10)), 0xFFFF) if accuracy is not None else 0)
+    return body + CRC.pack(zlib.crc32(body))
+
+
+def decode_packet(packet):
+    """Packet bytes -> (seq, item) with item shaped like an HTTP fix body; PacketError if invalid"""
+    if len(packet) != PACKET_SIZE:
+        raise PacketError(f"packet is {len(packet)} bytes, expected {PACKET_SIZE}")
+    body = packet[:PACKET.size]
+    if zlib.crc32(body) != CRC.unpack_from(packet, PACKET.size)[0]:
+        raise PacketError("checksum mismatch")
+    magic, version, flags, device, seq, lat, lon, millis, accuracy = PACKET.unpack(body)
+    if magic != MAGIC or version != VERSION:
+        raise PacketError(f"unknown packet type {magic!r} v{version}")
+    try:
+        device_id = device.rstrip(b'\0').decode('utf-8')
+    except UnicodeDecodeError:
+        raise PacketError("device_id is not UTF-8")
+
+    timestamp = None
+    if flags & FLAG_TIMESTAMP:
+        timestamp = (datetime.fromtimestamp(millis / 1000, timezone.utc)
+                     .isoformat(timespec='milliseconds').replace('+00:00', 'Z'))
+    return seq, {
+        'latitude': lat / COORDINATE_SCALE,
+        'longitude': lon / COORDINATE_SCALE,
+        'timestamp': timestamp,
+        'accuracy': accuracy / 10 if flags & FLAG_ACCURACY else None,
+        'device_id': device_id or None,
+    }
+
+
+def decode_datagram(datagram):
+    """
+    Split a datagram into packets: a list of ((seq, item), None) for good packets
+    and (None, PacketError) for bad ones, so one bad packet doesn't cost the rest.
+    Raises PacketError if the datagram can't be split into packets at all.
+    """
+    if not datagram or len(datagram) % PACKET_SIZE:
+        raise PacketError(f"datagram is {len(datagram)} bytes, not a multiple of {PACKET_SIZE}")
+    results = []
+    for offset in range(0, len(datagram), PACKET_SIZE):
+        try:
+            results.append((decode_packet(datagram[offset:offset + PACKET_SIZE]), None))
+        except PacketError as e:
+            results.append((None, e))
+    return results
+
+
+class _DeviceStream:
+    """Reordering state of one device"""
+
+    def __init__(self, seq, now):
+        self.expected = seq      # next sequence number to release
+        self.waiting = {}        # seq -> (arrived, item)
+        self.starting = True     # still collecting the first packets
+        self.newest = seq        # highest sequence number seen so far
+        self.last_seen = now     # arrival time of the device's latest packet
+
+
+class SequenceReorderer:
+    """
+    Per-device in-order release of sequence-numbered items. push() returns the
+    items that became releasable; expire() gives up on gaps older than `hold`.
+    A device that was silent for `restart_idle` seconds and then sends a lower
+    sequence number has restarted its counter (rebooted), not sent duplicates.
+    """
+
+    def __init__(self, hold=0.2, window=64, restart_idle=RESTART_IDLE):
+        self.hold = hold
+        self.window = window
+        self.restart_idle = restart_idle
+        self.devices = {}  # device -> _DeviceStream
+        self.counts = {'duplicates': 0, 'reordered': 0, 'lost': 0, 'resets': 0}
+
+    def push(self, device, seq, item, now):
+        state = self.devices.get(device)
+        if state is None:
+            # A device's first packets are held for `hold`, so the lowest sequence
+            # number that arrives in that time (not just the first) starts the stream
+            state = self.devices[device] = _DeviceStream(seq, now)
+        idle = now - state.last_seen
+        state.last_seen = now
+
+        # Out of order = behind the newest packet seen, whether or not it fills a gap
+        behind_newest = 0 < (state.newest - seq) % SEQ_MODULO < SEQ_MODULO // 2
+        if not behind_newest:
+            state.newest = seq
+
+        ahead = (seq - state.expected) % SEQ_MODULO
+        if state.starting and SEQ_MODULO - ahead <= RESET_DISTANCE:
+            state.expected, ahead = seq, 0
+        if ahead >= SEQ_MODULO // 2:
+            if SEQ_MODULO - ahead <= RESET_DISTANCE and idle < self.restart_idle:
+                self.counts['duplicates'] += 1  # already released (or given up on)
+                return []
+            # Far behind, or behind after a silence: the device restarted its counter.
+            # Flush what was waiting and start over from this packet
+            self.counts['resets'] += 1
+            released = [state.waiting[s][1]
+                        for s in sorted(state.waiting, key=lambda s: (s - state.expected) % SEQ_MODULO)]
+            restarted = self.devices[device] = _DeviceStream((seq + 1) % SEQ_MODULO, now)
+            restarted.starting = False
+            restarted.newest = seq
+            return released + [item]
+        if seq in state.waiting:
+            self.counts['duplicates'] += 1
+            return []
+        if behind_newest:
+            self.counts['reordered'] += 1
+        state.waiting[seq] = (now, item)
+        released = [] if state.starting else self._release(state)
+        if len(state.waiting) > self.window:
+            state.starting = False
+            released.extend(self._skip_gap(state))
+        return released
+
+    def _release(self, state):
+        """Everything contiguous from the expected sequence number"""
+        released = []
+        while state.expected in state.waiting:
+            released.append(state.waiting.pop(state.expected)[1])
+            state.expected = (state.expected + 1) % SEQ_MODULO
+        return released
+
+    def _skip_gap(self, state):
+        """Give up on the missing sequence number(s) before the oldest waiting item"""
+        first = min(state.waiting, key=lambda s: (s - state.expected) % SEQ_MODULO)
+        self.counts['lost'] += (first - state.expected) % SEQ_MODULO
+        state.expected = first
+        return self._release(state)
+
+    def expire(self, now):
+        """Release items held longer than `hold` behind a gap"""
+        released = []
+        for state in self.devices.values():
+            if state.starting and state.waiting and now - self._oldest(state) >= self.hold:
+                state.starting = False
+                released.extend(self._release(state))
+            while not state.starting and state.waiting and now - self._oldest(state) >= self.hold:
+                released.extend(self._skip_gap(state))
+        return released
+
+    @staticmethod
+    def _oldest(state):
+        return min(arrived for arrived, _ in state.waiting.values())
+
+    def pending(self):
+        return sum(len(state.waiting) for state in self.devices.values())
+
+
+class UDPReceiver:
+    """Listens for fix packets on a UDP port and delivers them in order on its own thread"""
+
+    def __init__(self, deliver, host='0.0.0.0', port=5001, hold=0.2, window=64):
+        self.deliver = deliver
+        self.reorderer = SequenceReorderer(hold, window)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)  # ride out bursts
+        self.sock.bind((host, port))
+        self.sock.settimeout(hold / 2 if hold else 0.1)
+        self.address = self.sock.getsockname()
+        self.counts = {'datagrams': 0, 'fixes': 0, 'malformed': 0}
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while self.running:
+            try:
+                datagram, _ = self.sock.recvfrom(MAX_DATAGRAM)
+            except socket.timeout:
+                datagram = None
+            except OSError:
+                if not self.running:
+                    return
+                raise
+            now = time.time()
+            released = []
+            if datagram is not None:
+                self.counts['datagrams'] += 1
+                try:
+                    packets = decode_datagram(datagram)
+                except PacketError:
+                    self.counts['malformed'] += 1  # not a whole number of packets
+                    packets = []
+                for packet, error in packets:
+                    if error is not None:
+                        self.counts['malformed'] += 1  # the other packets of the datagram are still used
+                        continue
+                    seq, item = packet
+                    released.extend(self.reorderer.push(item['device_id'], seq, item, now))
+            released.extend(self.reorderer.expire(now))
+            if released:
+                self.counts['fixes'] += len(released)
+                try:
+                    self.deliver(released, now)
+                except Exception as e:
+                    log_event(log, logging.ERROR, 'udp_delivery_failed', f"❌ UDP fix delivery failed: {e}",
+                              fixes=len(released), error=str(e))
+
+    def stats(self):
+        return dict(self.counts, **self.reorderer.counts, pending=self.reorderer.pending(),
+                    port=self.address[1])
+
+    def close(self):
+        self.running = False
+        self.sock.close()
+        self.thread.join(timeout=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Binary UDP fix protocol tools")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    send_parser = subparsers.add_parser('send', help="Send one fix packet")
+    send_parser.add_argument('--host', default='127.0.0.1')
+    send_parser.add_argument('--port', type=int, default=5001)
+    send_parser.add_argument('--device', default='default')
+    send_parser.add_argument('--seq', type=int, required=True)
+    send_parser.add_argument('--lat', type=float, required=True)
+    send_parser.add_argument('--lon', type=float, required=True)
+    send_parser.add_argument('--accuracy', type=float)
+    args = parser.parse_args()
+
+    packet = encode_fix(args.device, args.seq, args.lat, args.lon, time.time(), args.accuracy)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.sendto(packet, (args.host, args.port))
+    print(f"📡 Sent {len(packet)}-byte fix #{args.seq} for {args.device} to {args.host}:{args.port}")
@@ -0,0 +1,88 @@
+# ============================================================================
+# FILE 27: viewer_state.py (Last viewport + basemap snapshot for a fast start)
+# ============================================================================
+#
+# On exit the viewer writes where it was looking (position, zoom, map type,
+# source) and the basemap it was showing as a PNG next to the state file,
+# together with the BasemapView geometry of that image. On the next start
+# the PNG is loaded straight into a Tk PhotoImage (Tk decodes PNG itself,
+# so neither Pillow nor requests has to be imported) and becomes the cached
+# basemap: the first frame paints at once, and nothing is fetched until the
+# rover leaves the snapshot or the settings differ from it.
+# Both files are replaced atomically; a missing or unreadable state file
+# just means a normal (slower) start.
+
+import json
+import os
+
+from map_overlay import BasemapView
+
+DEFAULT_STATE_FILE = 'viewer_state.json'
+STATE_VERSION = 1
+
+
+def snapshot_path(state_file):
+    """Where the basemap snapshot of a state file is kept"""
+    return os.path.splitext(state_file)[0] + '.png'
+
+
+def load_state(state_file):
+    """The saved state dict, or None if there is none (or it is unusable)"""
+    try:
+        with open(state_file, 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(state, dict) or state.get('version') != STATE_VERSION:
+        return None
+    snapshot = state.get('snapshot')
+    if snapshot is not None and not os.path.exists(snapshot_path(state_file)):
+        state['snapshot'] = None
+    return state
+
+
+def snapshot_info(view, key, viewport):
+    """Snapshot entry of the state: the basemap's view geometry, key and requested viewport size"""
+    return {
+        'origin_x': float(view.origin_x),
+        'origin_y': float(view.origin_y),
+        'zoom': int(view.zoom),
+        'width': int(view.width),
+        'height': int(view.height),
+        'pixel_ratio': float(view.pixel_ratio),
+        'key': list(key),
+        'viewport': [int(size) for size in viewport]
+    }
+
+
+def save_state(state_file, latitude, longitude, zoom, map_type, map_source, snapshot=None, image=None):
+    """
+    Write the viewport and the snapshot entry. `image` (a Pillow image) is
+    written as the new snapshot PNG; without it an existing PNG is kept
+    (the snapshot restored at startup is still the one on screen).
+    """
+    if snapshot is not None and image is not None:
+        path = snapshot_path(state_file)
+        temp_path = path + '.tmp'
+        # Fast zlib level: this runs while the window closes
+        image.save(temp_path, format='PNG', compress_level=1)
+        os.replace(temp_path, path)
+    state = {
+        'version': STATE_VERSION,
+        'latitude': latitude,
+        'longitude': longitude,
+        'zoom': zoom,
+        'map_type': map_type,
+        'map_source': map_source,
+        'snapshot': snapshot
+    }
+    temp_file = state_file + '.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump(state, f)
+    os.replace(temp_file, state_file)
+
+
+def snapshot_view(snapshot):
+    """BasemapView of a saved snapshot"""
+    return BasemapView(snapshot['origin_x'], snapshot['origin_y'], snapshot['zoom'],
+                       snapshot['width'], snapshot['height'], snapshot['pixel_ratio'])
@@ -0,0 +1,49 @@
+# ============================================================================
+# FILE 7: web_mercator.py (Web Mercator projection helpers)
+# ============================================================================
+#
+# "World pixels" are pixel coordinates on the full map at a given zoom level:
+# the world is TILE_SIZE * 2**zoom pixels wide, (0, 0) is the north-west
+# corner. All functions accept scalars or NumPy arrays.
+
+import numpy as np
+
+TILE_SIZE = 256
+MAX_LATITUDE = 85.05112878
+EARTH_CIRCUMFERENCE = 40075016.686  # metres at the equator
+
+
+def world_size(zoom):
+    """Width (and height) of the world in pixels at a zoom level"""
+    return TILE_SIZE * (2 ** zoom)
+
+
+def latlon_to_world(lat, lon, zoom):
+    """Latitude/longitude in degrees -> world pixel (x, y)"""
+    lat = np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE)
+    size = world_size(zoom)
+    x = (np.asarray(lon) + 180.0) / 360.0 * size
+    sin_lat = np.sin(np.radians(lat))
+    y = (0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)) * size
+    return x, y
+
+
+def world_to_latlon(x, y, zoom):
+    """World pixel (x, y) -> latitude/longitude in degrees"""
+    size = world_size(zoom)
+    lon = np.asarray(x) / size * 360.0 - 180.0
+    n = np.pi - 2 * np.pi * np.asarray(y) / size
+    lat = np.degrees(np.arctan(np.sinh(n)))
+    return lat, lon
+
+
+def latlon_to_tile(lat, lon, zoom):
+    """Tile (x, y) containing a latitude/longitude"""
+    x, y = latlon_to_world(lat, lon, zoom)
+    last = 2 ** zoom - 1
+    return int(min(max(x // TILE_SIZE, 0), last)), int(min(max(y // TILE_SIZE, 0), last))
+
+
+def meters_per_pixel(lat, zoom):
+    """Ground resolution in metres per world pixel at a latitude"""
+    return EARTH_CIRCUMFERENCE * np.cos(np.radians(lat)) / world_size(zoom)
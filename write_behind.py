@@ -0,0 +1,115 @@
+# ============================================================================
+# FILE 13: write_behind.py (Asynchronous write-behind queue with group commit)
+# ============================================================================
+#
+# Request handlers only append accepted fixes to an in-memory queue and
+# return. A single background writer drains the queue and commits everything
+# that arrived in the last `flush_interval` seconds (or `max_batch` fixes,
+# whichever comes first) with one call to the sink, so the disk sees a few
+# large writes instead of one small write per request. close() drains the
+# queue before returning, so nothing accepted is lost on a clean shutdown.
+
+import threading
+import time
+from collections import deque
+
+
+class WriteBehindQueue:
+    """Buffers fixes in memory and group-commits them from a writer thread"""
+
+    def __init__(self, sink, flush_interval=0.05, max_batch=5000, max_pending=1000000,
+                 on_commit=None, on_error=None):
+        self.sink = sink                    # sink(fixes): persists a list of fixes
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending      # beyond this, new fixes are dropped (and counted)
+        self.on_commit = on_commit          # on_commit(fixes, seconds) after each group commit
+        self.on_error = on_error            # on_error(fixes, exception) if the sink raised
+        self.pending = deque()              # (enqueued_at, fix)
+        self.condition = threading.Condition()
+        self.submitted = 0
+        self.committed = 0
+        self.dropped = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self.thread.start()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def submit(self, fixes):
+        """Queue fixes for persistence; never blocks on I/O. Returns how many were queued"""
+        now = time.monotonic()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("write-behind queue is closed")
+            room = max(self.max_pending - len(self.pending), 0)
+            accepted = fixes[:room]
+            self.dropped += len(fixes) - len(accepted)
+            self.pending.extend((now, fix) for fix in accepted)
+            self.submitted += len(accepted)
+            self.condition.notify_all()
+        return len(accepted)
+
+    def _take_batch(self):
+        """Wait for the first fix, then give the batch up to flush_interval to fill up"""
+        with self.condition:
+            while not self.pending and not self.closed:
+                self.condition.wait()
+            if not self.pending:
+                return None
+            deadline = self.pending[0][0] + self.flush_interval
+            while len(self.pending) < self.max_batch and not self.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            count = min(len(self.pending), self.max_batch)
+            return [self.pending.popleft()[1] for _ in range(count)]
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            started = time.perf_counter()
+            try:
+                self.sink(batch)
+            except Exception as e:
+                if self.on_error:
+                    self.on_error(batch, e)
+            else:
+                if self.on_commit:
+                    self.on_commit(batch, time.perf_counter() - started)
+            with self.condition:
+                self.committed += len(batch)
+                self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        """Block until everything submitted so far has been handed to the sink"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            target = self.submitted
+            self.condition.notify_all()
+            while self.committed < target:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def close(self, timeout=30):
+        """Stop accepting fixes, drain the queue and stop the writer"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+    def stats(self):
+        return {
+            'pending': len(self.pending),
+            'submitted': self.submitted,
+            'committed': self.committed,
+            'dropped': self.dropped,
+        }